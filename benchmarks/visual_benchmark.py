@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2023 Telefónica Investigación y Desarrollo, S.A.U.
+This file is part of Toolium.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Benchmark of visual testing operations with synthetic screenshots, without opening any browser.
+
+Usage: python benchmarks/visual_benchmark.py [options]
+"""
+
+import argparse
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageDraw
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from toolium.visual_compare import get_visual_test  # noqa: E402
+from toolium.visual_test import VisualTest  # noqa: E402
+
+DEFAULT_SIZES = '800x600,1920x1080,1280x8000'
+DIFFERENCE_PATTERNS = ('equal', 'block', 'noise')
+IMAGE_OPERATIONS = ('remove_scrolls', 'base_resize', 'exclude_elements', 'crop_element')
+SCROLL_SIZE = 17  # size of chrome scrolls removed from synthetic screenshots
+
+
+class SyntheticDriver(object):
+    """Driver replacement that answers the calls made by visual testing operations, without any browser"""
+
+    def __init__(self, window_size):
+        self.window_size = window_size
+        self.desired_capabilities = {'platformName': 'Linux'}
+
+    def get_window_size(self):
+        return self.window_size
+
+    def execute_script(self, script, *args):
+        return 0
+
+
+class SyntheticElement(object):
+    """WebElement replacement with a fixed location and size"""
+
+    def __init__(self, x, y, width, height):
+        self.location = {'x': x, 'y': y}
+        self.size = {'width': width, 'height': height}
+
+
+def create_screenshot(width, height, seed=0):
+    """Create a synthetic screenshot that looks like a web page, with text lines, boxes and images
+
+    :param width: image width
+    :param height: image height
+    :param seed: random seed, the same seed always generates the same image
+    :returns: RGB image object
+    """
+    rand = random.Random(seed)
+    img = Image.new('RGB', (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    top = 10
+    while top < height:
+        block_height = rand.randint(20, 120)
+        if rand.random() < 0.3:
+            # Image or colored box
+            color = tuple(rand.randint(0, 255) for _ in range(3))
+            draw.rectangle((20, top, rand.randint(40, max(width - 20, 41)), top + block_height), fill=color)
+        else:
+            # Text lines
+            for line_top in range(top, top + block_height, 16):
+                draw.text((20, line_top), ''.join(rand.choice('abcdefghij klmnopq') for _ in range(width // 8)),
+                          fill=(40, 40, 40))
+        top += block_height + 10
+    return img
+
+
+def apply_difference(img, pattern, seed=1):
+    """Create a copy of an image with a controlled difference pattern
+
+    :param img: RGB image object
+    :param pattern: equal (no differences), block (a changed rectangle) or noise (isolated changed pixels, 0.1%)
+    :param seed: random seed
+    :returns: modified RGB image object
+    """
+    img = img.copy()
+    rand = random.Random(seed)
+    if pattern == 'block':
+        x, y = img.width // 3, img.height // 3
+        ImageDraw.Draw(img).rectangle((x, y, x + min(200, img.width // 4), y + min(50, img.height // 4)),
+                                      fill=(255, 0, 255))
+    elif pattern == 'noise':
+        pixels = img.load()
+        for _ in range(img.width * img.height // 1000):
+            x, y = rand.randrange(img.width), rand.randrange(img.height)
+            pixels[x, y] = tuple(255 - channel for channel in pixels[x, y])
+    elif pattern != 'equal':
+        raise ValueError(f"Unknown difference pattern '{pattern}', valid values are: "
+                         f"{', '.join(DIFFERENCE_PATTERNS)}")
+    return img
+
+
+def create_elements(width, height, count, seed=2):
+    """Create synthetic elements inside the image
+
+    :param width: image width
+    :param height: image height
+    :param count: number of elements
+    :param seed: random seed
+    :returns: list of synthetic elements
+    """
+    rand = random.Random(seed)
+    elements = []
+    for _ in range(count):
+        element_width, element_height = rand.randint(10, max(width // 4, 11)), rand.randint(10, max(height // 8, 11))
+        elements.append(SyntheticElement(rand.randrange(max(width - element_width, 1)),
+                                         rand.randrange(max(height - element_height, 1)), element_width,
+                                         element_height))
+    return elements
+
+
+def reset_max_rss():
+    """Reset the maximum resident set size of the process to its current resident set size, only available in Linux
+
+    :returns: True if it has been reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def get_rss(name):
+    """Get a resident set size of the process, that includes pil image buffers not traced by tracemalloc
+
+    :param name: VmRSS to get the current size or VmHWM to get the maximum size until now (or until it was reset)
+    :returns: resident set size in MB or None if it is not available in this platform
+    """
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) / 1024 for line in f if line.startswith(name + ':'))
+    except (OSError, StopIteration):
+        pass
+    if resource is None:
+        return None
+    # Current size is not available without /proc, so the maximum size is returned in any case
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux returns kilobytes and macOS returns bytes
+    return max_rss / 1024 ** 2 if sys.platform == 'darwin' else max_rss / 1024
+
+
+def measure(operation, repeat):
+    """Execute an operation several times measuring its duration and how much its memory peak exceeds the resident set
+    size of the process before executing it. In platforms where the maximum resident set size can not be reset, the
+    growth is only measured if the operation exceeds the previous maximum size of the process
+
+    :param operation: function without arguments
+    :param repeat: number of executions
+    :returns: dict with best and mean durations in seconds and resident set size growth in MB
+    """
+    durations = []
+    gc.collect()
+    rss = get_rss('VmRSS') if reset_max_rss() else get_rss('VmHWM')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        operation()
+        durations.append(time.perf_counter() - start)
+    rss_growth = max(get_rss('VmHWM') - rss, 0) if rss is not None else None
+    return {'best': min(durations), 'mean': statistics.mean(durations), 'rss_growth_mb': rss_growth}
+
+
+def get_operation_names(patterns):
+    """Get names of the visual testing operations to be measured
+
+    :param patterns: difference patterns to be compared
+    :returns: list of operation names
+    """
+    return list(IMAGE_OPERATIONS) + [f'compare_files[{pattern}]' for pattern in patterns] + ['render_report']
+
+
+def get_visual_test_operations(visual, img, baseline_path, elements, patterns):
+    """Get visual testing operations to be measured with an image
+
+    :param visual: visual testing object
+    :param img: synthetic screenshot with browser scrolls
+    :param baseline_path: baseline image file path
+    :param elements: synthetic elements to be excluded
+    :param patterns: difference patterns to be compared
+    :returns: dict with operation names and functions
+    """
+    width, height = img.width - SCROLL_SIZE, img.height - SCROLL_SIZE
+    counter = {'number': 0}
+
+    def compare(pattern_img):
+        counter['number'] += 1
+        image_path = os.path.join(visual.output_directory, f'{counter["number"]:02d}_benchmark.png')
+        visual.compare_files('benchmark', image_path, baseline_path, 0, pattern_img)
+
+    operations = {
+        'remove_scrolls': lambda: visual.remove_scrolls(img),
+        'base_resize': lambda: visual.base_resize(img),
+        'exclude_elements': lambda: visual.exclude_elements(img, elements),
+        'crop_element': lambda: visual.crop_element(img, SyntheticElement(10, 10, width // 2, height // 2)),
+    }
+    baseline = Image.open(baseline_path).convert('RGB')
+    for pattern in patterns:
+        pattern_img = apply_difference(baseline, pattern)
+        operations[f'compare_files[{pattern}]'] = lambda pattern_img=pattern_img: compare(pattern_img)
+    operations['render_report'] = lambda: VisualTest.render_report(visual.output_directory)
+    return operations
+
+
+def measure_operation(size, name, patterns, exclusions, repeat, engine, comparison_mode, work_directory):
+    """Measure a visual testing operation with the synthetic screenshot of a size, saved by run_benchmark. It is
+    executed in a new process, so that its resident set size growth is not hidden by memory of previous operations
+
+    :param size: tuple with image width and height
+    :param name: operation name
+    :param patterns: difference patterns compared with the baseline
+    :param exclusions: number of excluded elements
+    :param repeat: number of executions of the operation
+    :param engine: engine used to calculate differences (numpy or pil)
+    :param comparison_mode: comparison mode (pixel, tolerance, isolated or ssim)
+    :param work_directory: folder where baselines and visual reports are saved
+    :returns: dict with best and mean durations in seconds and growth of the maximum resident set size in MB
+    """
+    # Failed comparisons are expected, their warnings are not shown
+    logging.getLogger('toolium').setLevel(logging.ERROR)
+    width, height = size
+    size_name = f'{width}x{height}'
+    baseline_directory = os.path.join(work_directory, 'baseline', size_name)
+    visual = get_visual_test(os.path.join(work_directory, 'report', size_name), baseline_directory, True, engine,
+                             'directory', comparison_mode)
+    visual.driver_wrapper.config.add_section('Driver')
+    visual.driver_wrapper.config.set('Driver', 'type', 'chrome')
+    visual.driver_wrapper.driver = SyntheticDriver({'width': width // 2, 'height': height // 2})
+    # Page geometry with visible scrolls, as it is calculated in a visual assert
+    visual.geometry = {'scrollHeight': height * 2, 'scrollWidth': width * 2, 'innerHeight': height,
+                       'innerWidth': width, 'boxes': {}}
+
+    with Image.open(os.path.join(work_directory, f'screenshot_{size_name}.png')) as img:
+        img = img.convert('RGB')
+    elements = create_elements(width, height, exclusions)
+    # Only the difference pattern of the measured operation is created
+    patterns = [pattern for pattern in patterns if name == f'compare_files[{pattern}]']
+    operation = get_visual_test_operations(visual, img, os.path.join(baseline_directory, 'benchmark.png'), elements,
+                                           patterns)[name]
+    return measure(operation, repeat)
+
+
+def run_benchmark(sizes, patterns, exclusions, repeat, engine, comparison_mode, work_directory):
+    """Measure visual testing operations with synthetic screenshots of several sizes, each operation in a new process
+
+    :param sizes: list of tuples with image width and height
+    :param patterns: difference patterns compared with the baseline
+    :param exclusions: number of excluded elements
+    :param repeat: number of executions of each operation
+    :param engine: engine used to calculate differences (numpy or pil)
+    :param comparison_mode: comparison mode (pixel, tolerance, isolated or ssim)
+    :param work_directory: folder where baselines and visual reports are saved
+    :returns: list of dicts with size, operation, durations, throughput and resident set size growth
+    """
+    results = []
+    for width, height in sizes:
+        size_name = f'{width}x{height}'
+        baseline_directory = os.path.join(work_directory, 'baseline', size_name)
+        os.makedirs(baseline_directory, exist_ok=True)
+        screenshot = create_screenshot(width, height)
+        screenshot.save(os.path.join(baseline_directory, 'benchmark.png'))
+        img = Image.new('RGB', (width + SCROLL_SIZE, height + SCROLL_SIZE), (200, 200, 200))
+        img.paste(screenshot)
+        img.save(os.path.join(work_directory, f'screenshot_{size_name}.png'))
+
+        for name in get_operation_names(patterns):
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                measurement = executor.submit(measure_operation, (width, height), name, patterns, exclusions, repeat,
+                                              engine, comparison_mode, work_directory).result()
+            measurement.update({'size': size_name, 'operation': name,
+                                'mpixels_per_second': width * height / 1e6 / measurement['best']})
+            results.append(measurement)
+    return results
+
+
+def get_regressions(results, previous_results, max_regression):
+    """Find operations that are slower than in a previous benchmark execution
+
+    :param results: current benchmark results
+    :param previous_results: previous benchmark results
+    :param max_regression: maximum allowed increase of the best duration, e.g. 0.2 is 20%
+    :returns: list of tuples with size, operation, previous and current best durations
+    """
+    previous = {(result['size'], result['operation']): result['best'] for result in previous_results}
+    return [(result['size'], result['operation'], previous[(result['size'], result['operation'])], result['best'])
+            for result in results if (result['size'], result['operation']) in previous and
+            result['best'] > previous[(result['size'], result['operation'])] * (1 + max_regression)]
+
+
+def print_results(results):
+    """Print benchmark results as a table
+
+    :param results: benchmark results
+    """
+    print(f'{"size":<12}{"operation":<26}{"best ms":>10}{"mean ms":>10}{"Mpx/s":>10}{"+RSS MB":>10}')
+    for result in results:
+        rss_growth = f'{result["rss_growth_mb"]:>10.1f}' if result['rss_growth_mb'] is not None else f'{"-":>10}'
+        print(f'{result["size"]:<12}{result["operation"]:<26}{result["best"] * 1000:>10.2f}'
+              f'{result["mean"] * 1000:>10.2f}{result["mpixels_per_second"]:>10.1f}{rss_growth}')
+
+
+def parse_sizes(sizes):
+    """Parse a comma separated list of image sizes
+
+    :param sizes: str with sizes, e.g. 800x600,1920x1080
+    :returns: list of tuples with width and height
+    """
+    try:
+        return [tuple(int(value) for value in size.lower().split('x')) for size in sizes.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid sizes '{sizes}', expected format is WIDTHxHEIGHT,WIDTHxHEIGHT")
+
+
+def main(args=None):
+    """Run the visual testing benchmark from command line
+
+    :param args: command line arguments, by default sys.argv
+    :returns: exit code, 1 if any operation is slower than in the previous results file
+    """
+    parser = argparse.ArgumentParser(prog='python benchmarks/visual_benchmark.py',
+                                     description='Measure visual testing operations with synthetic screenshots')
+    parser.add_argument('-s', '--sizes', type=parse_sizes, default=parse_sizes(DEFAULT_SIZES),
+                        help=f'comma separated image sizes (default: {DEFAULT_SIZES})')
+    parser.add_argument('-p', '--patterns', default=','.join(DIFFERENCE_PATTERNS),
+                        help='comma separated difference patterns: equal, block or noise (default: all)')
+    parser.add_argument('-x', '--exclusions', type=int, default=10,
+                        help='number of excluded elements (default: 10)')
+    parser.add_argument('-n', '--repeat', type=int, default=5, help='executions of each operation (default: 5)')
+    parser.add_argument('-e', '--diff-engine', choices=['numpy', 'pil'], default='numpy',
+                        help='engine used to calculate differences (default: numpy)')
+    parser.add_argument('-m', '--comparison-mode', choices=VisualTest.comparison_modes, default='pixel',
+                        help='comparison mode (default: pixel)')
+    parser.add_argument('-o', '--output', help='json file where results are saved')
+    parser.add_argument('-b', '--baseline', help='json file with previous results to detect regressions')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='maximum allowed increase of best durations compared with baseline results '
+                             '(default: 0.2)')
+    parsed_args = parser.parse_args(args)
+
+    patterns = [pattern for pattern in parsed_args.patterns.split(',') if pattern]
+    work_directory = tempfile.mkdtemp(prefix='visual_benchmark_')
+    try:
+        results = run_benchmark(parsed_args.sizes, patterns, parsed_args.exclusions, parsed_args.repeat,
+                                parsed_args.diff_engine, parsed_args.comparison_mode, work_directory)
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+    print_results(results)
+
+    if parsed_args.output:
+        with open(parsed_args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if parsed_args.baseline:
+        with open(parsed_args.baseline) as f:
+            regressions = get_regressions(results, json.load(f), parsed_args.max_regression)
+        for size, operation, previous_best, best in regressions:
+            print(f'Regression in {operation} with {size} images: {previous_best * 1000:.2f} ms -> '
+                  f'{best * 1000:.2f} ms')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
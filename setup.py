@@ -49,6 +49,8 @@ setup(
     setup_requires=['pytest-runner'],
     tests_require=read_file('requirements_dev.txt').splitlines(),
     test_suite='toolium.test',
+    entry_points={'console_scripts': ['toolium-visual-compare=toolium.visual_compare:main',
+                                      'toolium-baselines=toolium.utils.baseline_store:main']},
     author='Rubén González Alonso, Telefónica I+D',
     author_email='ruben.gonzalezalonso@telefonica.com',
     url='https://github.com/telefonica/toolium',
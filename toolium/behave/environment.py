@@ -190,20 +190,29 @@ def add_assert_screenshot_methods(context, scenario):
     file_suffix = scenario.name
 
     def assert_screenshot(element_or_selector, filename, threshold=0, exclude_elements=[], driver_wrapper=None,
-                          force=False):
+                          force=False, comparison_mode=None):
         VisualTest(driver_wrapper, force).assert_screenshot(element_or_selector, filename, file_suffix, threshold,
-                                                            exclude_elements)
+                                                            exclude_elements, comparison_mode)
 
-    def assert_full_screenshot(filename, threshold=0, exclude_elements=[], driver_wrapper=None, force=False):
-        VisualTest(driver_wrapper, force).assert_screenshot(None, filename, file_suffix, threshold, exclude_elements)
+    def assert_full_screenshot(filename, threshold=0, exclude_elements=[], driver_wrapper=None, force=False,
+                               comparison_mode=None):
+        VisualTest(driver_wrapper, force).assert_screenshot(None, filename, file_suffix, threshold, exclude_elements,
+                                                            comparison_mode)
+
+    def assert_full_page_screenshot(filename, threshold=0, exclude_elements=[], driver_wrapper=None, force=False,
+                                    comparison_mode=None):
+        VisualTest(driver_wrapper, force).assert_screenshot(None, filename, file_suffix, threshold, exclude_elements,
+                                                            comparison_mode, full_page=True)
 
     # Monkey patching assert_screenshot method in PageElement to use the correct test name
-    def assert_screenshot_page_element(self, filename, threshold=0, exclude_elements=[], force=False):
+    def assert_screenshot_page_element(self, filename, threshold=0, exclude_elements=[], force=False,
+                                       comparison_mode=None):
         VisualTest(self.driver_wrapper, force).assert_screenshot(self.web_element, filename, file_suffix, threshold,
-                                                                 exclude_elements)
+                                                                 exclude_elements, comparison_mode)
 
     context.assert_screenshot = assert_screenshot
     context.assert_full_screenshot = assert_full_screenshot
+    context.assert_full_page_screenshot = assert_full_page_screenshot
     PageElement.assert_screenshot = assert_screenshot_page_element
 
 
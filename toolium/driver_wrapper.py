@@ -18,6 +18,8 @@ limitations under the License.
 
 import logging.config
 import os
+import time
+from contextlib import contextmanager
 
 import screeninfo
 
@@ -54,6 +56,8 @@ class DriverWrapper(object):
     remote_node = None  #: remote grid node
     remote_node_video_enabled = False  #: True if the remote grid node has the video recorder enabled
     logger = None  #: logger instance
+    #: javascript code to clear local and session storage of the current page, that fails in blank pages
+    clear_storage_script = 'try { window.localStorage.clear(); window.sessionStorage.clear(); } catch (e) {}'
 
     # Configuration and output files
     config_properties_filenames = None  #: configuration filenames separated by commas
@@ -206,44 +210,68 @@ class DriverWrapper(object):
             DriverWrappersPool.configure_visual_directories(driver_info)
             self.configure_visual_baseline()
 
-    def connect(self):
+    def connect(self, driver=None):
         """Set up the selenium driver and connect to the server
 
+        :param driver: driver already created in background, or None to create a new driver
         :returns: selenium driver
         """
         if not self.config.get('Driver', 'type') or self.config.get('Driver', 'type') in ['api', 'no_driver']:
             return None
 
-        self.driver = ConfigDriver(self.config, self.utils).create_driver()
+        start_time = time.perf_counter()
+        with self.connect_phase('create_driver'):
+            self.driver = driver if driver else ConfigDriver(self.config, self.utils).create_driver()
+            self.session_id = self.driver.session_id
 
-        # Save session id and remote node to download video after the test execution
-        self.session_id = self.driver.session_id
-        self.server_type, self.remote_node = self.utils.get_remote_node()
-        self.remote_node_video_enabled = self.utils.is_remote_video_enabled(self.server_type, self.remote_node)
+        # Save remote node to download video after the test execution
+        with self.connect_phase('get_remote_node'):
+            self.server_type, self.remote_node = self.utils.get_remote_node()
+        with self.connect_phase('is_remote_video_enabled'):
+            self.remote_node_video_enabled = self.utils.is_remote_video_enabled(self.server_type, self.remote_node)
 
         # Save app_strings in mobile tests
         if (self.is_mobile_test() and not self.is_web_test()
                 and self.config.getboolean_optional('Driver', 'appium_app_strings')):
-            self.app_strings = self.driver.app_strings()
+            with self.connect_phase('app_strings'):
+                self.app_strings = self.driver.app_strings()
 
         # Resize and move browser
-        self.resize_window()
+        with self.connect_phase('resize_window'):
+            self.resize_window()
 
         # Log window size
-        window_size = self.utils.get_window_size()
+        with self.connect_phase('get_window_size'):
+            window_size = self.utils.get_window_size()
         self.logger.debug('Window size: %s x %s', window_size['width'], window_size['height'])
 
         # Update baseline
-        self.update_visual_baseline()
+        with self.connect_phase('update_visual_baseline'):
+            self.update_visual_baseline()
 
         # Discard previous logcat logs
-        self.utils.discard_logcat_logs()
+        with self.connect_phase('discard_logcat_logs'):
+            self.utils.discard_logcat_logs()
 
         # Set implicitly wait timeout
-        self.utils.set_implicitly_wait()
+        with self.connect_phase('set_implicitly_wait'):
+            self.utils.set_implicitly_wait()
 
+        DriverWrappersPool.add_connect_timing(self, 'connect', time.perf_counter() - start_time)
         return self.driver
 
+    @contextmanager
+    def connect_phase(self, phase):
+        """Measure the duration of a driver connection phase, that is saved in the log and in the timings file
+
+        :param phase: connection phase name
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            DriverWrappersPool.add_connect_timing(self, phase, time.perf_counter() - start_time)
+
     def resize_window(self):
         """Resize and move browser window"""
         if self.is_maximizable():
@@ -345,15 +373,58 @@ class DriverWrapper(object):
         :returns: True if the driver should be reused
         """
         reuse_driver = self.config.getboolean_optional('Driver', 'reuse_driver')
-        reuse_driver_session = self.config.getboolean_optional('Driver', 'reuse_driver_session')
+        reset_driver_state = self.config.getboolean_optional('Driver', 'reset_driver_state')
+        reuse_driver_session = self.config.getboolean_optional('Driver', 'reuse_driver_session') or reset_driver_state
+        # Driver whose state is reset is always restarted after a failure
         restart_driver_after_failure = (self.config.getboolean_optional('Driver', 'restart_driver_after_failure') or
-                                        self.config.getboolean_optional('Driver', 'restart_driver_fail'))
+                                        self.config.getboolean_optional('Driver', 'restart_driver_fail') or
+                                        reset_driver_state)
         if context and scope == 'function':
             reuse_driver = reuse_driver or (hasattr(context, 'reuse_driver_from_tags')
                                             and context.reuse_driver_from_tags)
         return (((reuse_driver and scope == 'function') or (reuse_driver_session and scope != 'session'))
                 and (test_passed or not restart_driver_after_failure))
 
+    def should_reset_driver(self, scope, context=None):
+        """Check if the driver state should be reset before reusing the driver in the next test
+
+        :param scope: execution scope (function, module, class or session)
+        :param context: behave context
+        :returns: True if the driver state should be reset
+        """
+        if not self.config.getboolean_optional('Driver', 'reset_driver_state'):
+            return False
+        # Scenarios of a feature with reuse_driver tag share the driver state
+        return not (context and scope == 'function' and hasattr(context, 'reuse_driver_from_tags')
+                    and context.reuse_driver_from_tags)
+
+    def reset_driver(self):
+        """Reset the driver state to reuse the driver in the next test. In web tests, extra windows are closed, cookies
+        and storage are cleared and the browser navigates to a blank page. In mobile app tests, native context is
+        restored.
+
+        :returns: True if the driver state has been reset, False if the driver must be restarted
+        """
+        if not self.driver:
+            return True
+        try:
+            if self.is_mobile_test() and not self.is_web_test():
+                self.driver.switch_to.context('NATIVE_APP')
+            else:
+                window_handles = self.driver.window_handles
+                for window_handle in window_handles[1:]:
+                    self.driver.switch_to.window(window_handle)
+                    self.driver.close()
+                self.driver.switch_to.window(window_handles[0])
+                self.driver.delete_all_cookies()
+                self.driver.execute_script(self.clear_storage_script)
+                self.driver.get('about:blank')
+        except Exception as exc:
+            self.logger.warning('Error resetting driver state, driver will be restarted: %s' % exc)
+            return False
+        self.logger.debug('Driver state has been reset')
+        return True
+
     def get_driver_platform(self):
         """
         Get driver platform where tests are running
@@ -16,13 +16,21 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import atexit
+import copy
 import inspect
+import json
+import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
 
 import datetime
 
 from toolium.config_files import ConfigFiles
-from toolium.utils.path_utils import get_valid_filename, makedirs_safe
+from toolium.utils.path_utils import get_valid_filename, increment_counter_file, makedirs_safe
 from toolium.selenoid import Selenoid
 
 
@@ -41,6 +49,12 @@ class DriverWrappersPool(object):
     :type visual_baseline_directory: str
     :type visual_output_directory: str
     :type visual_number: int
+    :type artifacts_executor: concurrent.futures.ThreadPoolExecutor
+    :type pending_artifacts: list of tuple
+    :type artifacts_errors: dict
+    :type prewarm_executor: concurrent.futures.ThreadPoolExecutor
+    :type prewarmed_driver: tuple
+    :type connect_timings: dict
     """
     driver_wrappers = []  #: driver wrappers list
 
@@ -61,6 +75,25 @@ class DriverWrappersPool(object):
     visual_baseline_directory = None  #: folder to save visual baseline images
     visual_output_directory = None  #: folder to save visual report and images
     visual_number = None  #: number of videos recorded until now
+    visual_number_lock = threading.Lock()  #: lock to get unique visual numbers from several threads
+    visual_number_name = '.visual_number'  #: counter file shared by processes that save visual images in the same folder
+    numbers_lock = threading.Lock()  #: lock to get unique screenshots and videos numbers from several threads
+    execution_date_variable = 'TOOLIUM_EXECUTION_DATE'  #: env variable with the date used to name output folders
+
+    # Teardown configuration
+    teardown_workers = 4  #: maximum number of threads used to close driver wrappers in parallel
+    artifacts_executor = None  #: thread pool to collect videos and GGR logs in background
+    pending_artifacts = []  #: list of tuples with test name, artifact name and future of background collections
+    artifacts_errors = {}  #: dict with the list of artifacts collection errors of each test name
+
+    # Driver pre-warm configuration
+    prewarm_executor = None  #: thread to create the driver of the next test in background
+    prewarmed_driver = None  #: tuple with the config used to create the next driver and its future
+
+    # Driver connection timings
+    connect_timings = {}  #: dict with the list of durations of each driver connection phase in this session
+    connect_timings_lock = threading.Lock()  #: lock to save connection timings from several threads
+    connect_timings_name = 'connect_timings.jsonl'  #: file in logs folder with driver connection timings
 
     @classmethod
     def is_empty(cls):
@@ -97,18 +130,18 @@ class DriverWrappersPool(object):
 
         :param name: screenshot name suffix
         """
+        from toolium.jira import add_attachment
         screenshot_name = '{}_driver{}' if len(cls.driver_wrappers) > 1 else '{}'
-        driver_index = 1
-        for driver_wrapper in cls.driver_wrappers:
-            if not driver_wrapper.driver:
-                continue
-            from toolium.jira import add_attachment
+
+        def capture_screenshot(driver_wrapper, driver_index):
             try:
                 add_attachment(driver_wrapper.utils.capture_screenshot(screenshot_name.format(name, driver_index)))
             except Exception:
                 # Capture exceptions to avoid errors in teardown method due to session timeouts
                 pass
-            driver_index += 1
+
+        driver_wrappers = [driver_wrapper for driver_wrapper in cls.driver_wrappers if driver_wrapper.driver]
+        cls._run_in_driver_wrappers(capture_screenshot, driver_wrappers)
 
     @classmethod
     def connect_default_driver_wrapper(cls, config_files=None):
@@ -122,18 +155,117 @@ class DriverWrappersPool(object):
         if not driver_wrapper.driver:
             config_files = DriverWrappersPool.initialize_config_files(config_files)
             driver_wrapper.configure(config_files)
-            driver_wrapper.connect()
+            prewarmed_driver = cls.get_prewarmed_driver(driver_wrapper)
+            if prewarmed_driver:
+                driver_wrapper.connect(prewarmed_driver)
+            else:
+                driver_wrapper.connect()
+            cls.prewarm_driver(driver_wrapper)
         return driver_wrapper
 
+    @classmethod
+    def prewarm_driver(cls, driver_wrapper):
+        """Start creating the driver of the next test in background, if prewarm_driver property is enabled and the
+        driver is not reused between tests
+
+        :param driver_wrapper: default driver wrapper, whose config is used to create the next driver
+        """
+        from toolium.config_driver import ConfigDriver
+        from toolium.utils.driver_utils import Utils
+        config = driver_wrapper.config
+        if (not driver_wrapper.driver or not config.getboolean_optional('Driver', 'prewarm_driver')
+                or config.getboolean_optional('Driver', 'reuse_driver')
+                or config.getboolean_optional('Driver', 'reuse_driver_session')
+                or config.getboolean_optional('Driver', 'reset_driver_state')):
+            return
+        if cls.prewarm_executor is None:
+            cls.prewarm_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prewarm_driver')
+            # Unittest executions have no session scope, so the unused driver is also stopped at exit
+            atexit.register(cls.discard_prewarmed_driver)
+        prewarm_wrapper = copy.copy(driver_wrapper)
+        prewarm_wrapper.config = config.deepcopy()
+        prewarm_wrapper.utils = Utils(prewarm_wrapper)
+        future = cls.prewarm_executor.submit(ConfigDriver(prewarm_wrapper.config, prewarm_wrapper.utils).create_driver)
+        cls.prewarmed_driver = (cls._get_config_string(prewarm_wrapper.config), future)
+
+    @classmethod
+    def get_prewarmed_driver(cls, driver_wrapper):
+        """Get the driver created in background, if it has been created with the same config of the driver wrapper
+
+        :param driver_wrapper: driver wrapper that will be connected
+        :returns: driver created in background or None if a new driver must be created
+        """
+        if cls.prewarmed_driver is None:
+            return None
+        config_string, future = cls.prewarmed_driver
+        cls.prewarmed_driver = None
+        if config_string != cls._get_config_string(driver_wrapper.config):
+            driver_wrapper.logger.debug('Driver created in background is discarded because config has changed')
+            cls._quit_prewarmed_driver(future, driver_wrapper.logger)
+            return None
+        try:
+            driver = future.result()
+        except Exception as exc:
+            driver_wrapper.logger.warning('Error creating driver in background, a new driver will be created: %s' % exc)
+            return None
+        try:
+            # Remote servers close idle sessions, so check that the session is still alive
+            driver.current_url
+        except Exception as exc:
+            driver_wrapper.logger.warning('Driver created in background is not alive, a new driver will be created: %s'
+                                          % exc)
+            cls._quit_prewarmed_driver(future, driver_wrapper.logger)
+            return None
+        return driver
+
+    @classmethod
+    def discard_prewarmed_driver(cls):
+        """Stop the driver created in background that has not been used and stop its thread"""
+        if cls.prewarmed_driver is not None:
+            cls._quit_prewarmed_driver(cls.prewarmed_driver[1], logging.getLogger(__name__))
+            cls.prewarmed_driver = None
+        if cls.prewarm_executor:
+            cls.prewarm_executor.shutdown()
+            cls.prewarm_executor = None
+            atexit.unregister(cls.discard_prewarmed_driver)
+
+    @staticmethod
+    def _quit_prewarmed_driver(future, logger):
+        """Wait until the driver created in background is ready and stop it
+
+        :param future: future of the driver created in background
+        :param logger: logger to report errors
+        """
+        try:
+            future.result().quit()
+        except Exception as exc:
+            logger.warning('Error stopping driver created in background: %s' % exc)
+
+    @staticmethod
+    def _get_config_string(config):
+        """Get config content as a string, to check if two config objects are equal
+
+        :param config: config object
+        :returns: config content
+        """
+        config_string = StringIO()
+        config.write(config_string)
+        return config_string.getvalue()
+
     @classmethod
     def close_drivers(cls, scope, test_name, test_passed=True, context=None):
         """Stop all drivers, capture screenshots, copy webdriver and GGR logs and download saved videos
+        If visual comparisons have been executed in background, their errors are raised after closing drivers
 
         :param scope: execution scope (function, module, class or session)
         :param test_name: executed test name
         :param test_passed: True if the test has passed
         :param context: behave context
         """
+        from toolium.visual_test import VisualTest
+        # Wait for background visual comparisons
+        visual_error = VisualTest.wait_pending_comparisons(scope)
+
         if scope == 'function':
             # Capture screenshot on error
             if not test_passed:
@@ -143,16 +275,31 @@ class DriverWrappersPool(object):
                 context.dyn_env.execute_after_scenario_steps(context)
             # Save webdriver logs on error or if it is enabled
             cls.save_all_webdriver_logs(test_name, test_passed)
-        elif scope == 'session':
-            from toolium.visual_test import VisualTest
-            VisualTest.update_latest_report()
-
-        # Close browser and stop driver if it must not be reused
-        reuse_driver = cls.get_default_wrapper().should_reuse_driver(scope, test_passed, context)
+        elif scope == 'class' or (scope == 'session' and not os.environ.get('PYTEST_XDIST_WORKER')):
+            # Render visual report (class scope is the last one in unittest test cases), pytest-xdist workers share the
+            # visual report that is rendered by the controller process when all workers have finished
+            VisualTest.render_report()
+            if scope == 'session':
+                VisualTest.update_latest_report()
+
+        # Close browser and stop driver if it must not be reused, or if its state must be reset and it fails
+        default_wrapper = cls.get_default_wrapper()
+        reuse_driver = default_wrapper.should_reuse_driver(scope, test_passed, context)
+        if reuse_driver and default_wrapper.should_reset_driver(scope, context):
+            reuse_driver = default_wrapper.reset_driver()
         cls.stop_drivers(reuse_driver)
         cls.download_videos(test_name, test_passed, reuse_driver)
         cls.save_all_ggr_logs(test_name, test_passed)
         cls.remove_drivers(reuse_driver)
+        if scope == 'session':
+            # Wait for videos and GGR logs collected in background and stop the unused driver created in background
+            cls.wait_pending_artifacts()
+            cls.discard_prewarmed_driver()
+            cls.save_connect_timings_summary()
+
+        # Raise visual errors after closing drivers
+        if visual_error:
+            raise visual_error
 
     @classmethod
     def stop_drivers(cls, maintain_default=False):
@@ -163,15 +310,16 @@ class DriverWrappersPool(object):
         # Exclude first wrapper if the driver must be reused
         driver_wrappers = cls.driver_wrappers[1:] if maintain_default else cls.driver_wrappers
 
-        for driver_wrapper in driver_wrappers:
-            if not driver_wrapper.driver:
-                continue
+        def stop_driver(driver_wrapper, driver_index):
             try:
                 driver_wrapper.driver.quit()
             except Exception as e:
                 driver_wrapper.logger.warning(
                     "Capture exceptions to avoid errors in teardown method due to session timeouts: \n %s" % e)
 
+        cls._run_in_driver_wrappers(stop_driver, [driver_wrapper for driver_wrapper in driver_wrappers
+                                                  if driver_wrapper.driver])
+
     @classmethod
     def download_videos(cls, name, test_passed=True, maintain_default=False):
         """Download saved videos if video is enabled or if test fails
@@ -184,21 +332,21 @@ class DriverWrappersPool(object):
         driver_wrappers = cls.driver_wrappers[1:] if maintain_default else cls.driver_wrappers
         video_name = '{}_driver{}' if len(driver_wrappers) > 1 else '{}'
         video_name = video_name if test_passed else 'error_{}'.format(video_name)
-        driver_index = 1
 
-        for driver_wrapper in driver_wrappers:
-            if not driver_wrapper.driver:
-                continue
+        def download_video(driver_wrapper, driver_index):
             try:
                 # Download video if necessary (error case or enabled video)
                 if (not test_passed or driver_wrapper.config.getboolean_optional('Server', 'video_enabled', False)) \
                         and driver_wrapper.remote_node_video_enabled:
-                    driver_wrapper.utils.download_remote_video(driver_wrapper.server_type,
-                                                               video_name.format(name, driver_index))
+                    cls.collect_artifact(driver_wrapper, name, 'video',
+                                         lambda wrapper: wrapper.utils.download_remote_video(
+                                             wrapper.server_type, video_name.format(name, driver_index)))
             except Exception as exc:
                 # Capture exceptions to avoid errors in teardown method due to session timeouts
                 driver_wrapper.logger.warning('Error downloading videos: %s' % exc)
-            driver_index += 1
+
+        cls._run_in_driver_wrappers(download_video, [driver_wrapper for driver_wrapper in driver_wrappers
+                                                     if driver_wrapper.driver])
 
     @classmethod
     def remove_drivers(cls, maintain_default=False):
@@ -235,20 +383,186 @@ class DriverWrappersPool(object):
         :param ggr: True if driver should be ggr or selenoid
         """
         log_name = '{} [driver {}]' if len(cls.driver_wrappers) > 1 else '{}'
-        driver_index = 1
-        for driver_wrapper in cls.driver_wrappers:
+
+        def save_logs(driver_wrapper, driver_index):
             if driver_wrapper.driver and (driver_wrapper.config.getboolean_optional('Server', 'logs_enabled')
                                           or not test_passed):
                 try:
                     log_file_name = get_valid_filename(log_name.format(test_name, driver_index))
                     if ggr and driver_wrapper.server_type in ['ggr', 'selenoid']:
-                        Selenoid(driver_wrapper).download_session_log(log_file_name)
+                        cls.collect_artifact(driver_wrapper, test_name, 'GGR logs',
+                                             lambda wrapper: Selenoid(wrapper).download_session_log(log_file_name))
                     elif not ggr and driver_wrapper.server_type not in ['ggr', 'selenoid']:
                         driver_wrapper.utils.save_webdriver_logs(log_file_name)
                 except Exception as exc:
                     # Capture exceptions to avoid errors in teardown method due to session timeouts
                     driver_wrapper.logger.warning('Error downloading webdriver logs: %s' % exc)
-            driver_index += 1
+
+        cls._run_in_driver_wrappers(save_logs, cls.driver_wrappers)
+
+    @classmethod
+    def collect_artifact(cls, driver_wrapper, test_name, artifact_name, collect_function):
+        """Collect a test artifact, like a video or a log file, in background if artifacts_workers property is configured
+        Background collections use a copy of the driver wrapper, so they are not affected if the driver wrapper is
+        connected again in the next test
+
+        :param driver_wrapper: driver wrapper whose artifact will be collected
+        :param test_name: executed test name
+        :param artifact_name: artifact name to identify collection errors
+        :param collect_function: function that receives a driver wrapper and collects the artifact
+        """
+        from toolium.utils.driver_utils import Utils
+        executor = cls.get_artifacts_executor(driver_wrapper)
+        if executor is None:
+            collect_function(driver_wrapper)
+            return
+        artifacts_wrapper = copy.copy(driver_wrapper)
+        artifacts_wrapper.utils = Utils(artifacts_wrapper)
+        future = executor.submit(collect_function, artifacts_wrapper)
+        cls.pending_artifacts.append((test_name, artifact_name, future))
+
+    @classmethod
+    def get_artifacts_executor(cls, driver_wrapper):
+        """Get the thread pool to collect artifacts in background, if artifacts_workers property is configured
+
+        :param driver_wrapper: driver wrapper whose configuration is read
+        :returns: thread pool executor or None if artifacts must be collected synchronously
+        """
+        artifacts_workers = int(driver_wrapper.config.get_optional('Server', 'artifacts_workers') or 0)
+        if artifacts_workers <= 0:
+            return None
+        with cls.numbers_lock:
+            if cls.artifacts_executor is None:
+                cls.artifacts_executor = ThreadPoolExecutor(max_workers=artifacts_workers,
+                                                            thread_name_prefix='artifacts')
+                # Unittest executions have no session scope, so pending collections are also waited at exit
+                atexit.register(cls.wait_pending_artifacts)
+        return cls.artifacts_executor
+
+    @classmethod
+    def wait_pending_artifacts(cls):
+        """Wait until background artifacts collections have finished and report their errors with their test names
+
+        :returns: dict with the list of collection errors of each test name
+        """
+        pending_artifacts = cls.pending_artifacts[:]
+        del cls.pending_artifacts[:len(pending_artifacts)]
+        for test_name, artifact_name, future in pending_artifacts:
+            error = future.exception()
+            if error is not None:
+                message = 'Error collecting {}: {}'.format(artifact_name, error)
+                cls.artifacts_errors.setdefault(test_name, []).append(message)
+                logging.getLogger(__name__).warning("%s in test '%s'", message, test_name)
+        if cls.artifacts_executor:
+            cls.artifacts_executor.shutdown()
+            cls.artifacts_executor = None
+            atexit.unregister(cls.wait_pending_artifacts)
+        return cls.artifacts_errors
+
+    @classmethod
+    def add_connect_timing(cls, driver_wrapper, phase, duration):
+        """Save the duration of a driver connection phase in the log and in the connection timings file
+
+        :param driver_wrapper: driver wrapper that is being connected
+        :param phase: connection phase name
+        :param duration: phase duration in seconds
+        """
+        driver_wrapper.logger.debug("Driver connection phase '%s' took %.3f seconds", phase, duration)
+        record = {'time': time.time(), 'type': 'span', 'phase': phase, 'duration': round(duration, 6),
+                  'driver': driver_wrapper.config.get_optional('Driver', 'type'),
+                  'session_id': driver_wrapper.session_id}
+        with cls.connect_timings_lock:
+            if not cls.connect_timings:
+                # Unittest executions have no session scope, so the summary is also saved at exit
+                atexit.register(cls.save_connect_timings_summary)
+            cls.connect_timings.setdefault(phase, []).append(duration)
+            cls._write_connect_timings([record])
+
+    @classmethod
+    def save_connect_timings_summary(cls):
+        """Log the aggregated durations of each driver connection phase in this session, save them in the connection
+        timings file and reset them
+
+        :returns: list of dicts with the summary of each connection phase
+        """
+        with cls.connect_timings_lock:
+            connect_timings = cls.connect_timings
+            cls.connect_timings = {}
+            atexit.unregister(cls.save_connect_timings_summary)
+            records = [{'time': time.time(), 'type': 'summary', 'phase': phase, 'count': len(durations),
+                        'total': round(sum(durations), 6), 'mean': round(sum(durations) / len(durations), 6),
+                        'max': round(max(durations), 6)} for phase, durations in connect_timings.items()]
+            cls._write_connect_timings(records)
+        logger = logging.getLogger(__name__)
+        for record in records:
+            logger.info("Driver connection phase '%s': %d times, total %.3f s, mean %.3f s, max %.3f s",
+                        record['phase'], record['count'], record['total'], record['mean'], record['max'])
+        return records
+
+    @classmethod
+    def _write_connect_timings(cls, records):
+        """Append records to the connection timings file of this session, in JSON lines format
+
+        :param records: list of dicts to be saved
+        """
+        if not records or cls.logs_directory is None:
+            return
+        try:
+            makedirs_safe(cls.logs_directory)
+            with open(os.path.join(cls.logs_directory, cls.connect_timings_name), 'a') as timings_file:
+                timings_file.write(''.join(json.dumps(record, default=str) + '\n' for record in records))
+        except OSError as exc:
+            logging.getLogger(__name__).warning('Error saving driver connection timings: %s' % exc)
+
+    @classmethod
+    def _run_in_driver_wrappers(cls, teardown_function, driver_wrappers):
+        """Execute a teardown step for each driver wrapper, in parallel threads if there are several driver wrappers.
+        Steps are executed one after another, so the order of the steps of each driver wrapper is kept.
+
+        :param teardown_function: function that receives a driver wrapper and its index, starting at 1
+        :param driver_wrappers: list of driver wrappers
+        """
+        if len(driver_wrappers) > 1 and cls.teardown_workers > 1:
+            with ThreadPoolExecutor(max_workers=min(cls.teardown_workers, len(driver_wrappers)),
+                                    thread_name_prefix='teardown') as executor:
+                futures = [executor.submit(teardown_function, driver_wrapper, driver_index)
+                           for driver_index, driver_wrapper in enumerate(driver_wrappers, start=1)]
+            errors = [future.exception() for future in futures]
+        else:
+            errors = []
+            for driver_index, driver_wrapper in enumerate(driver_wrappers, start=1):
+                try:
+                    teardown_function(driver_wrapper, driver_index)
+                    errors.append(None)
+                except Exception as exc:
+                    errors.append(exc)
+
+        # Errors in a driver wrapper must not affect the other ones
+        for driver_wrapper, error in zip(driver_wrappers, errors):
+            if error:
+                driver_wrapper.logger.warning('Error in teardown of driver wrapper: %s' % error)
+
+    @classmethod
+    def get_screenshot_number(cls):
+        """Get a unique number for a screenshot, that is not repeated in other threads
+
+        :returns: screenshot number
+        """
+        with cls.numbers_lock:
+            screenshot_number = cls.screenshots_number
+            cls.screenshots_number += 1
+        return screenshot_number
+
+    @classmethod
+    def get_video_number(cls):
+        """Get a unique number for a video, that is not repeated in other threads
+
+        :returns: video number
+        """
+        with cls.numbers_lock:
+            video_number = cls.videos_number
+            cls.videos_number += 1
+        return video_number
 
     @staticmethod
     def get_configured_value(system_property_name, deprecated_system_property_name, specific_value, default_value):
@@ -334,12 +648,14 @@ class DriverWrappersPool(object):
     @classmethod
     def configure_visual_directories(cls, driver_info):
         """Configure screenshots, videos and visual directories
+        Folders are named with the date of TOOLIUM_EXECUTION_DATE environment variable if it exists, so that all
+        pytest-xdist workers share the same folders, or with the current date otherwise
 
         :param driver_info: driver property value to name folders
         """
         if cls.screenshots_directory is None:
             # Unique screenshots and videos directories
-            date = datetime.datetime.now().strftime('%Y-%m-%d_%H%M%S')
+            date = os.environ.get(cls.execution_date_variable) or cls.get_execution_date()
             folder_name = '%s_%s' % (date, driver_info) if driver_info else date
             folder_name = get_valid_filename(folder_name)
             cls.screenshots_directory = os.path.join(cls.output_directory, 'screenshots', folder_name)
@@ -352,6 +668,28 @@ class DriverWrappersPool(object):
             cls.visual_output_directory = os.path.join(cls.output_directory, 'visualtests', folder_name)
             cls.visual_number = 1
 
+    @staticmethod
+    def get_execution_date():
+        """Get the current date formatted to name output folders
+
+        :returns: formatted date
+        """
+        return datetime.datetime.now().strftime('%Y-%m-%d_%H%M%S')
+
+    @classmethod
+    def get_visual_number(cls):
+        """Get a unique number for a visual image, that is not repeated in other threads or processes saving visual
+        images in the same visual output folder, e.g. pytest-xdist workers
+
+        :returns: visual image number
+        """
+        with cls.visual_number_lock:
+            makedirs_safe(cls.visual_output_directory)
+            counter_path = os.path.join(cls.visual_output_directory, cls.visual_number_name)
+            visual_number = increment_counter_file(counter_path, cls.visual_number or 1)
+            cls.visual_number = visual_number + 1
+        return visual_number
+
     @staticmethod
     def initialize_config_files(tc_config_files=None):
         """Initialize config files and update config files names with the environment
@@ -393,3 +731,5 @@ class DriverWrappersPool(object):
         cls.videos_number = None
         cls.visual_output_directory = None
         cls.visual_number = None
+        cls.artifacts_errors = {}
+        cls.connect_timings = {}
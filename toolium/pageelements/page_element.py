@@ -264,7 +264,7 @@ class PageElement(CommonObject):
         """
         return self._wait_until_condition('clickable', timeout)
 
-    def assert_screenshot(self, filename, threshold=0, exclude_elements=[], force=False):
+    def assert_screenshot(self, filename, threshold=0, exclude_elements=[], force=False, comparison_mode=None):
         """Assert that a screenshot of the element is the same as a screenshot on disk, within a given threshold.
 
         :param filename: the filename for the screenshot, which will be appended with ``.png``
@@ -272,9 +272,10 @@ class PageElement(CommonObject):
         :param exclude_elements: list of WebElements, PageElements or element locators as a tuple (locator_type,
                                  locator_value) that must be excluded from the assertion
         :param force: if True, the screenshot is compared even if visual testing is disabled by configuration
+        :param comparison_mode: comparison mode (pixel, tolerance, isolated or ssim), by default the configured mode
         """
         VisualTest(self.driver_wrapper, force).assert_screenshot(self.web_element, filename, self.__class__.__name__,
-                                                                 threshold, exclude_elements)
+                                                                 threshold, exclude_elements, comparison_mode)
 
     def get_attribute(self, name):
         """Get the given attribute or property of the element
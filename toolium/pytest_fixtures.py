@@ -19,6 +19,37 @@ limitations under the License.
 import os
 import pytest
 from toolium.driver_wrappers_pool import DriverWrappersPool
+from toolium.visual_test import VisualTest
+
+# Visual output folders of finished pytest-xdist workers, whose reports are rendered by the controller process
+workers_visual_directories = []
+
+
+def pytest_configure(config):
+    # Share the execution date with pytest-xdist workers, that inherit environment variables from the controller
+    # process, so that all of them save their output files in the same folders
+    if not hasattr(config, 'workerinput'):
+        os.environ.setdefault(DriverWrappersPool.execution_date_variable, DriverWrappersPool.get_execution_date())
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_testnodedown(node, error):
+    # Collect the visual output folder of a finished pytest-xdist worker
+    visual_directory = getattr(node, 'workeroutput', {}).get('visual_output_directory')
+    if visual_directory and visual_directory not in workers_visual_directories:
+        workers_visual_directories.append(visual_directory)
+
+
+def pytest_sessionfinish(session):
+    if hasattr(session.config, 'workeroutput'):
+        # Send the visual output folder of this pytest-xdist worker to the controller process
+        session.config.workeroutput['visual_output_directory'] = DriverWrappersPool.visual_output_directory
+    else:
+        # Render visual reports once all pytest-xdist workers have finished
+        for visual_directory in workers_visual_directories:
+            VisualTest.render_report(visual_directory)
+            VisualTest.update_latest_report(visual_directory)
+        del workers_visual_directories[:]
 
 
 @pytest.hookimpl(hookwrapper=True, tryfirst=True)
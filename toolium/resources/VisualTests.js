@@ -1,3 +1,6 @@
+var rowsPerPage = 100;
+var currentPage = 0;
+
 function launchModal(src, title) {
   var image = document.getElementById('modal-image');
   image.setAttribute('src', src);
@@ -12,12 +15,27 @@ function closeModal() {
   modal.className = 'tc-modal';
 }
 
+function showPage(page) {
+  // Rows out of the current page are hidden, so their lazy images are not loaded
+  var rows = document.getElementById('images').getElementsByTagName('tbody')[0].rows;
+  var pages = Math.max(Math.ceil(rows.length / rowsPerPage), 1);
+  currentPage = Math.min(Math.max(page, 0), pages - 1);
+  for (var i = 0; i < rows.length; i++) {
+    rows[i].style.display = Math.floor(i / rowsPerPage) === currentPage ? '' : 'none';
+  }
+  document.getElementById('page-info').textContent = 'Page ' + (currentPage + 1) + ' of ' + pages;
+  document.getElementById('pagination').style.display = pages > 1 ? '' : 'none';
+}
+
 window.onload = function () {
   var images = document.getElementsByTagName("img")
   for (var i = 0; i < images.length; i++) {
     images[i].addEventListener("click", function(){
-        launchModal(this.src, this.title);
+        launchModal(this.getAttribute('data-full-src') || this.src, this.title);
     });
   };
   document.getElementById("modal").addEventListener("click", closeModal)
+  document.getElementById("previous-page").addEventListener("click", function(){ showPage(currentPage - 1); });
+  document.getElementById("next-page").addEventListener("click", function(){ showPage(currentPage + 1); });
+  showPage(0);
 };
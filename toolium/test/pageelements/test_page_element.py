@@ -363,7 +363,7 @@ def test_assert_screenshot(visual_assert_screenshot, visual_init, driver_wrapper
     RegisterPageObject(driver_wrapper).username.assert_screenshot('filename')
 
     visual_init.assert_called_once_with(driver_wrapper, False)
-    visual_assert_screenshot.assert_called_once_with(mock_element, 'filename', 'PageElement', 0, [])
+    visual_assert_screenshot.assert_called_once_with(mock_element, 'filename', 'PageElement', 0, [], None)
 
 
 @mock.patch('toolium.visual_test.VisualTest.__init__', return_value=None)
@@ -373,10 +373,11 @@ def test_assert_screenshot_options(visual_assert_screenshot, visual_init, driver
 
     RegisterPageObject(driver_wrapper).username.assert_screenshot('filename', threshold=0.1,
                                                                   exclude_elements=[mock_element],
-                                                                  force=True)
+                                                                  force=True, comparison_mode='ssim')
 
     visual_init.assert_called_once_with(driver_wrapper, True)
-    visual_assert_screenshot.assert_called_once_with(mock_element, 'filename', 'PageElement', 0.1, [mock_element])
+    visual_assert_screenshot.assert_called_once_with(mock_element, 'filename', 'PageElement', 0.1, [mock_element],
+                                                     'ssim')
 
 
 def test_get_attribute(driver_wrapper):
@@ -16,6 +16,7 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import json
 import logging
 import os
 
@@ -68,7 +69,7 @@ environment_properties = []
 
 
 @pytest.fixture
-def driver_wrapper():
+def driver_wrapper(tmp_path):
     # Reset wrappers pool values
     DriverWrappersPool._empty_pool()
     DriverWrapper.config_properties_filenames = None
@@ -83,6 +84,8 @@ def driver_wrapper():
     config_files.set_output_directory(os.path.join(root_path, 'output'))
     config_files.set_config_log_filename('logging.conf')
     new_driver_wrapper.configure(config_files)
+    # Save connection timings in a temporary folder
+    DriverWrappersPool.logs_directory = str(tmp_path)
 
     yield new_driver_wrapper
 
@@ -187,6 +190,30 @@ def test_connect(create_driver, driver_wrapper):
     assert logging.getLevelName(logger.level) == 'DEBUG'
 
 
+@mock.patch('toolium.driver_wrapper.ConfigDriver.create_driver')
+def test_connect_timings(create_driver, driver_wrapper):
+    # Mock data
+    create_driver.return_value = mock.MagicMock()
+    create_driver.return_value.session_id = 'session_1'
+    driver_wrapper.utils = mock.MagicMock()
+    driver_wrapper.utils.get_remote_node.return_value = ('local', None)
+    timings_path = os.path.join(DriverWrappersPool.logs_directory, DriverWrappersPool.connect_timings_name)
+
+    # Connect driver
+    driver_wrapper.connect()
+
+    # Check that connection phases have been saved in the timings file
+    expected_phases = ['create_driver', 'get_remote_node', 'is_remote_video_enabled', 'resize_window',
+                       'get_window_size', 'update_visual_baseline', 'discard_logcat_logs', 'set_implicitly_wait',
+                       'connect']
+    assert list(DriverWrappersPool.connect_timings) == expected_phases
+    with open(timings_path) as timings_file:
+        records = [json.loads(line) for line in timings_file]
+    assert [record['phase'] for record in records] == expected_phases
+    assert all(record['type'] == 'span' and record['session_id'] == 'session_1' and record['driver'] == 'firefox'
+               and record['duration'] >= 0 for record in records)
+
+
 api_tests = (
     '',
     'api',
@@ -325,3 +352,86 @@ def test_should_reuse_driver(reuse_driver, reuse_driver_session, restart_driver_
     context.reuse_driver_from_tags = reuse_driver_from_tags
 
     assert driver_wrapper.should_reuse_driver(scope, test_passed, context) == expected_should_reuse_driver
+
+
+# (scope, test_passed, expected_should_reuse_driver)
+should_be_reused_with_reset = (
+    ('function', True, True),  # function, test passed
+    ('module', True, True),  # module, test passed
+    ('session', True, False),  # session, test passed
+    ('function', False, False),  # function, test failed
+)
+
+
+@pytest.mark.parametrize("scope, test_passed, expected_should_reuse_driver", should_be_reused_with_reset)
+def test_should_reuse_driver_reset_driver_state(scope, test_passed, expected_should_reuse_driver, driver_wrapper):
+    driver_wrapper.config.set('Driver', 'reuse_driver', 'false')
+    driver_wrapper.config.set('Driver', 'reuse_driver_session', 'false')
+    driver_wrapper.config.set('Driver', 'restart_driver_after_failure', 'false')
+    driver_wrapper.config.set('Driver', 'reset_driver_state', 'true')
+
+    assert driver_wrapper.should_reuse_driver(scope, test_passed) == expected_should_reuse_driver
+
+
+# (reset_driver_state, reuse_driver_from_tags, scope, expected_should_reset_driver)
+should_be_reset = (
+    ('false', False, 'function', False),  # reset = false
+    ('true', False, 'function', True),  # reset = true, function
+    ('true', False, 'module', True),  # reset = true, module
+    ('true', True, 'function', False),  # reset = true, reuse tag, function
+    ('true', True, 'module', True),  # reset = true, reuse tag, module
+)
+
+
+@pytest.mark.parametrize("reset_driver_state, reuse_driver_from_tags, scope, expected_should_reset_driver",
+                         should_be_reset)
+def test_should_reset_driver(reset_driver_state, reuse_driver_from_tags, scope, expected_should_reset_driver,
+                             driver_wrapper):
+    driver_wrapper.config.set('Driver', 'reset_driver_state', reset_driver_state)
+
+    # Create context mock
+    context = mock.MagicMock()
+    context.reuse_driver_from_tags = reuse_driver_from_tags
+
+    assert driver_wrapper.should_reset_driver(scope, context) == expected_should_reset_driver
+
+
+def test_reset_driver_web(driver_wrapper):
+    driver_wrapper.config.set('Driver', 'type', 'firefox')
+    driver_wrapper.driver = mock.MagicMock()
+    driver_wrapper.driver.window_handles = ['window1', 'window2', 'window3']
+
+    assert driver_wrapper.reset_driver() is True
+
+    # Check that extra windows have been closed and browser state has been cleared
+    driver_wrapper.driver.switch_to.window.assert_has_calls([mock.call('window2'), mock.call('window3'),
+                                                             mock.call('window1')])
+    assert driver_wrapper.driver.close.call_count == 2
+    driver_wrapper.driver.delete_all_cookies.assert_called_once_with()
+    driver_wrapper.driver.execute_script.assert_called_once_with(DriverWrapper.clear_storage_script)
+    driver_wrapper.driver.get.assert_called_once_with('about:blank')
+
+
+def test_reset_driver_mobile_app(driver_wrapper):
+    driver_wrapper.config.set('Driver', 'type', 'android')
+    driver_wrapper.config.set('AppiumCapabilities', 'app', 'C:/Demo.apk')
+    driver_wrapper.driver = mock.MagicMock()
+
+    assert driver_wrapper.reset_driver() is True
+
+    # Check that native context has been restored
+    driver_wrapper.driver.switch_to.context.assert_called_once_with('NATIVE_APP')
+    driver_wrapper.driver.get.assert_not_called()
+
+
+def test_reset_driver_error(driver_wrapper):
+    driver_wrapper.config.set('Driver', 'type', 'firefox')
+    driver_wrapper.driver = mock.MagicMock()
+    driver_wrapper.driver.window_handles = ['window1']
+    driver_wrapper.driver.delete_all_cookies.side_effect = Exception('session timeout')
+    driver_wrapper.logger = mock.MagicMock()
+
+    # Check that driver must be restarted if its state can not be reset
+    assert driver_wrapper.reset_driver() is False
+    driver_wrapper.logger.warning.assert_called_once_with('Error resetting driver state, driver will be restarted: '
+                                                          'session timeout')
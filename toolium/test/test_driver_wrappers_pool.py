@@ -16,7 +16,9 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import json
 import os
+import threading
 
 import mock
 import pytest
@@ -93,6 +95,106 @@ def test_connect_default_driver_wrapper_already_connected(driver_wrapper):
     driver_wrapper.connect.assert_not_called()
 
 
+def configure_prewarm_driver(driver_wrapper):
+    driver_wrapper.config.set('Driver', 'prewarm_driver', 'true')
+    driver_wrapper.configure = mock.MagicMock()
+
+    def connect(driver=None):
+        driver_wrapper.driver = driver if driver else 'new_driver'
+    driver_wrapper.connect = mock.MagicMock(side_effect=connect)
+
+
+def test_connect_default_driver_wrapper_prewarm(driver_wrapper):
+    configure_prewarm_driver(driver_wrapper)
+    prewarmed_drivers = [mock.MagicMock(), mock.MagicMock()]
+
+    with mock.patch('toolium.config_driver.ConfigDriver.create_driver', side_effect=prewarmed_drivers) as create_driver:
+        # Connect default driver wrapper in first test
+        DriverWrappersPool.connect_default_driver_wrapper()
+        assert driver_wrapper.driver == 'new_driver'
+
+        # Connect default driver wrapper in second test
+        driver_wrapper.driver = None
+        DriverWrappersPool.connect_default_driver_wrapper()
+        assert driver_wrapper.driver == prewarmed_drivers[0]
+
+        # Discard next driver at the end of the session
+        DriverWrappersPool.discard_prewarmed_driver()
+
+    # Check that next drivers have been created in background and the unused one has been stopped
+    assert create_driver.call_count == 2
+    prewarmed_drivers[0].quit.assert_not_called()
+    prewarmed_drivers[1].quit.assert_called_once_with()
+    assert DriverWrappersPool.prewarmed_driver is None
+    assert DriverWrappersPool.prewarm_executor is None
+
+
+def test_connect_default_driver_wrapper_prewarm_config_changed(driver_wrapper):
+    configure_prewarm_driver(driver_wrapper)
+    prewarmed_driver = mock.MagicMock()
+
+    with mock.patch('toolium.config_driver.ConfigDriver.create_driver', return_value=prewarmed_driver):
+        # Connect default driver wrapper in first test
+        DriverWrappersPool.connect_default_driver_wrapper()
+
+        # Connect default driver wrapper in second test with a different config
+        driver_wrapper.driver = None
+        driver_wrapper.config.set('Driver', 'window_width', '800')
+        DriverWrappersPool.connect_default_driver_wrapper()
+        DriverWrappersPool.discard_prewarmed_driver()
+
+    # Check that driver created in background has been discarded and a new driver has been created
+    assert driver_wrapper.driver == 'new_driver'
+    assert prewarmed_driver.quit.call_count == 2
+
+
+def test_connect_default_driver_wrapper_prewarm_error(driver_wrapper):
+    configure_prewarm_driver(driver_wrapper)
+
+    with mock.patch('toolium.config_driver.ConfigDriver.create_driver', side_effect=Exception('session not created')):
+        # Connect default driver wrapper in two tests
+        DriverWrappersPool.connect_default_driver_wrapper()
+        driver_wrapper.driver = None
+        DriverWrappersPool.connect_default_driver_wrapper()
+        DriverWrappersPool.discard_prewarmed_driver()
+
+    # Check that a new driver has been created after the background error
+    assert driver_wrapper.driver == 'new_driver'
+    assert driver_wrapper.connect.call_args_list == [mock.call(), mock.call()]
+
+
+def test_connect_default_driver_wrapper_prewarm_dead_session(driver_wrapper):
+    configure_prewarm_driver(driver_wrapper)
+    prewarmed_driver = mock.MagicMock()
+    type(prewarmed_driver).current_url = mock.PropertyMock(side_effect=Exception('session timed out'))
+
+    with mock.patch('toolium.config_driver.ConfigDriver.create_driver', return_value=prewarmed_driver):
+        # Connect default driver wrapper in two tests, the background session is closed by the server meanwhile
+        DriverWrappersPool.connect_default_driver_wrapper()
+        driver_wrapper.driver = None
+        DriverWrappersPool.connect_default_driver_wrapper()
+        DriverWrappersPool.discard_prewarmed_driver()
+
+    # Check that dead driver has been stopped and a new driver has been created
+    assert driver_wrapper.driver == 'new_driver'
+    assert driver_wrapper.connect.call_args_list == [mock.call(), mock.call()]
+    assert prewarmed_driver.quit.call_count == 2
+
+
+@pytest.mark.parametrize("reuse_property", ('reuse_driver', 'reuse_driver_session'))
+def test_connect_default_driver_wrapper_prewarm_reuse_driver(reuse_property, driver_wrapper):
+    configure_prewarm_driver(driver_wrapper)
+    driver_wrapper.config.set('Driver', reuse_property, 'true')
+
+    # Connect default driver wrapper
+    with mock.patch('toolium.config_driver.ConfigDriver.create_driver') as create_driver:
+        DriverWrappersPool.connect_default_driver_wrapper()
+
+    # Check that next driver is not created in background if drivers are reused
+    create_driver.assert_not_called()
+    assert DriverWrappersPool.prewarmed_driver is None
+
+
 close_drivers_scopes = (
     'function',
     'module',
@@ -121,6 +223,270 @@ def test_close_drivers_function(scope, driver_wrapper):
         VisualTest.update_latest_report.assert_called_once_with()
 
 
+@pytest.mark.parametrize("scope", close_drivers_scopes + ('class',))
+def test_close_drivers_render_visual_report(scope, driver_wrapper):
+    # Close drivers
+    with mock.patch.object(VisualTest, 'render_report') as render_report, \
+            mock.patch.object(VisualTest, 'update_latest_report'), \
+            mock.patch.object(DriverWrappersPool, 'save_all_webdriver_logs'):
+        DriverWrappersPool.close_drivers(scope, 'test_name')
+
+    # Check that visual report is rendered only in class and session scopes
+    if scope in ('class', 'session'):
+        render_report.assert_called_once_with()
+    else:
+        render_report.assert_not_called()
+
+
+def test_close_drivers_render_visual_report_xdist_worker(driver_wrapper):
+    # Close drivers in a pytest-xdist worker
+    with mock.patch.object(VisualTest, 'render_report') as render_report, \
+            mock.patch.object(VisualTest, 'update_latest_report') as update_latest_report, \
+            mock.patch.dict(os.environ, {'PYTEST_XDIST_WORKER': 'gw0'}):
+        DriverWrappersPool.close_drivers('session', 'test_name')
+
+    # Check that visual report is rendered by the controller process instead of workers
+    render_report.assert_not_called()
+    update_latest_report.assert_not_called()
+
+
+def test_configure_visual_directories_execution_date(driver_wrapper):
+    # Configure directories with the execution date shared by pytest-xdist workers
+    DriverWrappersPool.screenshots_directory = None
+    with mock.patch.dict(os.environ, {'TOOLIUM_EXECUTION_DATE': '2023-05-10_103045'}):
+        DriverWrappersPool.configure_visual_directories('firefox')
+
+    output_directory = DriverWrappersPool.output_directory
+    folder_name = '2023-05-10_103045_firefox'
+    assert DriverWrappersPool.screenshots_directory == os.path.join(output_directory, 'screenshots', folder_name)
+    assert DriverWrappersPool.videos_directory == os.path.join(output_directory, 'videos', folder_name)
+    assert DriverWrappersPool.logs_directory == os.path.join(output_directory, 'logs', folder_name)
+    assert DriverWrappersPool.visual_output_directory == os.path.join(output_directory, 'visualtests', folder_name)
+
+
+def test_close_drivers_visual_error(driver_wrapper):
+    visual_error = AssertionError('visual error')
+
+    # Close drivers
+    with mock.patch.object(VisualTest, 'wait_pending_comparisons', return_value=visual_error), \
+            mock.patch.object(DriverWrappersPool, 'save_all_webdriver_logs'), \
+            mock.patch.object(DriverWrappersPool, 'stop_drivers') as stop_drivers:
+        with pytest.raises(AssertionError) as exc:
+            DriverWrappersPool.close_drivers('function', 'test_name')
+
+    # Check that visual error has been raised after stopping drivers
+    assert exc.value == visual_error
+    stop_drivers.assert_called_once_with(False)
+    assert DriverWrappersPool.driver_wrappers == []
+
+
+@pytest.mark.parametrize("reset_result", (True, False))
+def test_close_drivers_reset_driver_state(reset_result, driver_wrapper):
+    driver_wrapper.config.set('Driver', 'reset_driver_state', 'true')
+    driver_wrapper.driver = mock.MagicMock()
+
+    # Close drivers of a passed test
+    with mock.patch.object(DriverWrapper, 'reset_driver', return_value=reset_result) as reset_driver, \
+            mock.patch.object(DriverWrappersPool, 'save_all_webdriver_logs'):
+        DriverWrappersPool.close_drivers('function', 'test_name')
+
+    # Check that driver is reused if its state has been reset, and it is restarted otherwise
+    reset_driver.assert_called_once_with()
+    if reset_result:
+        driver_wrapper.driver.quit.assert_not_called()
+        assert DriverWrappersPool.driver_wrappers == [driver_wrapper]
+    else:
+        driver_wrapper.driver.quit.assert_called_once_with()
+        assert DriverWrappersPool.driver_wrappers == []
+
+
+def add_connected_driver_wrappers(driver_wrapper, number):
+    driver_wrapper.driver = mock.MagicMock()
+    for _ in range(number - 1):
+        new_wrapper = DriverWrapper()
+        new_wrapper.config = driver_wrapper.config
+        new_wrapper.driver = mock.MagicMock()
+    return DriverWrappersPool.driver_wrappers
+
+
+def test_stop_drivers_in_parallel(driver_wrapper):
+    driver_wrappers = add_connected_driver_wrappers(driver_wrapper, 3)
+    barrier = threading.Barrier(3, timeout=5)
+    threads = set()
+
+    def quit_driver():
+        # Each quit waits for the other ones, so it only finishes if drivers are stopped in parallel
+        threads.add(threading.current_thread().name)
+        barrier.wait()
+
+    for wrapper in driver_wrappers:
+        wrapper.driver.quit.side_effect = quit_driver
+
+    # Stop drivers
+    DriverWrappersPool.stop_drivers()
+
+    # Check that all drivers have been stopped in different threads
+    for wrapper in driver_wrappers:
+        wrapper.driver.quit.assert_called_once_with()
+    assert len(threads) == 3
+    assert all(name.startswith('teardown') for name in threads)
+
+
+def test_stop_drivers_error_in_one_driver(driver_wrapper):
+    driver_wrappers = add_connected_driver_wrappers(driver_wrapper, 3)
+    driver_wrappers[0].driver.quit.side_effect = Exception('session timeout')
+
+    # Stop drivers
+    DriverWrappersPool.stop_drivers()
+
+    # Check that the error in the first driver has not avoided stopping the other ones
+    for wrapper in driver_wrappers:
+        wrapper.driver.quit.assert_called_once_with()
+
+
+def test_stop_drivers_maintain_default(driver_wrapper):
+    driver_wrappers = add_connected_driver_wrappers(driver_wrapper, 3)
+
+    # Stop drivers except the default one
+    DriverWrappersPool.stop_drivers(maintain_default=True)
+
+    # Check that default driver has not been stopped
+    driver_wrappers[0].driver.quit.assert_not_called()
+    driver_wrappers[1].driver.quit.assert_called_once_with()
+    driver_wrappers[2].driver.quit.assert_called_once_with()
+
+
+def test_capture_screenshots_in_parallel(driver_wrapper):
+    driver_wrappers = add_connected_driver_wrappers(driver_wrapper, 4)
+    driver_wrappers[1].driver = None
+    DriverWrappersPool.screenshots_number = 1
+    connected_wrappers = [wrapper for wrapper in driver_wrappers if wrapper.driver]
+    for wrapper in connected_wrappers:
+        wrapper.driver.get_screenshot_as_file.return_value = True
+
+    # Capture screenshots
+    with mock.patch('toolium.jira.add_attachment'):
+        DriverWrappersPool.capture_screenshots('test_name')
+
+    # Check that screenshots have unique numbers and driver indexes only count connected drivers
+    filenames = sorted(os.path.basename(wrapper.driver.get_screenshot_as_file.call_args[0][0])
+                       for wrapper in connected_wrappers)
+    assert sorted(filename[:3] for filename in filenames) == ['01_', '02_', '03_']
+    assert sorted(filename[3:] for filename in filenames) == ['test_name_driver1.png', 'test_name_driver2.png',
+                                                              'test_name_driver3.png']
+    assert DriverWrappersPool.screenshots_number == 4
+
+
+def test_collect_artifact_inline(driver_wrapper):
+    collect_function = mock.MagicMock()
+
+    # Collect artifact without background workers
+    DriverWrappersPool.collect_artifact(driver_wrapper, 'test_name', 'video', collect_function)
+
+    # Check that artifact has been collected with the same driver wrapper
+    collect_function.assert_called_once_with(driver_wrapper)
+    assert DriverWrappersPool.pending_artifacts == []
+
+
+def test_collect_artifact_in_background(driver_wrapper):
+    driver_wrapper.config.set('Server', 'artifacts_workers', '2')
+    driver_wrapper.driver = mock.MagicMock()
+    driver_wrapper.session_id = 'old_session'
+    collected = threading.Event()
+    collected_sessions = []
+
+    def collect_function(wrapper):
+        collected.wait(5)
+        collected_sessions.append((wrapper.session_id, wrapper.utils.driver_wrapper.session_id))
+
+    # Collect artifact in background and connect again the driver wrapper before it finishes
+    DriverWrappersPool.collect_artifact(driver_wrapper, 'test_name', 'video', collect_function)
+    driver_wrapper.session_id = 'new_session'
+    collected.set()
+    errors = DriverWrappersPool.wait_pending_artifacts()
+
+    # Check that artifact has been collected with the driver wrapper data of the collected test
+    assert collected_sessions == [('old_session', 'old_session')]
+    assert errors == {}
+    assert DriverWrappersPool.pending_artifacts == []
+    assert DriverWrappersPool.artifacts_executor is None
+
+
+def test_collect_artifact_errors(driver_wrapper):
+    driver_wrapper.config.set('Server', 'artifacts_workers', '2')
+    failed_function = mock.MagicMock(side_effect=Exception('video not found'))
+
+    # Collect artifacts of two tests in background, failing the second one
+    DriverWrappersPool.collect_artifact(driver_wrapper, 'test_1', 'video', mock.MagicMock())
+    DriverWrappersPool.collect_artifact(driver_wrapper, 'test_2', 'video', failed_function)
+    errors = DriverWrappersPool.wait_pending_artifacts()
+
+    # Check that collection error has been reported in its test
+    assert errors == {'test_2': ['Error collecting video: video not found']}
+
+
+def test_collect_artifact_wait_at_exit(driver_wrapper):
+    driver_wrapper.config.set('Server', 'artifacts_workers', '1')
+
+    # Check that pending collections are waited at exit until they are waited at the end of the session
+    with mock.patch('toolium.driver_wrappers_pool.atexit') as atexit:
+        DriverWrappersPool.collect_artifact(driver_wrapper, 'test_name', 'video', mock.MagicMock())
+        atexit.register.assert_called_once_with(DriverWrappersPool.wait_pending_artifacts)
+        DriverWrappersPool.wait_pending_artifacts()
+        atexit.unregister.assert_called_once_with(DriverWrappersPool.wait_pending_artifacts)
+
+
+def test_close_drivers_downloads_videos_in_background(driver_wrapper):
+    driver_wrapper.config.set('Server', 'artifacts_workers', '1')
+    driver_wrapper.driver = mock.MagicMock()
+    driver_wrapper.server_type = 'grid'
+    driver_wrapper.remote_node_video_enabled = True
+
+    # Close drivers of a failed test
+    with mock.patch('toolium.utils.driver_utils.Utils.download_remote_video') as download_remote_video, \
+            mock.patch.object(DriverWrappersPool, 'wait_pending_artifacts') as wait_pending_artifacts:
+        DriverWrappersPool.close_drivers('function', 'test_name', test_passed=False)
+        wait_pending_artifacts.assert_not_called()
+        pending_artifacts = DriverWrappersPool.pending_artifacts[:]
+        for _, _, future in pending_artifacts:
+            future.result()
+
+    # Check that video has been downloaded in background
+    assert [artifact[:2] for artifact in pending_artifacts] == [('test_name', 'video')]
+    download_remote_video.assert_called_once_with('grid', 'error_test_name')
+    DriverWrappersPool.wait_pending_artifacts()
+
+
+def test_save_connect_timings_summary(driver_wrapper, tmp_path):
+    DriverWrappersPool.logs_directory = str(tmp_path)
+    DriverWrappersPool.add_connect_timing(driver_wrapper, 'create_driver', 1.0)
+    DriverWrappersPool.add_connect_timing(driver_wrapper, 'create_driver', 3.0)
+    DriverWrappersPool.add_connect_timing(driver_wrapper, 'resize_window', 0.5)
+
+    # Save summary at the end of the session
+    records = DriverWrappersPool.save_connect_timings_summary()
+
+    # Check that summary has been saved after the spans and timings have been reset
+    expected_summary = [('create_driver', 2, 4.0, 2.0, 3.0), ('resize_window', 1, 0.5, 0.5, 0.5)]
+    assert [(r['phase'], r['count'], r['total'], r['mean'], r['max']) for r in records] == expected_summary
+    with open(os.path.join(str(tmp_path), DriverWrappersPool.connect_timings_name)) as timings_file:
+        saved_records = [json.loads(line) for line in timings_file]
+    assert [record['type'] for record in saved_records] == ['span'] * 3 + ['summary'] * 2
+    assert saved_records[3:] == records
+    assert DriverWrappersPool.connect_timings == {}
+
+
+def test_save_connect_timings_summary_at_exit(driver_wrapper, tmp_path):
+    # Check that summary is saved at exit until it is saved at the end of the session
+    DriverWrappersPool.logs_directory = str(tmp_path)
+    with mock.patch('toolium.driver_wrappers_pool.atexit') as atexit:
+        DriverWrappersPool.add_connect_timing(driver_wrapper, 'create_driver', 1.0)
+        DriverWrappersPool.add_connect_timing(driver_wrapper, 'resize_window', 0.5)
+        atexit.register.assert_called_once_with(DriverWrappersPool.save_connect_timings_summary)
+        DriverWrappersPool.save_connect_timings_summary()
+        atexit.unregister.assert_called_once_with(DriverWrappersPool.save_connect_timings_summary)
+
+
 def test_find_parent_directory_relative():
     directory = 'conf'
     filename = 'properties.cfg'
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2023 Telefónica Investigación y Desarrollo, S.A.U.
+This file is part of Toolium.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+
+import mock
+
+from toolium import pytest_fixtures
+from toolium.driver_wrappers_pool import DriverWrappersPool
+
+
+def test_pytest_configure_execution_date():
+    # Controller process shares its execution date with workers
+    config = mock.MagicMock(spec=[])
+    with mock.patch.dict(os.environ, clear=True):
+        pytest_fixtures.pytest_configure(config)
+        execution_date = os.environ['TOOLIUM_EXECUTION_DATE']
+        pytest_fixtures.pytest_configure(config)
+        assert os.environ['TOOLIUM_EXECUTION_DATE'] == execution_date
+
+
+def test_pytest_configure_execution_date_worker():
+    # Workers use the execution date inherited from the controller process
+    config = mock.MagicMock(spec=['workerinput'])
+    with mock.patch.dict(os.environ, clear=True):
+        pytest_fixtures.pytest_configure(config)
+        assert 'TOOLIUM_EXECUTION_DATE' not in os.environ
+
+
+def test_pytest_sessionfinish_worker():
+    # Workers send their visual output folder to the controller process instead of rendering the report
+    session = mock.MagicMock()
+    session.config.workeroutput = {}
+    with mock.patch.object(DriverWrappersPool, 'visual_output_directory', 'visualtests/2023-05-10_103045_firefox'), \
+            mock.patch('toolium.pytest_fixtures.VisualTest') as visual_test:
+        pytest_fixtures.pytest_sessionfinish(session)
+
+    assert session.config.workeroutput == {'visual_output_directory': 'visualtests/2023-05-10_103045_firefox'}
+    visual_test.render_report.assert_not_called()
+
+
+def test_pytest_sessionfinish_controller():
+    # Controller process renders once the visual report of all finished workers
+    visual_directory = 'visualtests/2023-05-10_103045_firefox'
+    for worker_visual_directory in (visual_directory, visual_directory, None):
+        node = mock.MagicMock()
+        node.workeroutput = {'visual_output_directory': worker_visual_directory}
+        pytest_fixtures.pytest_testnodedown(node, None)
+    session = mock.MagicMock()
+    session.config = mock.MagicMock(spec=[])
+    with mock.patch('toolium.pytest_fixtures.VisualTest') as visual_test:
+        pytest_fixtures.pytest_sessionfinish(session)
+
+    visual_test.render_report.assert_called_once_with(visual_directory)
+    visual_test.update_latest_report.assert_called_once_with(visual_directory)
+    assert pytest_fixtures.workers_visual_directories == []
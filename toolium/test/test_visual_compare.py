@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2023 Telefónica Investigación y Desarrollo, S.A.U.
+This file is part of Toolium.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import os
+import shutil
+
+import pytest
+
+from toolium.driver_wrapper import DriverWrappersPool
+from toolium.visual_compare import main
+from toolium.utils.path_utils import makedirs_safe
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+visual_path = os.path.join(root_path, 'output', 'visualcompare')
+output_path = os.path.join(visual_path, 'execution')
+baseline_path = os.path.join(visual_path, 'baseline')
+report_path = os.path.join(visual_path, 'report')
+
+
+@pytest.fixture
+def visual_directories():
+    # Create previous execution and baseline folders
+    if os.path.exists(visual_path):
+        shutil.rmtree(visual_path)
+    makedirs_safe(output_path)
+    makedirs_safe(baseline_path)
+    shutil.copyfile(os.path.join(root_path, 'resources', 'register.png'), os.path.join(baseline_path, 'register.png'))
+    shutil.copyfile(os.path.join(root_path, 'resources', 'register_v2.png'),
+                    os.path.join(output_path, '01_register__test_diff.png'))
+    shutil.copyfile(os.path.join(root_path, 'resources', 'register.png'),
+                    os.path.join(output_path, '02_register__test_equal.png'))
+    shutil.copyfile(os.path.join(root_path, 'resources', 'register.png'),
+                    os.path.join(output_path, '03_register_without_baseline.png'))
+    # Baseline copies and diff images of the previous report must be ignored
+    shutil.copyfile(os.path.join(root_path, 'resources', 'register.png'), os.path.join(output_path, 'register.png'))
+    shutil.copyfile(os.path.join(root_path, 'resources', 'register_v2_diff.png'),
+                    os.path.join(output_path, '01_register__test_diff.diff.png'))
+
+    yield
+
+    DriverWrappersPool._empty_pool()
+
+
+def get_report_records():
+    """Read report records of the new report
+
+    :returns: list of result records
+    """
+    with open(os.path.join(report_path, 'VisualTests.jsonl')) as f:
+        records = [json.loads(line) for line in f]
+    return [record for record in records if record['type'] == 'result']
+
+
+def test_visual_compare_diff(visual_directories):
+    exit_code = main([output_path, baseline_path, '--report-directory', report_path, '--workers', '2'])
+
+    # Check results in the same order as previous execution
+    assert exit_code == 1
+    records = get_report_records()
+    assert [record['result'] for record in records] == ['diff', 'equal', 'diff']
+    assert 'Distance is 0.00520373, more than 0 threshold' in records[0]['row']
+    assert '<td>test_equal<br>(register)</td>' in records[1]['row']
+    assert 'Baseline file not found' in records[2]['row']
+    assert os.path.exists(os.path.join(report_path, '01_register__test_diff.diff.png'))
+    with open(os.path.join(report_path, 'VisualTests.html')) as f:
+        assert '<p><b>Visual asserts</b>: 3 (2 failed)</p>' in f.read()
+
+
+def test_visual_compare_screenshots_from_records(visual_directories):
+    # Baseline name with characters that are replaced in screenshot filenames
+    shutil.move(os.path.join(baseline_path, 'register.png'), os.path.join(baseline_path, 'register page.v1.png'))
+    os.rename(os.path.join(output_path, '02_register__test_equal.png'),
+              os.path.join(output_path, '02_register_page_v1__test_equal.png'))
+    # Baseline copy whose filename looks like a screenshot filename
+    shutil.copyfile(os.path.join(root_path, 'resources', 'register.png'), os.path.join(output_path, '01_home.png'))
+    with open(os.path.join(output_path, 'VisualTests.jsonl'), 'w') as f:
+        for name, image, baseline in (('test_diff<br>(register)', '01_register__test_diff.png', 'register.png'),
+                                      ('test_equal<br>(register page.v1)', '02_register_page_v1__test_equal.png',
+                                       'register page.v1.png')):
+            f.write(json.dumps({'type': 'result', 'result': 'equal', 'row': '', 'time': 1, 'name': name,
+                                'image': image, 'baseline': baseline}) + '\n')
+
+    exit_code = main([output_path, baseline_path, '-r', report_path, '-w', '1', '-t', '0.01'])
+
+    # Check that screenshots and baseline names have been read from records of the previous execution, ignoring
+    # screenshots without records
+    assert exit_code == 1
+    records = get_report_records()
+    assert [record['result'] for record in records] == ['diff', 'equal']
+    assert 'Baseline file not found' in records[0]['row']
+    assert '<td>test_equal<br>(register page.v1)</td>' in records[1]['row']
+    assert records[1]['baseline'] == 'register page.v1.png'
+    assert not os.path.exists(os.path.join(report_path, '01_home.png'))
+    assert not os.path.exists(os.path.join(report_path, '03_register_without_baseline.png'))
+
+
+def test_visual_compare_threshold_failed_only(visual_directories):
+    os.remove(os.path.join(output_path, '03_register_without_baseline.png'))
+    exit_code = main([output_path, baseline_path, '-r', report_path, '-w', '1', '-t', '0.01', '--failed-only'])
+
+    # Check that similar images are not added to the report
+    assert exit_code == 0
+    assert get_report_records() == []
+
+    # A new execution must replace the previous report
+    exit_code = main([output_path, baseline_path, '-r', report_path, '-w', '1', '-t', '0.01'])
+    assert exit_code == 0
+    assert [record['result'] for record in get_report_records()] == ['equal', 'equal']
+
+
+def test_visual_compare_comparison_mode(visual_directories):
+    pytest.importorskip('numpy')
+    os.remove(os.path.join(output_path, '03_register_without_baseline.png'))
+    exit_code = main([output_path, baseline_path, '-r', report_path, '-w', '1', '--comparison-mode', 'tolerance',
+                      '--comparison-tolerance', '255'])
+
+    # Differences are ignored with the maximum tolerance
+    assert exit_code == 0
+    assert [record['result'] for record in get_report_records()] == ['equal', 'equal']
+
+
+def test_visual_compare_comparison_tolerance_invalid(visual_directories):
+    pytest.importorskip('numpy')
+    with pytest.raises(ValueError) as exc:
+        main([output_path, baseline_path, '-r', report_path, '-m', 'ssim', '--comparison-tolerance', '16'])
+    assert str(exc.value) == "Invalid visual ssim_tolerance '16.0', valid values are numbers from 0 to 1"
+    with pytest.raises(ValueError) as exc:
+        main([output_path, baseline_path, '-r', report_path, '--comparison-tolerance', '16'])
+    assert str(exc.value) == "Visual comparison mode 'pixel' has no tolerance"
@@ -17,12 +17,16 @@ limitations under the License.
 """
 
 import inspect
+import json
 import mock
 import os
 import pytest
 import re
 import shutil
-from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from PIL import Image, ImageChops
+from selenium.common.exceptions import WebDriverException
 
 from toolium.config_files import ConfigFiles
 from toolium.driver_wrapper import DriverWrapper
@@ -43,6 +47,10 @@ orig_file_ios = os.path.join(root_path, 'resources', 'ios.png')
 orig_file_ios_web = os.path.join(root_path, 'resources', 'ios_web.png')
 orig_file_mac = os.path.join(root_path, 'resources', 'mac_os_retina.png')
 
+# Copies of expected images, to avoid saving baseline digests in resources folder
+resources_path = os.path.join(root_path, 'resources')
+expected_path = os.path.join(root_path, 'output', 'visualtests', 'expected')
+
 # Baseline file paths
 baselines_path = os.path.join(root_path, 'output', 'visualtests', 'baseline', 'firefox')
 file_v1 = os.path.join(baselines_path, 'register.png')
@@ -99,6 +107,10 @@ def driver_wrapper():
     driver_wrapper.configure(config_files)
     driver_wrapper.config.set('VisualTests', 'enabled', 'true')
     DriverWrappersPool.visual_output_directory = os.path.join(visual_path, 'execution')
+    # Restart visual numbers, because the visual output folder is reused in all tests
+    counter_path = os.path.join(DriverWrappersPool.visual_output_directory, DriverWrappersPool.visual_number_name)
+    if os.path.exists(counter_path):
+        os.remove(counter_path)
 
     yield driver_wrapper
 
@@ -135,6 +147,9 @@ def compare_image_files(visual, report_name, image, expected_image, expected_res
     :param expected_result: expected result
     :param threshold: allowed threshold
     """
+    if os.path.dirname(expected_image) == resources_path:
+        makedirs_safe(expected_path)
+        expected_image = shutil.copyfile(expected_image, os.path.join(expected_path, os.path.basename(expected_image)))
     assert visual.compare_files(report_name, image, expected_image, threshold) == expected_result
 
 
@@ -194,7 +209,8 @@ def test_compare_files_diff_fail(driver_wrapper):
     with pytest.raises(AssertionError) as exc:
         visual.compare_files(current_method_name(), file_v2, file_v1, 0)
     assert str(exc.value) == f"The new screenshot '{file_v2}' did not match the baseline '{file_v1}' " \
-                             f"(by a distance of 0.00520373, more than 0 threshold)"
+                             f"(by a distance of 0.00520373, more than 0 threshold). " \
+                             f"Different regions: (440, 218, 558, 247): 3392 pixels"
 
 
 def test_compare_files_diff_fail_with_threshold(driver_wrapper):
@@ -205,7 +221,247 @@ def test_compare_files_diff_fail_with_threshold(driver_wrapper):
     with pytest.raises(AssertionError) as exc:
         visual.compare_files(current_method_name(), file_v2, file_v1, 0.005)
     assert str(exc.value) == f"The new screenshot '{file_v2}' did not match the baseline '{file_v1}' " \
-                             f"(by a distance of 0.00520373, more than 0.005 threshold)"
+                             f"(by a distance of 0.00520373, more than 0.005 threshold). " \
+                             f"Different regions: (440, 218, 558, 247): 3392 pixels"
+
+
+def test_compare_files_diff_pil_engine(driver_wrapper):
+    # Update conf and create a new VisualTest instance
+    driver_wrapper.config.set('VisualTests', 'diff_engine', 'pil')
+    visual = VisualTest(driver_wrapper)
+    expected_result = 'diff-Distance is 0.00520373, more than 0 threshold'
+    assert visual.compare_files(current_method_name(), file_v2, file_v1, 0) == expected_result
+
+
+def test_compare_files_diff_numpy_engine_without_numpy(driver_wrapper):
+    # Update conf and create a new VisualTest instance
+    driver_wrapper.config.set('VisualTests', 'diff_engine', 'numpy')
+    visual = VisualTest(driver_wrapper)
+    with mock.patch('toolium.visual_test.numpy', None):
+        assert visual.get_diff_engine() == 'pil'
+        expected_result = 'diff-Distance is 0.00520373, more than 0 threshold'
+        assert visual.compare_files(current_method_name(), file_v2, file_v1, 0) == expected_result
+
+
+def test_get_diff_engine_unknown(driver_wrapper):
+    # Update conf and create a new VisualTest instance
+    driver_wrapper.config.set('VisualTests', 'diff_engine', 'unknown')
+    visual = VisualTest(driver_wrapper)
+    with pytest.raises(ValueError) as exc:
+        visual.get_diff_engine()
+    assert str(exc.value) == "Unknown visual diff engine 'unknown', valid values are: numpy, pil"
+
+
+def test_save_differences_image_engines(driver_wrapper):
+    pytest.importorskip('numpy')
+    visual = VisualTest(driver_wrapper)
+    image = Image.open(file_v2).convert('RGB')
+    baseline = Image.open(file_v1).convert('RGB')
+    pil_diff_path = os.path.join(visual.output_directory, f'{current_method_name()}_pil.diff.png')
+    numpy_diff_path = os.path.join(visual.output_directory, f'{current_method_name()}_numpy.diff.png')
+
+    # Both engines must calculate the same distance and generate the same diff image
+    pil_distance = visual.save_differences_image(image.copy(), baseline.copy(), pil_diff_path, 'pil')
+    numpy_distance = visual.save_differences_image(image.copy(), baseline.copy(), numpy_diff_path, 'numpy')
+    assert pil_distance == numpy_distance
+    assert ImageChops.difference(Image.open(pil_diff_path), Image.open(numpy_diff_path)).getbbox() is None
+
+
+is_under_threshold_tests = (
+    ('pil', 0, False),
+    ('pil', 0.005, False),
+    ('pil', 0.01, True),
+    ('numpy', 0, False),
+    ('numpy', 0.005, False),
+    ('numpy', 0.01, True),
+)
+
+
+@pytest.mark.parametrize('engine, threshold, expected_result', is_under_threshold_tests)
+@pytest.mark.parametrize('tile_height', [1, 100, 1000])
+def test_is_under_threshold(engine, threshold, expected_result, tile_height):
+    if engine == 'numpy':
+        pytest.importorskip('numpy')
+    image = Image.open(file_v2).convert('RGB')
+    baseline = Image.open(file_v1).convert('RGB')
+    assert VisualTest.is_under_threshold(image, baseline, threshold, engine, tile_height) is expected_result
+
+
+def get_comparison_mode_images():
+    # Baseline with a black square and image with an isolated black pixel and a block of 3x3 almost white pixels
+    baseline = Image.new('RGB', (20, 20), (255, 255, 255))
+    baseline.paste((0, 0, 0), (5, 5, 10, 10))
+    image = baseline.copy()
+    image.putpixel((15, 15), (0, 0, 0))
+    image.paste((250, 250, 250), (0, 0, 3, 3))
+    return image, baseline
+
+
+comparison_mode_tests = (
+    ('pixel', None, 10),
+    ('tolerance', 16, 1),
+    ('tolerance', 4, 10),
+    ('isolated', None, 9),
+    ('ssim', 0.95, 9),
+    ('ssim', 0.5, 1),
+)
+
+
+@pytest.mark.parametrize('comparison_mode, tolerance, expected_diff_pixels', comparison_mode_tests)
+def test_get_differences_image_comparison_modes(comparison_mode, tolerance, expected_diff_pixels):
+    pytest.importorskip('numpy')
+    image, baseline = get_comparison_mode_images()
+    diff_pixels_percentage = expected_diff_pixels / 400
+
+    _, distance = VisualTest.get_differences_image(image, baseline.copy(), 'pil', comparison_mode, tolerance)
+    assert distance == diff_pixels_percentage
+    # Tiled comparison must get the same result
+    for tile_height in (1, 3, 20):
+        assert VisualTest.is_under_threshold(image, baseline, diff_pixels_percentage, 'numpy', tile_height,
+                                             comparison_mode, tolerance)
+        assert not VisualTest.is_under_threshold(image, baseline, diff_pixels_percentage - 0.001, 'numpy',
+                                                 tile_height, comparison_mode, tolerance)
+
+
+def test_compare_files_comparison_mode(driver_wrapper):
+    pytest.importorskip('numpy')
+    # Update conf and create a new VisualTest instance
+    driver_wrapper.config.set('VisualTests', 'channel_tolerance', '255')
+    visual = VisualTest(driver_wrapper)
+
+    # Comparison mode of the assert has priority over configured comparison mode
+    assert visual.compare_files(current_method_name(), file_v2, file_v1, 0, comparison_mode='tolerance') == 'equal'
+    driver_wrapper.config.set('VisualTests', 'comparison_mode', 'tolerance')
+    assert visual.compare_files(current_method_name(), file_v2, file_v1, 0) == 'equal'
+    expected_result = 'diff-Distance is 0.00520373, more than 0 threshold'
+    assert visual.compare_files(current_method_name(), file_v2, file_v1, 0, comparison_mode='pixel') == expected_result
+
+
+def test_get_comparison_mode(driver_wrapper):
+    visual = VisualTest(driver_wrapper)
+    assert visual.get_comparison_mode() == ('pixel', None)
+    driver_wrapper.config.set('VisualTests', 'comparison_mode', 'ssim')
+    assert visual.get_comparison_mode() == ('ssim', 0.95)
+    assert visual.get_comparison_mode('tolerance') == ('tolerance', 16)
+    driver_wrapper.config.set('VisualTests', 'channel_tolerance', '8')
+    assert visual.get_comparison_mode('tolerance') == ('tolerance', 8)
+    # Each comparison mode has its own tolerance
+    assert visual.get_comparison_mode('ssim') == ('ssim', 0.95)
+    driver_wrapper.config.set('VisualTests', 'ssim_tolerance', '0.8')
+    assert visual.get_comparison_mode('ssim') == ('ssim', 0.8)
+    assert visual.get_comparison_mode('isolated') == ('isolated', None)
+
+
+comparison_tolerance_tests = (
+    ('tolerance', 'channel_tolerance', '256', 'from 0 to 255'),
+    ('tolerance', 'channel_tolerance', '-1', 'from 0 to 255'),
+    ('ssim', 'ssim_tolerance', '16', 'from 0 to 1'),
+    ('ssim', 'ssim_tolerance', 'high', 'from 0 to 1'),
+)
+
+
+@pytest.mark.parametrize('comparison_mode, option, tolerance, valid_values', comparison_tolerance_tests)
+def test_get_comparison_mode_invalid_tolerance(comparison_mode, option, tolerance, valid_values, driver_wrapper):
+    driver_wrapper.config.set('VisualTests', option, tolerance)
+    visual = VisualTest(driver_wrapper)
+    with pytest.raises(ValueError) as exc:
+        visual.get_comparison_mode(comparison_mode)
+    assert str(exc.value) == f"Invalid visual {option} '{tolerance}', valid values are numbers {valid_values}"
+
+
+def test_get_comparison_mode_unknown(driver_wrapper):
+    visual = VisualTest(driver_wrapper)
+    with pytest.raises(ValueError) as exc:
+        visual.get_comparison_mode('unknown')
+    assert str(exc.value) == "Unknown visual comparison mode 'unknown', valid values are: pixel, tolerance, isolated," \
+                             " ssim"
+
+
+def test_get_comparison_mode_without_numpy(driver_wrapper):
+    visual = VisualTest(driver_wrapper)
+    with mock.patch('toolium.visual_test.numpy', None):
+        assert visual.get_comparison_mode('pixel') == ('pixel', None)
+        with pytest.raises(ImportError) as exc:
+            visual.get_comparison_mode('ssim')
+    assert str(exc.value) == "numpy must be installed to use 'ssim' visual comparison mode"
+
+
+def test_compare_files_similar_early_exit(driver_wrapper):
+    # Update conf and create a new VisualTest instance
+    driver_wrapper.config.set('VisualTests', 'early_exit', 'true')
+    driver_wrapper.config.set('VisualTests', 'complete_report', 'false')
+    visual = VisualTest(driver_wrapper)
+
+    # Differences image is not generated because the result is not added to the report
+    with mock.patch.object(VisualTest, 'get_differences_image') as get_differences_image:
+        assert visual.compare_files(current_method_name(), file_v2, file_v1, 0.01) == 'equal'
+    get_differences_image.assert_not_called()
+
+
+def test_compare_files_similar_early_exit_complete_report(driver_wrapper):
+    # Update conf and create a new VisualTest instance
+    driver_wrapper.config.set('VisualTests', 'early_exit', 'true')
+    visual = VisualTest(driver_wrapper)
+
+    # Exact distance is calculated because the result is added to the report
+    with mock.patch.object(VisualTest, 'is_under_threshold') as is_under_threshold:
+        expected_result = 'equal-Distance is 0.00520373, less than 0.01 threshold'
+        assert visual.compare_files(current_method_name(), file_v2, file_v1, 0.01) == expected_result
+    is_under_threshold.assert_not_called()
+
+
+def test_compare_files_diff_early_exit(driver_wrapper):
+    # Update conf and create a new VisualTest instance
+    driver_wrapper.config.set('VisualTests', 'early_exit', 'true')
+    driver_wrapper.config.set('VisualTests', 'complete_report', 'false')
+    visual = VisualTest(driver_wrapper)
+
+    # Exact distance and differences image are calculated for failed comparisons
+    expected_result = 'diff-Distance is 0.00520373, more than 0.005 threshold'
+    assert visual.compare_files(current_method_name(), file_v2, file_v1, 0.005) == expected_result
+
+
+def test_compare_files_equal_cached_digest(driver_wrapper):
+    visual = VisualTest(driver_wrapper)
+    baseline_path = os.path.join(baselines_path, f'{current_method_name()}.png')
+    shutil.copyfile(file_v1, baseline_path)
+
+    # First comparison saves baseline digest
+    assert visual.compare_files(current_method_name(), file_v1, baseline_path, 0) == 'equal'
+    assert os.path.exists(f'{baseline_path}.sha256')
+
+    # Second comparison uses cached digest, so baseline is not decoded and diff image is not generated
+    with mock.patch('toolium.visual_test.Image.open', wraps=Image.open) as image_open, \
+            mock.patch.object(VisualTest, 'save_differences_image') as save_differences_image:
+        assert visual.compare_files(current_method_name(), file_v1, baseline_path, 0) == 'equal'
+    image_open.assert_called_once_with(file_v1)
+    save_differences_image.assert_not_called()
+
+
+def test_compare_files_diff_outdated_cached_digest(driver_wrapper):
+    visual = VisualTest(driver_wrapper)
+    baseline_path = os.path.join(baselines_path, f'{current_method_name()}.png')
+    shutil.copyfile(file_v1, baseline_path)
+    assert visual.compare_files(current_method_name(), file_v1, baseline_path, 0) == 'equal'
+
+    # Cached digest must be ignored after baseline is modified
+    shutil.copyfile(file_v2, baseline_path)
+    expected_result = 'diff-Distance is 0.00520373, more than 0 threshold'
+    assert visual.compare_files(current_method_name(), file_v1, baseline_path, 0) == expected_result
+
+
+def test_compare_files_diff_baseline_cache(driver_wrapper):
+    driver_wrapper.config.set('VisualTests', 'baseline_cache_size', '10')
+    visual = VisualTest(driver_wrapper)
+    VisualTest.baseline_cache.clear()
+    expected_result = 'diff-Distance is 0.00520373, more than 0 threshold'
+    assert visual.compare_files(current_method_name(), file_v2, file_v1, 0) == expected_result
+
+    # Second comparison uses cached baseline, so baseline is not decoded again
+    with mock.patch('toolium.visual_test.Image.open', wraps=Image.open) as image_open:
+        assert visual.compare_files(current_method_name(), file_v2, file_v1, 0) == expected_result
+    image_open.assert_called_once_with(file_v2)
+    VisualTest.baseline_cache.clear()
 
 
 def test_compare_files_size(driver_wrapper):
@@ -226,15 +482,16 @@ def test_compare_files_size_fail(driver_wrapper):
 
 
 def test_get_img_element(driver_wrapper):
-    expected_img = r'<img src=".*register_v2.png" title="Baseline image"/>'
+    expected_img = r'<img src=".*register_v2.png" title="Baseline image" loading="lazy"/>'
     visual = VisualTest(driver_wrapper)
     img = visual._get_img_element('register_v2.png', 'Baseline image')
     assert re.compile(expected_img).match(img) is not None
 
 
 def test_get_html_row(driver_wrapper):
-    expected_row = r'<tr class=diff><td>report_name</td><td><img src=".*register_v2.png" title="Baseline image"/>' \
-                   r'</td><td><img src=".*register.png" title="Screenshot image"/></td><td></td></tr>'
+    expected_row = r'<tr class=diff><td>report_name</td>' \
+                   r'<td><img src=".*register_v2.png" title="Baseline image" loading="lazy"/>' \
+                   r'</td><td><img src=".*register.png" title="Screenshot image" loading="lazy"/></td><td></td></tr>'
     visual = VisualTest(driver_wrapper)
     row = visual._get_html_row('diff', 'report_name', file_v1, file_v2, None, None)
     assert re.compile(expected_row).match(row) is not None
@@ -242,8 +499,10 @@ def test_get_html_row(driver_wrapper):
 
 def test_get_html_row_message(driver_wrapper):
     result_message = 'Distance is 0.00520373, more than 0 threshold'
-    expected_row = r'<tr class=diff><td>report_name</td><td><img src=".*register_v2.png" title="Baseline image"/>' \
-                   f'</td><td><img src=".*register.png" title="Screenshot image"/></td><td>{result_message}</td></tr>'
+    expected_row = r'<tr class=diff><td>report_name</td>' \
+                   r'<td><img src=".*register_v2.png" title="Baseline image" loading="lazy"/>' \
+                   r'</td><td><img src=".*register.png" title="Screenshot image" loading="lazy"/></td>' \
+                   f'<td>{result_message}</td></tr>'
     visual = VisualTest(driver_wrapper)
     row = visual._get_html_row('diff', 'report_name', file_v1, file_v2, None, result_message)
     assert re.compile(expected_row).match(row) is not None
@@ -251,14 +510,178 @@ def test_get_html_row_message(driver_wrapper):
 
 def test_get_html_row_with_diff_image(driver_wrapper):
     result_message = 'Distance is 0.00520373, more than 0 threshold'
-    expected_row = r'<tr class=diff><td>report_name</td><td><img src=".*register_v2.png" title="Baseline image"/>' \
-                   r'</td><td><img src=".*register.png" title="Screenshot image"/></td>' \
-                   f'<td><img src=".*register_v2.diff.png" title="{result_message}"/></td></tr>'
+    expected_row = r'<tr class=diff><td>report_name</td>' \
+                   r'<td><img src=".*register_v2.png" title="Baseline image" loading="lazy"/>' \
+                   r'</td><td><img src=".*register.png" title="Screenshot image" loading="lazy"/></td>' \
+                   f'<td><img src=".*register_v2.diff.png" title="{result_message}" loading="lazy"/></td></tr>'
+    visual = VisualTest(driver_wrapper)
+    row = visual._get_html_row('diff', 'report_name', file_v1, file_v2, file_v2_diff, result_message)
+    assert re.compile(expected_row).match(row) is not None
+
+
+def test_get_html_row_with_regions(driver_wrapper):
+    result_message = 'Distance is 0.00520373, more than 0 threshold'
+    thumbnail_path = os.path.join(DriverWrappersPool.visual_output_directory, 'regions', 'register_v2.1.png')
+    expected_row = r'<tr class=diff><td>report_name</td>' \
+                   r'<td><img src=".*register_v2.png" title="Baseline image" loading="lazy"/>' \
+                   r'</td><td><img src=".*register.png" title="Screenshot image" loading="lazy"/></td>' \
+                   f'<td><img class="thumbnail" src=".*regions/register_v2.1.png" title="{result_message}"' \
+                   r' data-full-src=".*register_v2.diff.png" loading="lazy"/></td></tr>'
+    visual = VisualTest(driver_wrapper)
+    row = visual._get_html_row('diff', 'report_name', file_v1, file_v2, file_v2_diff, result_message,
+                               [{'box': [440, 218, 558, 247], 'pixels': 3392, 'thumbnail': thumbnail_path}])
+    assert re.compile(expected_row).match(row) is not None
+
+
+def test_get_html_row_with_thumbnails(driver_wrapper):
+    driver_wrapper.config.set('VisualTests', 'report_thumbnail_width', '200')
+    result_message = 'Distance is 0.00520373, more than 0 threshold'
+    expected_row = r'<tr class=diff><td>report_name</td>' \
+                   r'<td><img src="thumbnails/register_v2.png" title="Baseline image"' \
+                   r' data-full-src=".*register_v2.png" loading="lazy"/>' \
+                   r'</td><td><img src="thumbnails/register.png" title="Screenshot image"' \
+                   r' data-full-src=".*register.png" loading="lazy"/></td>' \
+                   f'<td><img src="thumbnails/register_v2.diff.png" title="{result_message}"' \
+                   r' data-full-src=".*register_v2.diff.png" loading="lazy"/></td></tr>'
     visual = VisualTest(driver_wrapper)
     row = visual._get_html_row('diff', 'report_name', file_v1, file_v2, file_v2_diff, result_message)
     assert re.compile(expected_row).match(row) is not None
 
 
+def test_compare_files_diff_thumbnails(driver_wrapper):
+    driver_wrapper.config.set('VisualTests', 'report_thumbnail_width', '200')
+    visual = VisualTest(driver_wrapper)
+    image_path = os.path.join(visual.output_directory, f'{current_method_name()}.png')
+    shutil.copyfile(file_v2, image_path)
+    visual.compare_files(current_method_name(), image_path, file_v1, 0)
+    VisualTest.wait_pending_thumbnails()
+
+    # Thumbnails of baseline and screenshot images are generated in background
+    thumbnails_directory = os.path.join(visual.output_directory, 'thumbnails')
+    assert Image.open(os.path.join(thumbnails_directory, 'register.png')).size == (200, 46)
+    assert Image.open(os.path.join(thumbnails_directory, f'{current_method_name()}.png')).size == (200, 46)
+    assert VisualTest.thumbnails_executor is None
+
+
+def test_get_differences_regions():
+    pytest.importorskip('numpy')
+    diff_image = Image.new('RGB', (100, 60), (255, 255, 255))
+    # Near pixels are joined in the same region
+    diff_image.paste((255, 0, 0), (10, 10, 20, 15))
+    diff_image.putpixel((22, 12), (255, 0, 0))
+    diff_image.paste((255, 0, 0), (80, 50, 85, 55))
+    # Pixels similar to red are not differences
+    diff_image.putpixel((50, 30), (255, 128, 128))
+
+    assert VisualTest.get_differences_regions(diff_image) == [{'box': [10, 10, 23, 15], 'pixels': 51},
+                                                              {'box': [80, 50, 85, 55], 'pixels': 25}]
+    assert VisualTest.get_differences_regions(diff_image, block_size=2) == [{'box': [10, 10, 20, 15], 'pixels': 50},
+                                                                            {'box': [80, 50, 85, 55], 'pixels': 25},
+                                                                            {'box': [22, 12, 23, 13], 'pixels': 1}]
+
+
+def test_get_differences_regions_diagonal():
+    pytest.importorskip('numpy')
+    diff_image = Image.new('RGB', (60, 60), (255, 255, 255))
+    for position in range(60):
+        diff_image.putpixel((position, position), (255, 0, 0))
+
+    assert VisualTest.get_differences_regions(diff_image, block_size=2) == [{'box': [0, 0, 60, 60], 'pixels': 60}]
+    assert VisualTest.get_differences_regions(Image.new('RGB', (60, 60), (255, 255, 255))) == []
+
+
+def test_compare_files_diff_regions(driver_wrapper):
+    pytest.importorskip('numpy')
+    visual = VisualTest(driver_wrapper)
+    image_path = os.path.join(visual.output_directory, f'{current_method_name()}.png')
+    shutil.copyfile(file_v2, image_path)
+    baseline_files = sorted(os.listdir(baselines_path))
+    visual.compare_files(current_method_name(), image_path, file_v1, 0)
+
+    # Regions are saved in the report record and their thumbnails are shown in the report
+    with open(os.path.join(visual.output_directory, VisualTest.records_name)) as f:
+        record = json.loads(f.readlines()[-1])
+    assert record['regions'] == [{'box': [440, 218, 558, 247], 'pixels': 3392}]
+    thumbnail_path = os.path.join(visual.output_directory, 'regions', f'{current_method_name()}.1.png')
+    assert Image.open(thumbnail_path).size == (150, 61)
+    assert f'src="regions/{current_method_name()}.1.png"' in record['row']
+    assert f'data-full-src="{current_method_name()}.diff.png"' in record['row']
+    # Report images are never saved in the baseline folder
+    assert sorted(os.listdir(baselines_path)) == baseline_files
+
+
+def test_compare_files_diff_regions_image_outside_report(driver_wrapper):
+    pytest.importorskip('numpy')
+    visual = VisualTest(driver_wrapper)
+    shutil.rmtree(os.path.join(baselines_path, 'regions'), ignore_errors=True)
+    visual.compare_files(current_method_name(), file_v2, file_v1, 0)
+
+    # Regions thumbnails are saved in the report folder, even if the compared image is in other folder
+    assert os.path.exists(os.path.join(visual.output_directory, 'regions', 'register_v2.1.png'))
+    assert not os.path.exists(os.path.join(baselines_path, 'regions'))
+
+
+def test_render_report(driver_wrapper):
+    visual = VisualTest(driver_wrapper)
+    visual.compare_files(current_method_name(), file_v2, file_v1, 0)
+    VisualTest.render_report()
+
+    # Check that the report contains the summary and the new result row
+    records_path = os.path.join(visual.output_directory, VisualTest.records_name)
+    with open(records_path) as f:
+        results_number = len([line for line in f if '"type": "result"' in line])
+    with open(os.path.join(visual.output_directory, VisualTest.report_name)) as f:
+        report = f.read()
+    assert '<p><b>Baseline name</b>: firefox</p>' in report
+    assert re.search(f'<p><b>Visual asserts</b>: {results_number} \\([0-9]+ failed\\)</p>', report)
+    assert f'<tr class=diff><td>{current_method_name()}</td>' in report
+    assert report.index(f'<td>{current_method_name()}</td>') < report.index('</tbody>')
+
+
+def test_render_report_with_shards(driver_wrapper):
+    output_directory = os.path.join(root_path, 'output', 'visualtests', current_method_name())
+    shutil.rmtree(output_directory, ignore_errors=True)
+    DriverWrappersPool.visual_output_directory = output_directory
+    visual = VisualTest(driver_wrapper)
+
+    # Each worker saves its records in its own shard file
+    for worker, report_name in (('gw0', 'first'), ('gw1', 'second'), ('gw0', 'third')):
+        with mock.patch.dict(os.environ, {'PYTEST_XDIST_WORKER': worker}):
+            visual._add_result_to_report('diff', report_name, file_v2, None, None, 'Baseline file not found')
+    assert sorted(os.listdir(output_directory)) == ['VisualTests.css', 'VisualTests.gw0.jsonl', 'VisualTests.gw1.jsonl',
+                                                    'VisualTests.html', 'VisualTests.js', 'VisualTests.jsonl']
+
+    # All shards are merged in the report
+    VisualTest.render_report(output_directory)
+    with open(os.path.join(output_directory, VisualTest.report_name)) as f:
+        report = f.read()
+    assert '<p><b>Visual asserts</b>: 3 (3 failed)</p>' in report
+    assert report.index('<td>first</td>') < report.index('<td>second</td>') < report.index('<td>third</td>')
+
+
+def test_get_visual_number_parallel(driver_wrapper):
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        numbers = list(executor.map(lambda _: DriverWrappersPool.get_visual_number(), range(20)))
+    assert sorted(numbers) == list(range(1, 21))
+    assert DriverWrappersPool.visual_number == 21
+
+
+def test_render_report_interval(driver_wrapper):
+    driver_wrapper.config.set('VisualTests', 'report_render_interval', '0.000001')
+    visual = VisualTest(driver_wrapper)
+
+    # Check that the report is rendered when a new result is added
+    with mock.patch.object(VisualTest, 'render_report') as render_report:
+        visual.compare_files(current_method_name(), file_v2, file_v1, 0)
+    render_report.assert_called_once_with(visual.output_directory)
+
+
+def test_render_report_without_records(driver_wrapper):
+    output_directory = os.path.join(root_path, 'output', 'visualtests', current_method_name())
+    VisualTest.render_report(output_directory)
+    assert not os.path.exists(os.path.join(output_directory, VisualTest.report_name))
+
+
 def test_crop_element(driver_wrapper):
     # Create element mock
     driver_wrapper.driver.execute_script.return_value = 0  # scrollX=0 and scrollY=0
@@ -451,6 +874,23 @@ def test_exclude_element_outofimage(driver_wrapper):
     assert_image(visual, img, current_method_name(), 'register_exclude_outofimage')
 
 
+def test_exclude_element_negative_position(driver_wrapper):
+    # Create elements mock
+    visual = VisualTest(driver_wrapper)
+    driver_wrapper.driver.execute_script.return_value = 0  # scrollX=0 and scrollY=0
+    web_elements = [get_mock_element(x=-100, y=40, height=40, width=300)]
+    img = Image.open(file_v1)
+
+    # Exclude elements
+    img = visual.exclude_elements(img, web_elements)
+
+    # Only the visible part of the element must be excluded
+    assert img.getpixel((0, 40)) == (0, 0, 0, 255)
+    assert img.getpixel((199, 79)) == (0, 0, 0, 255)
+    assert img.getpixel((200, 40)) != (0, 0, 0, 255)
+    assert img.getpixel((img.size[0] - 1, 40)) != (0, 0, 0, 255)
+
+
 def test_exclude_no_elements(driver_wrapper):
     # Exclude no elements
     visual = VisualTest(driver_wrapper)
@@ -494,7 +934,7 @@ def test_assert_screenshot_no_enabled_force_fail(driver_wrapper):
         visual.assert_screenshot(None, filename=filename, file_suffix=current_method_name())
     driver_wrapper.driver.get_screenshot_as_png.assert_called_once_with()
     assert str(exc.value).endswith(f"did not match the baseline '{file_v1}' (by a distance of 0.00520373,"
-                                   f" more than 0 threshold)")
+                                   f" more than 0 threshold). Different regions: (440, 218, 558, 247): 3392 pixels")
 
 
 def test_assert_screenshot_full_and_save_baseline(driver_wrapper):
@@ -514,6 +954,131 @@ def test_assert_screenshot_full_and_save_baseline(driver_wrapper):
     # Output image and new baseline image must be equal
     baseline_path = os.path.join(baselines_path, f'{filename}.png')
     compare_image_files(visual, current_method_name(), output_path, baseline_path)
+    assert os.path.exists(f'{baseline_path}.sha256')
+
+
+def configure_scrolled_page(driver_wrapper, page, viewport_height):
+    """Configure driver mock to capture viewport screenshots of a page image scrolled by the page size script
+
+    :param driver_wrapper: driver wrapper instance
+    :param page: page image object
+    :param viewport_height: viewport height in pixels
+    """
+    scroll = {'y': 50}
+
+    def execute_script(script, *args):
+        if script == VisualTest.scroll_script:
+            previous_scroll_y, scroll['y'] = scroll['y'], min(args[0], page.height - viewport_height)
+            return {'scrollX': 0, 'scrollY': previous_scroll_y, 'newScrollY': scroll['y'], 'pageHeight': page.height}
+        if script == VisualTest.geometry_script:
+            return {'scrollHeight': page.height, 'scrollWidth': page.width, 'innerHeight': viewport_height,
+                    'innerWidth': page.width, 'rects': [[0, 240, 100, 260] for _ in args]}
+        scroll['y'] = args[1]
+
+    def get_screenshot_as_png():
+        screenshot = BytesIO()
+        page.crop((0, scroll['y'], page.width, scroll['y'] + viewport_height)).save(screenshot, 'PNG')
+        return screenshot.getvalue()
+
+    driver_wrapper.driver.execute_script.side_effect = execute_script
+    driver_wrapper.driver.get_screenshot_as_png.side_effect = get_screenshot_as_png
+    return scroll
+
+
+def test_get_full_page_screenshot(driver_wrapper):
+    page = Image.open(file_v1).convert('RGB').resize((420, 1000))
+    scroll = configure_scrolled_page(driver_wrapper, page, 300)
+    visual = VisualTest(driver_wrapper)
+
+    img = visual.get_full_page_screenshot(None, [])
+
+    # Viewport screenshots are stitched in the page image and original scroll position is restored
+    assert img.size == (420, 1000)
+    assert ImageChops.difference(img, page).getbbox() is None
+    assert driver_wrapper.driver.get_screenshot_as_png.call_count == 4
+    assert scroll['y'] == 50
+
+
+def test_get_full_page_screenshot_exclude_and_crop(driver_wrapper):
+    page = Image.open(file_v1).convert('RGB').resize((420, 1000))
+    configure_scrolled_page(driver_wrapper, page, 300)
+    visual = VisualTest(driver_wrapper)
+    web_element = get_mock_element(x=0, y=240, height=20, width=100)
+    exclude_element = get_mock_element(x=0, y=240, height=20, width=100)
+
+    # Element and excluded element boxes are page coordinates
+    img = visual.get_full_page_screenshot(web_element, [exclude_element])
+    assert img.size == (100, 20)
+    assert img.convert('RGB').getcolors() == [(2000, (0, 0, 0))]
+
+
+def test_get_full_page_screenshot_mobile(driver_wrapper):
+    driver_wrapper.is_mobile_test = mock.MagicMock(return_value=True)
+    visual = VisualTest(driver_wrapper)
+
+    with pytest.raises(ValueError) as exc:
+        visual.get_full_page_screenshot(None, [])
+    assert str(exc.value) == 'Full page screenshots are only available in desktop browsers'
+
+
+def test_assert_screenshot_full_page_and_save_baseline(driver_wrapper):
+    page = Image.open(file_v1).convert('RGB').resize((420, 1000))
+    configure_scrolled_page(driver_wrapper, page, 300)
+    driver_wrapper.config.set('VisualTests', 'save', 'true')
+    visual = VisualTest(driver_wrapper)
+
+    filename = current_method_name()
+    visual.assert_screenshot(None, filename=filename, file_suffix=current_method_name(), full_page=True)
+
+    baseline_path = os.path.join(baselines_path, f'{filename}.png')
+    assert Image.open(baseline_path).size == (420, 1000)
+
+
+@pytest.mark.parametrize('engine, comparison_mode', [('numpy', 'pixel'), ('pil', 'pixel'), ('numpy', 'tolerance'),
+                                                     ('numpy', 'isolated'), ('numpy', 'ssim')])
+def test_get_differences_image_strips(engine, comparison_mode):
+    if engine == 'numpy' or comparison_mode != 'pixel':
+        pytest.importorskip('numpy')
+    image = Image.open(file_v2).convert('RGB')
+    baseline = Image.open(file_v1).convert('RGB')
+    tolerance = VisualTest.default_comparison_tolerances.get(comparison_mode)
+
+    # Differences calculated in strips must be equal to differences of the whole image
+    diff_image, percentage = VisualTest.get_differences_image(image, baseline.copy(), engine, comparison_mode,
+                                                              tolerance)
+    strips_diff_image, strips_percentage = VisualTest.get_differences_image(image, baseline.copy(), engine,
+                                                                            comparison_mode, tolerance, 50)
+    assert strips_percentage == percentage
+    assert ImageChops.difference(strips_diff_image, diff_image).getbbox() is None
+
+
+@pytest.mark.parametrize('baseline_store', ['content', 'pack'])
+def test_assert_screenshot_full_baseline_store(driver_wrapper, baseline_store):
+    # Configure driver mock
+    with open(file_v1, "rb") as f:
+        image_data = f.read()
+    driver_wrapper.driver.get_screenshot_as_png.return_value = image_data
+    driver_wrapper.config.set('VisualTests', 'save', 'true')
+    driver_wrapper.config.set('VisualTests', 'baseline_store', baseline_store)
+    visual = VisualTest(driver_wrapper)
+
+    # Baseline is saved in the store instead of in a file of the baseline folder
+    filename = f'{current_method_name()}_{baseline_store}'
+    visual.assert_screenshot(None, filename=filename)
+    baseline_path = os.path.join(baselines_path, f'{filename}.png')
+    assert not os.path.exists(baseline_path)
+    assert visual.baseline_store.exists(baseline_path)
+
+    # Next screenshots are compared with the saved baseline
+    driver_wrapper.config.set('VisualTests', 'save', 'false')
+    driver_wrapper.config.set('VisualTests', 'fail', 'true')
+    visual = VisualTest(driver_wrapper)
+    visual.assert_screenshot(None, filename=filename)
+    with open(file_v2, "rb") as f:
+        driver_wrapper.driver.get_screenshot_as_png.return_value = f.read()
+    with pytest.raises(AssertionError):
+        visual.assert_screenshot(None, filename=filename)
+    assert os.path.exists(os.path.join(visual.output_directory, f'{filename}.png'))
 
 
 def test_assert_screenshot_element_and_save_baseline(driver_wrapper):
@@ -556,6 +1121,50 @@ def test_assert_screenshot_full_and_compare(driver_wrapper):
     driver_wrapper.driver.get_screenshot_as_png.assert_called_once_with()
 
 
+def test_assert_screenshot_full_and_compare_without_complete_report(driver_wrapper):
+    # Configure driver mock
+    with open(file_v1, "rb") as f:
+        image_data = f.read()
+    driver_wrapper.driver.get_screenshot_as_png.return_value = image_data
+    driver_wrapper.config.set('VisualTests', 'complete_report', 'false')
+    visual = VisualTest(driver_wrapper)
+
+    # Assert screenshot
+    filename = os.path.splitext(os.path.basename(file_v1))[0]
+    visual.assert_screenshot(None, filename=filename, file_suffix=current_method_name())
+
+    # Check that equal screenshot has not been saved, because it is not added to the report
+    output_path = os.path.join(visual.output_directory, f'01_{filename}__{current_method_name()}.png')
+    assert not os.path.exists(output_path)
+
+
+def test_assert_screenshot_full_and_compare_diff_saved(driver_wrapper):
+    # Configure driver mock
+    with open(file_v2, "rb") as f:
+        image_data = f.read()
+    driver_wrapper.driver.get_screenshot_as_png.return_value = image_data
+    driver_wrapper.config.set('VisualTests', 'complete_report', 'false')
+    visual = VisualTest(driver_wrapper)
+
+    # Assert screenshot
+    filename = os.path.splitext(os.path.basename(file_v1))[0]
+    visual.assert_screenshot(None, filename=filename, file_suffix=current_method_name())
+
+    # Check that different screenshot and diff image have been saved
+    output_path = os.path.join(visual.output_directory, f'01_{filename}__{current_method_name()}.png')
+    compare_image_files(visual, current_method_name(), output_path, file_v2)
+    assert os.path.exists(output_path.replace('.png', '.diff.png'))
+
+
+def test_save_image_compress_level(driver_wrapper):
+    driver_wrapper.config.set('VisualTests', 'png_compress_level', '1')
+    visual = VisualTest(driver_wrapper)
+    img = mock.MagicMock()
+
+    visual.save_image(img, 'image.png')
+    img.save.assert_called_once_with('image.png', 'PNG', compress_level=1)
+
+
 def test_assert_screenshot_element_and_compare(driver_wrapper):
     # Add baseline image
     driver_wrapper.driver.execute_script.return_value = 0  # scrollX=0 and scrollY=0
@@ -575,6 +1184,119 @@ def test_assert_screenshot_element_and_compare(driver_wrapper):
     driver_wrapper.driver.get_screenshot_as_png.assert_called_once_with()
 
 
+def test_assert_screenshot_element_geometry_in_one_script(driver_wrapper):
+    # Create element mock and page geometry without scrolls
+    web_element = get_mock_element(x=250, y=40, height=40, width=300)
+    driver_wrapper.driver.execute_script.return_value = {'scrollHeight': 388, 'scrollWidth': 1680,
+                                                         'innerHeight': 388, 'innerWidth': 1680,
+                                                         'rects': [[250, 40, 550, 80]]}
+
+    # Configure driver mock
+    with open(file_v1, "rb") as f:
+        image_data = f.read()
+    driver_wrapper.driver.get_screenshot_as_png.return_value = image_data
+    driver_wrapper.config.set('Driver', 'type', 'chrome')
+    visual = VisualTest(driver_wrapper)
+
+    # Assert screenshot
+    filename = os.path.splitext(os.path.basename(file_cropped))[0]
+    visual.assert_screenshot(web_element, filename=filename, file_suffix=current_method_name())
+
+    # Check that page geometry has been calculated with only one javascript call
+    driver_wrapper.driver.execute_script.assert_called_once_with(VisualTest.geometry_script, web_element)
+    assert visual.geometry is None
+    output_path = os.path.join(visual.output_directory, f'01_{filename}__{current_method_name()}.png')
+    compare_image_files(visual, current_method_name(), output_path, orig_file_cropped)
+
+
+def test_assert_screenshot_native_element_screenshot(driver_wrapper):
+    # Create element mock with its own screenshot
+    web_element = get_mock_element(x=250, y=40, height=40, width=300)
+    with open(file_cropped, "rb") as f:
+        web_element.screenshot_as_png = f.read()
+    driver_wrapper.is_mac_test = mock.MagicMock(return_value=False)
+    driver_wrapper.config.set('VisualTests', 'element_screenshot', 'true')
+    visual = VisualTest(driver_wrapper)
+
+    # Assert screenshot
+    filename = os.path.splitext(os.path.basename(file_cropped))[0]
+    visual.assert_screenshot(web_element, filename=filename, file_suffix=current_method_name())
+
+    # Check that full screenshot has not been captured
+    driver_wrapper.driver.get_screenshot_as_png.assert_not_called()
+    driver_wrapper.driver.execute_script.assert_not_called()
+    output_path = os.path.join(visual.output_directory, f'01_{filename}__{current_method_name()}.png')
+    compare_image_files(visual, current_method_name(), output_path, orig_file_cropped)
+
+
+def test_get_native_element_screenshot_with_excluded_elements(driver_wrapper):
+    web_element = get_mock_element(x=250, y=40, height=40, width=300)
+    exclude_elements = [get_mock_element(x=250, y=40, height=10, width=10)]
+    driver_wrapper.is_mac_test = mock.MagicMock(return_value=False)
+    driver_wrapper.config.set('VisualTests', 'element_screenshot', 'true')
+    visual = VisualTest(driver_wrapper)
+
+    # Element screenshot can not be used with excluded elements
+    assert visual.get_native_element_screenshot(web_element, exclude_elements) is None
+
+
+def test_get_native_element_screenshot_not_supported(driver_wrapper):
+    web_element = get_mock_element(x=250, y=40, height=40, width=300)
+    type(web_element).screenshot_as_png = mock.PropertyMock(side_effect=WebDriverException('not supported'))
+    driver_wrapper.is_mac_test = mock.MagicMock(return_value=False)
+    driver_wrapper.config.set('VisualTests', 'element_screenshot', 'true')
+    visual = VisualTest(driver_wrapper)
+
+    # Full screenshot must be captured if element screenshot is not supported
+    assert visual.get_native_element_screenshot(web_element, []) is None
+
+
+def test_get_geometry(driver_wrapper):
+    web_elements = [get_mock_element(x=250, y=40, height=40, width=300),
+                    get_mock_element(x=250, y=90, height=20, width=100)]
+    driver_wrapper.driver.execute_script.return_value = {'scrollHeight': 600, 'scrollWidth': 1200,
+                                                         'innerHeight': 400, 'innerWidth': 900,
+                                                         'rects': [[250.5, 40, 550.5, 80], [250, 90, 350, 110]]}
+    driver_wrapper.config.set('Driver', 'type', 'chrome')
+    visual = VisualTest(driver_wrapper)
+
+    # Check scrolls and element boxes
+    visual.geometry = visual.get_geometry(web_elements)
+    assert visual.get_scrolls_size() == {'x': 17, 'y': 17}
+    assert visual.get_element_box(web_elements[0]) == (250, 40, 550, 80)
+    assert visual.get_element_box(web_elements[1]) == (250, 90, 350, 110)
+    driver_wrapper.driver.execute_script.assert_called_once_with(VisualTest.geometry_script, *web_elements)
+
+
+def test_get_geometry_fractional_coordinates(driver_wrapper):
+    web_element = get_mock_element(x=101, y=40, height=40.2, width=300.2)
+    driver_wrapper.driver.execute_script.return_value = {'scrollHeight': 600, 'scrollWidth': 1200,
+                                                         'innerHeight': 400, 'innerWidth': 900,
+                                                         'rects': [[100.6, 40.3, 400.8, 80.5]]}
+    driver_wrapper.config.set('Driver', 'type', 'chrome')
+    visual = VisualTest(driver_wrapper)
+
+    # Check that element box is rounded like webdriver location and size
+    visual.geometry = visual.get_geometry([web_element])
+    assert visual.get_element_box(web_element) == (101, 40, 401, 80)
+
+
+def test_get_geometry_mobile(driver_wrapper):
+    driver_wrapper.config.set('Driver', 'type', 'ios')
+    visual = VisualTest(driver_wrapper)
+
+    # Check that javascript is not executed in mobile tests
+    assert visual.get_geometry([get_mock_element(x=250, y=40, height=40, width=300)]) is None
+    driver_wrapper.driver.execute_script.assert_not_called()
+
+
+def test_get_geometry_javascript_error(driver_wrapper):
+    driver_wrapper.driver.execute_script.side_effect = WebDriverException('javascript error')
+    visual = VisualTest(driver_wrapper)
+
+    assert visual.get_geometry([get_mock_element(x=250, y=40, height=40, width=300)]) is None
+
+
 def test_assert_screenshot_full_without_baseline(driver_wrapper):
     # Configure driver mock
     with open(file_v1, "rb") as f:
@@ -695,3 +1417,105 @@ def test_assert_screenshot_greater_threshold(driver_wrapper):
     with pytest.raises(TypeError) as exc:
         visual.assert_screenshot(None, 'screenshot_full', threshold=2)
     assert str(exc.value) == 'Threshold must be a number between 0 and 1: 2'
+
+
+def test_assert_screenshot_async(driver_wrapper):
+    # Configure driver mock
+    with open(file_v2, "rb") as f:
+        image_data = f.read()
+    driver_wrapper.driver.get_screenshot_as_png.return_value = image_data
+
+    # Update conf and create a new VisualTest instance
+    driver_wrapper.config.set('VisualTests', 'fail', 'true')
+    driver_wrapper.config.set('VisualTests', 'async_workers', '2')
+    visual = VisualTest(driver_wrapper)
+
+    # Assert screenshot does not fail until background comparisons are waited
+    filename = os.path.splitext(os.path.basename(file_v1))[0]
+    visual.assert_screenshot(None, filename=filename, file_suffix=current_method_name())
+    driver_wrapper.driver.get_screenshot_as_png.assert_called_once_with()
+    assert len(VisualTest.pending_comparisons) == 1
+
+    # Function scope waits for comparisons when sync point is test
+    error = VisualTest.wait_pending_comparisons('function')
+    assert str(error).endswith(f"did not match the baseline '{file_v1}' (by a distance of 0.00520373,"
+                               f" more than 0 threshold). Different regions: (440, 218, 558, 247): 3392 pixels")
+    assert VisualTest.pending_comparisons == []
+    assert VisualTest.wait_pending_comparisons('session') is None
+    assert VisualTest.executor is None
+
+
+def test_assert_screenshot_async_sync_point_assert(driver_wrapper):
+    # Configure driver mock
+    with open(file_v2, "rb") as f:
+        image_data = f.read()
+    driver_wrapper.driver.get_screenshot_as_png.return_value = image_data
+
+    # Update conf and create a new VisualTest instance
+    driver_wrapper.config.set('VisualTests', 'fail', 'true')
+    driver_wrapper.config.set('VisualTests', 'async_workers', '1')
+    driver_wrapper.config.set('VisualTests', 'async_sync_point', 'assert')
+    visual = VisualTest(driver_wrapper)
+
+    # Next assert screenshot raises previous assert error
+    filename = os.path.splitext(os.path.basename(file_v1))[0]
+    visual.assert_screenshot(None, filename=filename, file_suffix=current_method_name())
+    with pytest.raises(AssertionError) as exc:
+        visual.assert_screenshot(None, filename=filename, file_suffix=current_method_name())
+    assert str(exc.value).endswith(f"did not match the baseline '{file_v1}' (by a distance of 0.00520373,"
+                                   f" more than 0 threshold). Different regions: (440, 218, 558, 247): 3392 pixels")
+    assert VisualTest.wait_pending_comparisons('session') is None
+
+
+def test_assert_screenshot_async_sync_point_session(driver_wrapper):
+    # Configure driver mock
+    with open(file_v2, "rb") as f:
+        image_data = f.read()
+    driver_wrapper.driver.get_screenshot_as_png.return_value = image_data
+
+    # Update conf and create a new VisualTest instance
+    driver_wrapper.config.set('VisualTests', 'fail', 'true')
+    driver_wrapper.config.set('VisualTests', 'async_workers', '1')
+    driver_wrapper.config.set('VisualTests', 'async_sync_point', 'session')
+    visual = VisualTest(driver_wrapper)
+
+    # Errors are only collected in session scope
+    filename = os.path.splitext(os.path.basename(file_v1))[0]
+    visual.assert_screenshot(None, filename=filename, file_suffix=current_method_name())
+    visual.assert_screenshot(None, filename=filename, file_suffix=current_method_name())
+    assert VisualTest.wait_pending_comparisons('function') is None
+    error = VisualTest.wait_pending_comparisons('session')
+    assert len(str(error).splitlines()) == 2
+    VisualTest.sync_point = None
+
+
+def test_assert_screenshot_async_sync_point_session_unittest(driver_wrapper):
+    # Configure driver mock
+    with open(file_v2, "rb") as f:
+        image_data = f.read()
+    driver_wrapper.driver.get_screenshot_as_png.return_value = image_data
+
+    # Update conf and create a new VisualTest instance
+    driver_wrapper.config.set('VisualTests', 'fail', 'true')
+    driver_wrapper.config.set('VisualTests', 'async_workers', '1')
+    driver_wrapper.config.set('VisualTests', 'async_sync_point', 'session')
+    visual = VisualTest(driver_wrapper)
+
+    # Errors are collected in class scope, that is the last one in unittest test cases
+    filename = os.path.splitext(os.path.basename(file_v1))[0]
+    visual.assert_screenshot(None, filename=filename, file_suffix=current_method_name())
+    error = VisualTest.wait_pending_comparisons('class')
+    assert len(str(error).splitlines()) == 1
+    assert VisualTest.wait_pending_comparisons('session') is None
+    VisualTest.sync_point = None
+
+
+def test_assert_screenshot_async_unknown_sync_point(driver_wrapper):
+    # Update conf and create a new VisualTest instance
+    driver_wrapper.config.set('VisualTests', 'async_workers', '1')
+    driver_wrapper.config.set('VisualTests', 'async_sync_point', 'unknown')
+    visual = VisualTest(driver_wrapper)
+
+    with pytest.raises(ValueError) as exc:
+        visual.get_executor()
+    assert str(exc.value) == "Unknown visual async sync point 'unknown', valid values are: assert, test, session"
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2023 Telefónica Investigación y Desarrollo, S.A.U.
+This file is part of Toolium.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import os
+import shutil
+
+import pytest
+from PIL import Image
+
+from toolium.utils.baseline_store import (BaselinePack, ContentAddressedBaselineStore, DirectoryBaselineStore,
+                                          PackBaselineStore, get_baseline_store, get_image_digest, main)
+from toolium.utils.path_utils import makedirs_safe
+
+root_path = os.path.dirname(os.path.realpath(__file__))
+resources_path = os.path.join(root_path, '..', 'resources')
+baseline_root = os.path.join(root_path, 'output', 'baselinestore')
+firefox_path = os.path.join(baseline_root, 'firefox')
+chrome_path = os.path.join(baseline_root, 'chrome')
+
+
+def save_image(img, image_path):
+    img.save(image_path, 'PNG')
+
+
+@pytest.fixture
+def baseline_directories():
+    # Create two baseline folders with the same image
+    if os.path.exists(baseline_root):
+        shutil.rmtree(baseline_root)
+    makedirs_safe(firefox_path)
+    makedirs_safe(chrome_path)
+    shutil.copyfile(os.path.join(resources_path, 'register.png'), os.path.join(firefox_path, 'register.png'))
+    shutil.copyfile(os.path.join(resources_path, 'register.png'), os.path.join(chrome_path, 'register.png'))
+    shutil.copyfile(os.path.join(resources_path, 'register_v2.png'), os.path.join(chrome_path, 'register_v2.png'))
+    yield
+
+
+def test_directory_store_save(baseline_directories):
+    store = DirectoryBaselineStore()
+    baseline_path = os.path.join(firefox_path, 'new.png')
+    img = Image.open(os.path.join(resources_path, 'register.png'))
+    digest = get_image_digest(img)
+    assert not store.exists(baseline_path)
+
+    store.save(img, baseline_path, digest, save_image)
+    assert store.exists(baseline_path)
+    assert store.get_file(baseline_path) == baseline_path
+    assert store.get_digest(baseline_path) == digest
+
+
+def test_content_store_save_equal_images(baseline_directories):
+    store = ContentAddressedBaselineStore()
+    img = Image.open(os.path.join(resources_path, 'register.png'))
+    digest = get_image_digest(img)
+    firefox_baseline_path = os.path.join(firefox_path, 'new.png')
+    chrome_baseline_path = os.path.join(chrome_path, 'new.png')
+
+    store.save(img, firefox_baseline_path, digest, save_image)
+    store.save(img, chrome_baseline_path, digest, save_image)
+
+    # Both baselines use the same blob file
+    blob_path = os.path.join(baseline_root, '.blobs', digest[:2], f'{digest}.png')
+    assert store.get_file(firefox_baseline_path) == blob_path
+    assert store.get_file(chrome_baseline_path) == blob_path
+    assert store.exists(firefox_baseline_path)
+    assert store.get_digest(chrome_baseline_path) == digest
+    assert not os.path.exists(firefox_baseline_path)
+    with open(os.path.join(chrome_path, 'baselines.json')) as f:
+        assert json.load(f) == {'new.png': digest}
+
+
+def test_content_store_not_indexed_baseline(baseline_directories):
+    store = ContentAddressedBaselineStore()
+    baseline_path = os.path.join(firefox_path, 'register.png')
+
+    # Baselines that are not in the index are read from baseline folder
+    assert store.get_file(baseline_path) == baseline_path
+    assert store.exists(baseline_path)
+    assert not store.exists(os.path.join(firefox_path, 'unknown.png'))
+
+
+def test_content_store_index_modified_by_other_process(baseline_directories):
+    store = ContentAddressedBaselineStore()
+    other_store = ContentAddressedBaselineStore()
+    img = Image.open(os.path.join(resources_path, 'register.png'))
+    digest = get_image_digest(img)
+    store.save(img, os.path.join(firefox_path, 'first.png'), digest, save_image)
+    assert not store.exists(os.path.join(firefox_path, 'second.png'))
+
+    # Index is read again when it is modified, keeping previous baselines
+    other_store.save(img, os.path.join(firefox_path, 'second.png'), digest, save_image)
+    os.utime(os.path.join(firefox_path, 'baselines.json'), ns=(1, 1))
+    assert store.exists(os.path.join(firefox_path, 'first.png'))
+    assert store.exists(os.path.join(firefox_path, 'second.png'))
+
+
+def test_pack_store_save(baseline_directories):
+    store = PackBaselineStore()
+    img = Image.open(os.path.join(resources_path, 'register.png'))
+    digest = get_image_digest(img)
+    baseline_path = os.path.join(firefox_path, 'new.png')
+
+    store.save(img, baseline_path, digest, save_image)
+
+    # Baseline is appended to the pack file instead of being saved in the baseline folder
+    assert not os.path.exists(baseline_path)
+    assert os.path.exists(os.path.join(firefox_path, 'baselines.pack'))
+    assert store.exists(baseline_path)
+    assert store.get_digest(baseline_path) == digest
+    with store.open(baseline_path) as f:
+        assert get_image_digest(Image.open(f)) == digest
+    copy_path = os.path.join(firefox_path, 'copy.png')
+    store.copy(baseline_path, copy_path)
+    assert get_image_digest(Image.open(copy_path)) == digest
+
+
+def test_pack_store_save_again(baseline_directories):
+    store = PackBaselineStore()
+    img = Image.open(os.path.join(resources_path, 'register.png'))
+    new_img = Image.open(os.path.join(resources_path, 'register_v2.png'))
+    baseline_path = os.path.join(firefox_path, 'new.png')
+    store.save(img, baseline_path, get_image_digest(img), save_image)
+    version = store.get_version(baseline_path)
+
+    # Last entry of a baseline is the valid one
+    store.save(new_img, baseline_path, get_image_digest(new_img), save_image)
+    assert store.get_version(baseline_path) != version
+    assert store.get_digest(baseline_path) == get_image_digest(new_img)
+
+
+def test_pack_store_not_packed_baseline(baseline_directories):
+    store = PackBaselineStore()
+    baseline_path = os.path.join(firefox_path, 'register.png')
+
+    # Baselines that are not in the pack are read from baseline folder
+    assert store.exists(baseline_path)
+    assert not store.exists(os.path.join(firefox_path, 'unknown.png'))
+    with store.open(baseline_path) as f:
+        assert f.name == baseline_path
+
+
+def test_pack_appended_by_other_process(baseline_directories):
+    pack_path = os.path.join(firefox_path, 'baselines.pack')
+    pack = BaselinePack(pack_path)
+    other_pack = BaselinePack(pack_path)
+    pack.append('first.png', b'first', 'a' * 64)
+    assert pack.get_entry('second.png') is None
+
+    # New entries are read when pack file grows
+    other_pack.append('second.png', b'second', 'b' * 64)
+    assert pack.read('first.png') == b'first'
+    assert pack.read('second.png') == b'second'
+    assert pack.get_entry('second.png')[2] == 'b' * 64
+    pack.close()
+    other_pack.close()
+
+
+def test_pack_compact(baseline_directories):
+    pack_path = os.path.join(firefox_path, 'baselines.pack')
+    pack = BaselinePack(pack_path)
+    pack.append('first.png', b'first', 'a' * 64)
+    pack.append('second.png', b'second', 'b' * 64)
+    pack.append('first.png', b'first again', 'c' * 64)
+    pack_size = os.path.getsize(pack_path)
+
+    assert pack.compact() == 1
+    assert os.path.getsize(pack_path) < pack_size
+    assert pack.read('first.png') == b'first again'
+    assert pack.read('second.png') == b'second'
+    assert BaselinePack(pack_path).get_entry('first.png')[2] == 'c' * 64
+    pack.close()
+
+
+def test_pack_invalid_file(baseline_directories):
+    pack_path = os.path.join(firefox_path, 'baselines.pack')
+    with open(pack_path, 'wb') as f:
+        f.write(b'0' * 100)
+
+    with pytest.raises(ValueError) as exc:
+        BaselinePack(pack_path).get_entry('first.png')
+    assert str(exc.value) == f"Invalid baseline pack file '{pack_path}' at position 0"
+
+
+def test_pack_and_compact_directory(baseline_directories, capsys):
+    assert main(['pack', chrome_path, '--remove']) == 0
+    assert capsys.readouterr().out == 'Packed baselines: 2\n'
+    assert main(['pack', firefox_path]) == 0
+    assert main(['pack', firefox_path]) == 0
+    assert main(['compact', firefox_path]) == 0
+    assert capsys.readouterr().out == 'Packed baselines: 1\nPacked baselines: 1\nRemoved outdated baselines: 1\n'
+
+    # PNG files are appended to the pack as they are
+    store = get_baseline_store('pack')
+    baseline_path = os.path.join(chrome_path, 'register_v2.png')
+    assert not os.path.exists(baseline_path)
+    with store.open(baseline_path) as packed, open(os.path.join(resources_path, 'register_v2.png'), 'rb') as original:
+        assert packed.read() == original.read()
+    store.get_pack(chrome_path).close()
+    store.get_pack(firefox_path).close()
+
+
+def test_get_baseline_store():
+    assert isinstance(get_baseline_store(), DirectoryBaselineStore)
+    assert isinstance(get_baseline_store('content'), ContentAddressedBaselineStore)
+    assert isinstance(get_baseline_store('pack'), PackBaselineStore)
+    assert get_baseline_store('content') is get_baseline_store('content')
+
+
+def test_get_baseline_store_unknown():
+    with pytest.raises(ValueError) as exc:
+        get_baseline_store('unknown')
+    assert str(exc.value) == "Unknown visual baseline store 'unknown', valid values are: directory, content, pack"
+
+
+def test_migrate_directory(baseline_directories, capsys):
+    assert main(['migrate', baseline_root, '--remove']) == 0
+    assert capsys.readouterr().out == 'Migrated baselines: 3 (2 different images)\n'
+
+    # PNG files are moved to blobs and equal images are saved only once
+    store = get_baseline_store('content')
+    assert not os.path.exists(os.path.join(firefox_path, 'register.png'))
+    assert store.get_file(os.path.join(firefox_path, 'register.png')) == \
+        store.get_file(os.path.join(chrome_path, 'register.png'))
+    with open(store.get_file(os.path.join(chrome_path, 'register_v2.png')), 'rb') as blob, \
+            open(os.path.join(resources_path, 'register_v2.png'), 'rb') as original:
+        assert blob.read() == original.read()
@@ -51,7 +51,10 @@ def context():
     driver_wrapper.configure(config_files)
     context.driver_wrapper = driver_wrapper
 
-    return context
+    # Restore os functions mocked in tests, to avoid affecting other test modules
+    os_functions = (os.listdir, os.remove, os.rmdir)
+    yield context
+    os.listdir, os.remove, os.rmdir = os_functions
 
 
 def test_get_download_directory_base_download_directory_none(context):
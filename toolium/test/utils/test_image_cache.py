@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2023 Telefónica Investigación y Desarrollo, S.A.U.
+This file is part of Toolium.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from PIL import Image
+
+from toolium.utils.image_cache import ImageCache
+
+
+def test_image_cache_get():
+    cache = ImageCache(max_size=1000)
+    img = Image.new('RGB', (10, 10))
+    cache.put('image.png', 1, img, 'digest')
+
+    assert cache.get('image.png', 1) == (img, 'digest')
+    assert cache.get('image.png', 2) is None
+    assert cache.get('other.png', 1) is None
+    assert cache.size == 300
+
+
+def test_image_cache_new_mtime():
+    cache = ImageCache(max_size=1000)
+    cache.put('image.png', 1, Image.new('RGB', (10, 10)))
+    new_img = Image.new('RGB', (10, 10))
+    cache.put('image.png', 2, new_img)
+
+    # Previous image version must be removed
+    assert cache.get('image.png', 1) is None
+    assert cache.get('image.png', 2) == (new_img, None)
+    assert cache.size == 300
+
+
+def test_image_cache_lru_eviction():
+    cache = ImageCache(max_size=700)
+    cache.put('image_1.png', 1, Image.new('RGB', (10, 10)))
+    cache.put('image_2.png', 1, Image.new('RGB', (10, 10)))
+    cache.get('image_1.png', 1)
+    cache.put('image_3.png', 1, Image.new('RGB', (10, 10)))
+
+    # Least recently used image must be evicted
+    assert cache.get('image_1.png', 1) is not None
+    assert cache.get('image_2.png', 1) is None
+    assert cache.get('image_3.png', 1) is not None
+    assert cache.size == 600
+
+
+def test_image_cache_image_too_big():
+    cache = ImageCache(max_size=200)
+    cache.put('image.png', 1, Image.new('RGB', (10, 10)))
+
+    assert cache.get('image.png', 1) is None
+    assert cache.size == 0
+
+
+def test_image_cache_disabled():
+    cache = ImageCache()
+    cache.put('image.png', 1, Image.new('RGB', (1, 1)))
+
+    assert cache.get('image.png', 1) is None
+
+
+def test_image_cache_invalidate():
+    cache = ImageCache(max_size=1000)
+    cache.put('image_1.png', 1, Image.new('RGB', (10, 10)))
+    cache.put('image_2.png', 1, Image.new('RGB', (10, 10)))
+    cache.invalidate('image_1.png')
+
+    assert cache.get('image_1.png', 1) is None
+    assert cache.get('image_2.png', 1) is not None
+    assert cache.size == 300
+
+    cache.clear()
+    assert cache.get('image_2.png', 1) is None
+    assert cache.size == 0
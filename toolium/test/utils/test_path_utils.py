@@ -16,13 +16,17 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import mock
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import pytest
 import queue as queue
+import shutil
 import threading
 import uuid
 
-from toolium.utils.path_utils import get_valid_filename, makedirs_safe
+from toolium.utils.path_utils import get_valid_filename, increment_counter_file, link_directory, makedirs_safe, \
+    sync_directory
 
 filename_tests = (
     ('hola_pepito', 'hola_pepito'),
@@ -103,3 +107,91 @@ def test_path_utils_makedirs_compatibility():
     makedirs_safe(folder)
     assert os.path.isdir(folder)
     os.rmdir(folder)
+
+
+def create_files(folder, files):
+    for filename, content in files.items():
+        os.makedirs(os.path.dirname(os.path.join(folder, filename)), exist_ok=True)
+        with open(os.path.join(folder, filename), 'w') as f:
+            f.write(content)
+
+
+def test_link_directory():
+    root_folder = os.path.join('output', str(uuid.uuid4()))
+    link_path = os.path.join(root_folder, 'latest')
+    create_files(os.path.join(root_folder, 'first'), {'report.html': 'first'})
+    create_files(os.path.join(root_folder, 'second'), {'report.html': 'second'})
+    # Previous folder is replaced by a link
+    create_files(link_path, {'report.html': 'previous'})
+
+    link_directory(os.path.join(root_folder, 'first'), link_path)
+    assert os.path.islink(link_path)
+    assert os.readlink(link_path) == 'first'
+    link_directory(os.path.join(root_folder, 'second'), link_path)
+    with open(os.path.join(link_path, 'report.html')) as f:
+        assert f.read() == 'second'
+    assert sorted(os.listdir(root_folder)) == ['first', 'latest', 'second']
+    shutil.rmtree(root_folder)
+
+
+def test_sync_directory():
+    root_folder = os.path.join('output', str(uuid.uuid4()))
+    source, destination = os.path.join(root_folder, 'source'), os.path.join(root_folder, 'latest')
+    create_files(source, {'report.html': 'new report', os.path.join('images', 'unchanged.png'): 'unchanged'})
+    create_files(destination, {'report.html': 'old report', os.path.join('old', 'removed.png'): 'removed'})
+    os.link(os.path.join(source, 'images', 'unchanged.png'), os.path.join(destination, 'unchanged.png'))
+
+    sync_directory(source, destination)
+    assert os.path.samefile(os.path.join(source, 'report.html'), os.path.join(destination, 'report.html'))
+    assert os.path.samefile(os.path.join(source, 'images', 'unchanged.png'),
+                            os.path.join(destination, 'images', 'unchanged.png'))
+    assert sorted(os.listdir(destination)) == ['images', 'report.html']
+    shutil.rmtree(root_folder)
+
+
+def test_sync_directory_without_hard_links():
+    root_folder = os.path.join('output', str(uuid.uuid4()))
+    source, destination = os.path.join(root_folder, 'source'), os.path.join(root_folder, 'latest')
+    create_files(source, {'report.html': 'new report'})
+
+    with mock.patch('os.link', side_effect=OSError('hard links not supported')):
+        sync_directory(source, destination)
+        destination_mtime = os.stat(os.path.join(destination, 'report.html')).st_mtime_ns
+        # Unchanged files are not copied again
+        with mock.patch('shutil.copy2') as copy2:
+            sync_directory(source, destination)
+            copy2.assert_not_called()
+
+    assert not os.path.samefile(os.path.join(source, 'report.html'), os.path.join(destination, 'report.html'))
+    assert os.stat(os.path.join(source, 'report.html')).st_mtime_ns == destination_mtime
+    with open(os.path.join(destination, 'report.html')) as f:
+        assert f.read() == 'new report'
+    shutil.rmtree(root_folder)
+
+
+def test_increment_counter_file():
+    counter_path = os.path.join('output', str(uuid.uuid4()))
+
+    assert increment_counter_file(counter_path) == 1
+    assert increment_counter_file(counter_path) == 2
+    with open(counter_path) as f:
+        assert f.read() == '3'
+    os.remove(counter_path)
+
+
+def test_increment_counter_file_initial_value():
+    counter_path = os.path.join('output', str(uuid.uuid4()))
+
+    assert increment_counter_file(counter_path, 10) == 10
+    assert increment_counter_file(counter_path, 10) == 11
+    os.remove(counter_path)
+
+
+@pytest.mark.parametrize('executor_class', [ThreadPoolExecutor, ProcessPoolExecutor])
+def test_increment_counter_file_parallel(executor_class):
+    counter_path = os.path.join('output', str(uuid.uuid4()))
+
+    with executor_class(max_workers=4) as executor:
+        numbers = list(executor.map(increment_counter_file, [counter_path] * 50))
+    assert sorted(numbers) == list(range(1, 51))
+    os.remove(counter_path)
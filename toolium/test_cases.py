@@ -118,9 +118,10 @@ class SeleniumTestCase(BasicTestCase):
         # Monkey patching assert_screenshot method in PageElement to use the correct test name
         file_suffix = self.get_method_name()
 
-        def assert_screenshot_page_element(self, filename, threshold=0, exclude_elements=[], force=False):
+        def assert_screenshot_page_element(self, filename, threshold=0, exclude_elements=[], force=False,
+                                           comparison_mode=None):
             VisualTest(self.driver_wrapper, force).assert_screenshot(self.web_element, filename, file_suffix,
-                                                                     threshold, exclude_elements)
+                                                                     threshold, exclude_elements, comparison_mode)
 
         PageElement.assert_screenshot = assert_screenshot_page_element
 
@@ -135,7 +136,8 @@ class SeleniumTestCase(BasicTestCase):
                                          test_name=self.get_subclassmethod_name(),
                                          test_passed=self._test_passed)
 
-    def assert_screenshot(self, element, filename, threshold=0, exclude_elements=[], driver_wrapper=None, force=False):
+    def assert_screenshot(self, element, filename, threshold=0, exclude_elements=[], driver_wrapper=None, force=False,
+                          comparison_mode=None):
         """Assert that a screenshot of an element is the same as a screenshot on disk, within a given threshold.
 
         :param element: either a WebElement, PageElement or element locator as a tuple (locator_type, locator_value).
@@ -146,11 +148,14 @@ class SeleniumTestCase(BasicTestCase):
                                  from the assertion.
         :param driver_wrapper: driver wrapper instance
         :param force: if True, the screenshot is compared even if visual testing is disabled by configuration
+        :param comparison_mode: comparison mode (pixel, tolerance, isolated or ssim), by default the configured mode
         """
         file_suffix = self.get_method_name()
-        VisualTest(driver_wrapper, force).assert_screenshot(element, filename, file_suffix, threshold, exclude_elements)
+        VisualTest(driver_wrapper, force).assert_screenshot(element, filename, file_suffix, threshold, exclude_elements,
+                                                            comparison_mode)
 
-    def assert_full_screenshot(self, filename, threshold=0, exclude_elements=[], driver_wrapper=None, force=False):
+    def assert_full_screenshot(self, filename, threshold=0, exclude_elements=[], driver_wrapper=None, force=False,
+                               comparison_mode=None):
         """Assert that a driver screenshot is the same as a screenshot on disk, within a given threshold.
 
         :param filename: the filename for the screenshot, which will be appended with ``.png``
@@ -159,9 +164,28 @@ class SeleniumTestCase(BasicTestCase):
                                  from the assertion.
         :param driver_wrapper: driver wrapper instance
         :param force: if True, the screenshot is compared even if visual testing is disabled by configuration
+        :param comparison_mode: comparison mode (pixel, tolerance, isolated or ssim), by default the configured mode
         """
         file_suffix = self.get_method_name()
-        VisualTest(driver_wrapper, force).assert_screenshot(None, filename, file_suffix, threshold, exclude_elements)
+        VisualTest(driver_wrapper, force).assert_screenshot(None, filename, file_suffix, threshold, exclude_elements,
+                                                            comparison_mode)
+
+    def assert_full_page_screenshot(self, filename, threshold=0, exclude_elements=[], driver_wrapper=None,
+                                    force=False, comparison_mode=None):
+        """Assert that a screenshot of the whole page, captured scrolling the browser window, is the same as a
+        screenshot on disk, within a given threshold. It is only available in desktop browsers.
+
+        :param filename: the filename for the screenshot, which will be appended with ``.png``
+        :param threshold: percentage threshold for triggering a test failure (value between 0 and 1)
+        :param exclude_elements: list of CSS/XPATH selectors as a string or WebElement objects that must be excluded
+                                 from the assertion.
+        :param driver_wrapper: driver wrapper instance
+        :param force: if True, the screenshot is compared even if visual testing is disabled by configuration
+        :param comparison_mode: comparison mode (pixel, tolerance, isolated or ssim), by default the configured mode
+        """
+        file_suffix = self.get_method_name()
+        VisualTest(driver_wrapper, force).assert_screenshot(None, filename, file_suffix, threshold, exclude_elements,
+                                                            comparison_mode, full_page=True)
 
 
 class AppiumTestCase(SeleniumTestCase):
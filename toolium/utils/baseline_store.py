@@ -0,0 +1,629 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2023 Telefónica Investigación y Desarrollo, S.A.U.
+This file is part of Toolium.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Baseline stores used by visual testing to read and save baseline images.
+
+Usage: python -m toolium.utils.baseline_store migrate BASELINE_DIRECTORY [--remove]
+       python -m toolium.utils.baseline_store pack BASELINE_DIRECTORY [--remove]
+       python -m toolium.utils.baseline_store compact BASELINE_DIRECTORY
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+import sys
+import threading
+from io import BytesIO
+
+from PIL import Image
+
+from toolium.utils.path_utils import makedirs_safe
+
+
+def get_image_digest(img):
+    """Calculate a digest of the image size and its decoded RGB pixels
+
+    :param img: image object
+    :returns: str with the hexadecimal digest
+    """
+    digest = hashlib.sha256('{}x{}'.format(*img.size).encode())
+    digest.update((img if img.mode == 'RGB' else img.convert('RGB')).tobytes())
+    return digest.hexdigest()
+
+
+class DirectoryBaselineStore(object):
+    """Baseline store that saves each baseline image as a PNG file in its baseline folder, with a digest file beside it
+    to detect quickly that a screenshot is equal to its baseline
+
+    Baseline images are identified by their path in the baseline folder, i.e. {baseline_directory}/{filename}.png
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+
+    def get_file(self, baseline_path):
+        """Get the file that contains a baseline image
+
+        :param baseline_path: baseline image path
+        :returns: path of the PNG file with the baseline image
+        """
+        return baseline_path
+
+    def exists(self, baseline_path):
+        """Check if a baseline image exists
+
+        :param baseline_path: baseline image path
+        :returns: True if the baseline image exists
+        """
+        return os.path.exists(self.get_file(baseline_path))
+
+    def open(self, baseline_path):
+        """Open a baseline image to read its PNG data
+
+        :param baseline_path: baseline image path
+        :returns: binary file object
+        """
+        return open(self.get_file(baseline_path), 'rb')
+
+    def copy(self, baseline_path, destination_path):
+        """Copy a baseline image to a PNG file
+
+        :param baseline_path: baseline image path
+        :param destination_path: destination file path
+        """
+        shutil.copyfile(self.get_file(baseline_path), destination_path)
+
+    def get_version(self, baseline_path):
+        """Get an identifier of the current version of a baseline image, that changes when the baseline is saved again
+
+        :param baseline_path: baseline image path
+        :returns: version identifier, the modification time of the baseline file
+        """
+        return os.stat(self.get_file(baseline_path)).st_mtime_ns
+
+    def get_digest(self, baseline_path):
+        """Get baseline pixels digest from the digest file saved beside the baseline, if baseline has not changed
+
+        :param baseline_path: baseline image path
+        :returns: str with the hexadecimal digest or None if there is no valid cached digest
+        """
+        try:
+            baseline_stat = os.stat(baseline_path)
+            with open(f'{baseline_path}.sha256') as f:
+                cached_digest = json.load(f)
+            if (cached_digest['mtime'] == baseline_stat.st_mtime_ns
+                    and cached_digest['size'] == baseline_stat.st_size):
+                return cached_digest['digest']
+        except (OSError, ValueError, KeyError):
+            pass
+        return None
+
+    def save_digest(self, baseline_path, digest):
+        """Save baseline pixels digest in a file beside the baseline
+
+        :param baseline_path: baseline image path
+        :param digest: str with the hexadecimal digest
+        """
+        try:
+            baseline_stat = os.stat(baseline_path)
+            with open(f'{baseline_path}.sha256', 'w') as f:
+                json.dump({'digest': digest, 'mtime': baseline_stat.st_mtime_ns, 'size': baseline_stat.st_size}, f)
+        except OSError as exc:
+            self.logger.debug("Baseline digest of '%s' could not be saved: %s", baseline_path, exc)
+
+    def save(self, img, baseline_path, digest, save_image):
+        """Save an image as baseline
+
+        :param img: image object
+        :param baseline_path: baseline image path
+        :param digest: str with the hexadecimal digest of the image pixels
+        :param save_image: function that receives the image object and a file path and saves the image in PNG format
+        """
+        save_image(img, baseline_path)
+        self.save_digest(baseline_path, digest)
+
+
+class ContentAddressedBaselineStore(DirectoryBaselineStore):
+    """Baseline store that saves each different baseline image only once, in a blob file named with its pixels digest
+
+    Blobs are saved in a .blobs folder shared by all baseline folders, i.e. {baseline_root}/.blobs/{digest}.png,
+    and each baseline folder contains an index file that maps baseline filenames to blob digests. Baseline images that
+    are not in the index are read from their PNG file in the baseline folder, as in directory store.
+    """
+    index_name = 'baselines.json'  #: name of the index file in each baseline folder
+    blobs_name = '.blobs'  #: name of the blobs folder in the baselines root folder
+
+    def __init__(self):
+        super(ContentAddressedBaselineStore, self).__init__()
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def get_blob_path(self, baseline_path, digest):
+        """Get the blob file path of a baseline image
+
+        :param baseline_path: baseline image path
+        :param digest: str with the hexadecimal digest of the image pixels
+        :returns: blob file path
+        """
+        baseline_root = os.path.dirname(os.path.dirname(os.path.normpath(baseline_path)))
+        return os.path.join(baseline_root, self.blobs_name, digest[:2], f'{digest}.png')
+
+    def get_file(self, baseline_path):
+        """Get the file that contains a baseline image, that is its blob file if it is in the index
+
+        :param baseline_path: baseline image path
+        :returns: path of the PNG file with the baseline image
+        """
+        digest = self._get_index(os.path.dirname(baseline_path)).get(os.path.basename(baseline_path))
+        return self.get_blob_path(baseline_path, digest) if digest else baseline_path
+
+    def get_digest(self, baseline_path):
+        """Get baseline pixels digest from the index, or from the digest file if baseline is not in the index
+
+        :param baseline_path: baseline image path
+        :returns: str with the hexadecimal digest or None if there is no valid cached digest
+        """
+        digest = self._get_index(os.path.dirname(baseline_path)).get(os.path.basename(baseline_path))
+        return digest or super(ContentAddressedBaselineStore, self).get_digest(baseline_path)
+
+    def get_version(self, baseline_path):
+        """Get an identifier of the current version of a baseline image, that changes when the baseline is saved again
+
+        :param baseline_path: baseline image path
+        :returns: version identifier, the blob digest or the modification time of the baseline file if it is not in
+                  the index
+        """
+        digest = self._get_index(os.path.dirname(baseline_path)).get(os.path.basename(baseline_path))
+        return digest or super(ContentAddressedBaselineStore, self).get_version(baseline_path)
+
+    def save_digest(self, baseline_path, digest):
+        """Save baseline pixels digest in a file beside the baseline, only if baseline is not in the index
+
+        :param baseline_path: baseline image path
+        :param digest: str with the hexadecimal digest
+        """
+        if self.get_file(baseline_path) == baseline_path:
+            super(ContentAddressedBaselineStore, self).save_digest(baseline_path, digest)
+
+    def save(self, img, baseline_path, digest, save_image):
+        """Save an image as baseline, creating its blob file if there is not an equal image saved yet
+
+        :param img: image object
+        :param baseline_path: baseline image path
+        :param digest: str with the hexadecimal digest of the image pixels
+        :param save_image: function that receives the image object and a file path and saves the image in PNG format
+        """
+        blob_path = self.get_blob_path(baseline_path, digest)
+        if not os.path.exists(blob_path):
+            makedirs_safe(os.path.dirname(blob_path))
+            # Save in a temporary file to avoid reading incomplete blobs from other threads or processes
+            temp_path = f'{blob_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            save_image(img, temp_path)
+            os.replace(temp_path, blob_path)
+        self.add_to_index(baseline_path, digest)
+
+    def add_to_index(self, baseline_path, digest):
+        """Add a baseline image to the index of its baseline folder
+
+        :param baseline_path: baseline image path
+        :param digest: str with the hexadecimal digest of its blob
+        """
+        baseline_directory = os.path.dirname(baseline_path)
+        index_path = os.path.join(baseline_directory, self.index_name)
+        with self._lock:
+            # Read index again to keep baselines saved by other processes
+            self._indexes.pop(baseline_directory, None)
+            index = dict(self._get_index(baseline_directory))
+            index[os.path.basename(baseline_path)] = digest
+            temp_path = f'{index_path}.{os.getpid()}.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(index, f, indent=2, sort_keys=True)
+            os.replace(temp_path, index_path)
+            self._indexes[baseline_directory] = (os.stat(index_path).st_mtime_ns, index)
+
+    def _get_index(self, baseline_directory):
+        """Get the index of a baseline folder, reading it again only if it has been modified
+
+        :param baseline_directory: baseline folder
+        :returns: dict with baseline filenames and their blob digests
+        """
+        index_path = os.path.join(baseline_directory, self.index_name)
+        try:
+            index_mtime = os.stat(index_path).st_mtime_ns
+        except OSError:
+            return {}
+        cached_index = self._indexes.get(baseline_directory)
+        if cached_index and cached_index[0] == index_mtime:
+            return cached_index[1]
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError) as exc:
+            self.logger.warning("Baseline index '%s' could not be read: %s", index_path, exc)
+            return {}
+        self._indexes[baseline_directory] = (index_mtime, index)
+        return index
+
+
+class BaselinePack(object):
+    """Pack file with baseline images, that is read with memory mapping
+
+    The pack file is a sequence of entries, each of them with a header, the baseline filename and the PNG file data.
+    New entries are appended to the end of the file, so the last entry of a filename is the valid one.
+
+    :type entries: dict
+    """
+    header = struct.Struct('>4sHI64s')  #: entry header: magic, filename length, data length and pixels digest
+    magic = b'TBP1'  #: bytes at the beginning of each entry
+    entries = None  #: dict with filenames and tuples with data offset, data length and pixels digest of each entry
+
+    def __init__(self, pack_path):
+        self.pack_path = pack_path
+        self.entries = {}
+        self._file = None
+        self._mmap = None
+        self._read_size = 0
+        self._lock = threading.Lock()
+
+    def get_entry(self, filename):
+        """Get the last entry of a baseline filename, reading before new entries appended by other processes
+
+        :param filename: baseline filename
+        :returns: tuple with data offset, data length and pixels digest, or None if the filename is not in the pack
+        """
+        with self._lock:
+            self._refresh()
+            return self.entries.get(filename)
+
+    def read(self, filename):
+        """Read PNG data of a baseline filename
+
+        :param filename: baseline filename
+        :returns: bytes with PNG data
+        """
+        with self._lock:
+            self._refresh()
+            data_offset, data_length, _ = self.entries[filename]
+            return self._mmap[data_offset:data_offset + data_length]
+
+    def append(self, filename, data, digest):
+        """Append a baseline image to the end of the pack file, in a single write operation
+
+        :param filename: baseline filename
+        :param data: bytes with PNG data
+        :param digest: str with the hexadecimal digest of the image pixels
+        """
+        encoded_filename = filename.encode('utf-8')
+        entry = self.header.pack(self.magic, len(encoded_filename), len(data), digest.encode('ascii'))
+        with self._lock:
+            with open(self.pack_path, 'ab') as f:
+                f.write(entry + encoded_filename + data)
+            self._refresh()
+
+    def compact(self):
+        """Rewrite the pack file without outdated entries
+
+        :returns: number of removed entries
+        """
+        with self._lock:
+            self._refresh()
+            entries = sorted(self.entries.items(), key=lambda item: item[1][0])
+            removed = self._count_entries() - len(entries)
+            temp_path = f'{self.pack_path}.{os.getpid()}.tmp'
+            with open(temp_path, 'wb') as f:
+                for filename, (data_offset, data_length, digest) in entries:
+                    encoded_filename = filename.encode('utf-8')
+                    f.write(self.header.pack(self.magic, len(encoded_filename), data_length, digest.encode('ascii')))
+                    f.write(encoded_filename + self._mmap[data_offset:data_offset + data_length])
+            self._close()
+            os.replace(temp_path, self.pack_path)
+            self._refresh()
+        return removed
+
+    def close(self):
+        """Close the pack file"""
+        with self._lock:
+            self._close()
+
+    def _refresh(self):
+        """Map the pack file again and read new entries if its size has changed, lock must be acquired before"""
+        try:
+            pack_stat = os.stat(self.pack_path)
+        except OSError:
+            pack_stat = None
+        if self._file is not None and (pack_stat is None
+                                       or os.fstat(self._file.fileno()).st_ino != pack_stat.st_ino):
+            # Pack file has been replaced or removed
+            self._close()
+        pack_size = pack_stat.st_size if pack_stat else 0
+        if pack_size == self._read_size:
+            return
+        if self._file is None:
+            self._file = open(self.pack_path, 'rb')
+        if self._mmap is not None:
+            self._mmap.close()
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._read_entries(len(self._mmap))
+
+    def _read_entries(self, pack_size):
+        """Read entries headers from the last read position, lock must be acquired before
+
+        :param pack_size: size of the mapped pack file
+        """
+        offset = self._read_size
+        while offset + self.header.size <= pack_size:
+            magic, filename_length, data_length, digest = self.header.unpack_from(self._mmap, offset)
+            if magic != self.magic:
+                raise ValueError(f"Invalid baseline pack file '{self.pack_path}' at position {offset}")
+            data_offset = offset + self.header.size + filename_length
+            if data_offset + data_length > pack_size:
+                # Entry is being written by other process
+                break
+            filename = self._mmap[offset + self.header.size:data_offset].decode('utf-8')
+            self.entries[filename] = (data_offset, data_length, digest.decode('ascii'))
+            offset = data_offset + data_length
+        self._read_size = offset
+
+    def _count_entries(self):
+        """Count all entries of the pack file, including outdated entries, lock must be acquired before
+
+        :returns: number of entries
+        """
+        count = offset = 0
+        while offset < self._read_size:
+            _, filename_length, data_length, _ = self.header.unpack_from(self._mmap, offset)
+            offset += self.header.size + filename_length + data_length
+            count += 1
+        return count
+
+    def _close(self):
+        """Close the mapped pack file and forget its entries, lock must be acquired before"""
+        if self._mmap is not None:
+            self._mmap.close()
+        if self._file is not None:
+            self._file.close()
+        self._mmap = self._file = None
+        self.entries = {}
+        self._read_size = 0
+
+
+class PackBaselineStore(DirectoryBaselineStore):
+    """Baseline store that saves all baseline images of a baseline folder in a single pack file, read with memory
+    mapping, to avoid opening lots of small files in networked filesystems
+
+    The pack file of each baseline folder is {baseline_directory}/baselines.pack. New baselines are appended to the pack
+    file in save mode and outdated entries are removed compacting the pack offline. Baseline images that are not in the
+    pack are read from their PNG file in the baseline folder, as in directory store.
+    """
+    pack_name = 'baselines.pack'  #: name of the pack file in each baseline folder
+
+    def __init__(self):
+        super(PackBaselineStore, self).__init__()
+        self._packs = {}
+        self._lock = threading.Lock()
+
+    def get_pack(self, baseline_directory):
+        """Get the pack of a baseline folder
+
+        :param baseline_directory: baseline folder
+        :returns: BaselinePack object
+        """
+        with self._lock:
+            if baseline_directory not in self._packs:
+                self._packs[baseline_directory] = BaselinePack(os.path.join(baseline_directory, self.pack_name))
+            return self._packs[baseline_directory]
+
+    def _get_entry(self, baseline_path):
+        """Get the pack entry of a baseline image
+
+        :param baseline_path: baseline image path
+        :returns: tuple with data offset, data length and pixels digest, or None if baseline is not in the pack
+        """
+        return self.get_pack(os.path.dirname(baseline_path)).get_entry(os.path.basename(baseline_path))
+
+    def exists(self, baseline_path):
+        """Check if a baseline image exists in the pack or in the baseline folder
+
+        :param baseline_path: baseline image path
+        :returns: True if the baseline image exists
+        """
+        return self._get_entry(baseline_path) is not None or super(PackBaselineStore, self).exists(baseline_path)
+
+    def open(self, baseline_path):
+        """Open a baseline image to read its PNG data from the pack, or from the baseline folder if it is not packed
+
+        :param baseline_path: baseline image path
+        :returns: binary file object
+        """
+        if self._get_entry(baseline_path) is None:
+            return super(PackBaselineStore, self).open(baseline_path)
+        return BytesIO(self.get_pack(os.path.dirname(baseline_path)).read(os.path.basename(baseline_path)))
+
+    def copy(self, baseline_path, destination_path):
+        """Copy a baseline image to a PNG file
+
+        :param baseline_path: baseline image path
+        :param destination_path: destination file path
+        """
+        with self.open(baseline_path) as baseline_file, open(destination_path, 'wb') as destination_file:
+            shutil.copyfileobj(baseline_file, destination_file)
+
+    def get_version(self, baseline_path):
+        """Get an identifier of the current version of a baseline image, that changes when the baseline is saved again
+
+        :param baseline_path: baseline image path
+        :returns: version identifier, the position of the pack entry or the modification time of the baseline file if
+                  it is not in the pack
+        """
+        entry = self._get_entry(baseline_path)
+        return entry[0] if entry else super(PackBaselineStore, self).get_version(baseline_path)
+
+    def get_digest(self, baseline_path):
+        """Get baseline pixels digest from the pack, or from the digest file if baseline is not in the pack
+
+        :param baseline_path: baseline image path
+        :returns: str with the hexadecimal digest or None if there is no valid cached digest
+        """
+        entry = self._get_entry(baseline_path)
+        return entry[2] if entry else super(PackBaselineStore, self).get_digest(baseline_path)
+
+    def save_digest(self, baseline_path, digest):
+        """Save baseline pixels digest in a file beside the baseline, only if baseline is not in the pack
+
+        :param baseline_path: baseline image path
+        :param digest: str with the hexadecimal digest
+        """
+        if self._get_entry(baseline_path) is None:
+            super(PackBaselineStore, self).save_digest(baseline_path, digest)
+
+    def save(self, img, baseline_path, digest, save_image):
+        """Save an image as baseline, appending it to the pack file
+
+        :param img: image object
+        :param baseline_path: baseline image path
+        :param digest: str with the hexadecimal digest of the image pixels
+        :param save_image: function that receives the image object and a file object and saves the image in PNG format
+        """
+        data = BytesIO()
+        save_image(img, data)
+        self.get_pack(os.path.dirname(baseline_path)).append(os.path.basename(baseline_path), data.getvalue(), digest)
+
+
+#: baseline store classes by their name in baseline_store config property
+baseline_stores = {'directory': DirectoryBaselineStore, 'content': ContentAddressedBaselineStore,
+                   'pack': PackBaselineStore}
+_baseline_store_instances = {}
+
+
+def get_baseline_store(store_type='directory'):
+    """Get the baseline store of a type, that is shared by all visual tests
+
+    :param store_type: baseline store type (directory, content or pack)
+    :returns: baseline store object
+    """
+    if store_type not in baseline_stores:
+        raise ValueError(f"Unknown visual baseline store '{store_type}', valid values are:"
+                         f" {', '.join(baseline_stores)}")
+    if store_type not in _baseline_store_instances:
+        _baseline_store_instances[store_type] = baseline_stores[store_type]()
+    return _baseline_store_instances[store_type]
+
+
+def migrate_directory(baseline_root, remove=False):
+    """Migrate all baseline folders in a baselines root folder to the content addressed baseline store
+
+    :param baseline_root: folder that contains a baseline folder per baseline name
+    :param remove: True if migrated PNG files and their digest files must be removed from the baseline folders
+    :returns: dict with the number of migrated baseline images and the number of blobs
+    """
+    store = get_baseline_store('content')
+    digests = set()
+    migrated = 0
+    for baseline_name in sorted(os.listdir(baseline_root)):
+        baseline_directory = os.path.join(baseline_root, baseline_name)
+        if baseline_name == store.blobs_name or not os.path.isdir(baseline_directory):
+            continue
+        for filename in sorted(os.listdir(baseline_directory)):
+            baseline_path = os.path.join(baseline_directory, filename)
+            if not filename.endswith('.png') or store.get_file(baseline_path) != baseline_path:
+                continue
+            with Image.open(baseline_path) as img:
+                digest = get_image_digest(img)
+            # Blob is a copy of the original file, so PNG files are not encoded again
+            store.save(img, baseline_path, digest, lambda _, blob_path: shutil.copyfile(baseline_path, blob_path))
+            digests.add(digest)
+            migrated += 1
+            if remove:
+                os.remove(baseline_path)
+                if os.path.exists(f'{baseline_path}.sha256'):
+                    os.remove(f'{baseline_path}.sha256')
+    return {'baselines': migrated, 'blobs': len(digests)}
+
+
+def pack_directory(baseline_directory, remove=False):
+    """Append PNG files of a baseline folder to its pack file
+
+    :param baseline_directory: baseline folder
+    :param remove: True if packed PNG files and their digest files must be removed from the baseline folder
+    :returns: number of packed baseline images
+    """
+    pack = get_baseline_store('pack').get_pack(baseline_directory)
+    packed = 0
+    for filename in sorted(os.listdir(baseline_directory)):
+        baseline_path = os.path.join(baseline_directory, filename)
+        if not filename.endswith('.png') or not os.path.isfile(baseline_path):
+            continue
+        # PNG files are appended as they are, without encoding them again
+        with open(baseline_path, 'rb') as f:
+            data = f.read()
+        with Image.open(BytesIO(data)) as img:
+            pack.append(filename, data, get_image_digest(img))
+        packed += 1
+        if remove:
+            os.remove(baseline_path)
+            if os.path.exists(f'{baseline_path}.sha256'):
+                os.remove(f'{baseline_path}.sha256')
+    return packed
+
+
+def compact_pack(baseline_directory):
+    """Remove outdated entries from the pack file of a baseline folder
+
+    :param baseline_directory: baseline folder
+    :returns: number of removed entries
+    """
+    return get_baseline_store('pack').get_pack(baseline_directory).compact()
+
+
+def main(args=None):
+    """Manage visual testing baselines from command line
+
+    :param args: command line arguments, by default sys.argv
+    :returns: exit code
+    """
+    parser = argparse.ArgumentParser(prog='python -m toolium.utils.baseline_store',
+                                     description='Manage visual testing baseline stores')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate', help='migrate baseline folders to the content addressed store')
+    migrate_parser.add_argument('baseline_directory',
+                                help='baselines root folder, that contains a baseline folder per baseline name')
+    migrate_parser.add_argument('--remove', action='store_true',
+                                help='remove migrated PNG files from baseline folders')
+    pack_parser = subparsers.add_parser('pack', help='append PNG files of a baseline folder to its pack file')
+    pack_parser.add_argument('baseline_directory', help='baseline folder')
+    pack_parser.add_argument('--remove', action='store_true', help='remove packed PNG files from baseline folder')
+    compact_parser = subparsers.add_parser('compact', help='remove outdated entries from the pack file')
+    compact_parser.add_argument('baseline_directory', help='baseline folder')
+    parsed_args = parser.parse_args(args)
+
+    if parsed_args.command == 'migrate':
+        results = migrate_directory(parsed_args.baseline_directory, parsed_args.remove)
+        print('Migrated baselines: {} ({} different images)'.format(results['baselines'], results['blobs']))
+    elif parsed_args.command == 'pack':
+        print('Packed baselines: {}'.format(pack_directory(parsed_args.baseline_directory, parsed_args.remove)))
+    else:
+        print('Removed outdated baselines: {}'.format(compact_pack(parsed_args.baseline_directory)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -48,13 +48,12 @@ class Utils(WaitUtils):
         :returns: screenshot path
         """
         from toolium.driver_wrappers_pool import DriverWrappersPool
-        filename = '{0:0=2d}_{1}'.format(DriverWrappersPool.screenshots_number, name)
+        filename = '{0:0=2d}_{1}'.format(DriverWrappersPool.get_screenshot_number(), name)
         filename = '{}.png'.format(get_valid_filename(filename))
         filepath = os.path.join(DriverWrappersPool.screenshots_directory, filename)
         makedirs_safe(DriverWrappersPool.screenshots_directory)
         if self.driver_wrapper.driver.get_screenshot_as_file(filepath):
             self.logger.info('Screenshot saved in %s', filepath)
-            DriverWrappersPool.screenshots_number += 1
             return filepath
         return None
 
@@ -239,14 +238,13 @@ class Utils(WaitUtils):
         :param video_name: video name
         """
         from toolium.driver_wrappers_pool import DriverWrappersPool
-        filename = '{0:0=2d}_{1}'.format(DriverWrappersPool.videos_number, video_name)
+        filename = '{0:0=2d}_{1}'.format(DriverWrappersPool.get_video_number(), video_name)
         filename = '{}.mp4'.format(get_valid_filename(filename))
         filepath = os.path.join(DriverWrappersPool.videos_directory, filename)
         makedirs_safe(DriverWrappersPool.videos_directory)
         response = requests.get(video_url)
         open(filepath, 'wb').write(response.content)
         self.logger.info("Video saved in '%s'", filepath)
-        DriverWrappersPool.videos_number += 1
 
     def is_remote_video_enabled(self, server_type, remote_node):
         """Check if the remote node has the video recorder enabled
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2023 Telefónica Investigación y Desarrollo, S.A.U.
+This file is part of Toolium.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class ImageCache(object):
+    """LRU cache of decoded images, keyed by file path and version (e.g. modification time) and bounded by a memory
+    budget
+
+    :type max_size: int
+    :type size: int
+    """
+    max_size = 0  #: maximum size in bytes of cached images, 0 to disable the cache
+    size = 0  #: size in bytes of cached images
+
+    def __init__(self, max_size=0):
+        self.max_size = max_size
+        self.size = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, image_path, mtime):
+        """Get a cached image and mark it as the most recently used
+
+        :param image_path: image file path
+        :param mtime: image file modification time or any other version identifier
+        :returns: tuple with the image object and its digest, or None if it is not cached
+        """
+        with self._lock:
+            entry = self._images.get((image_path, mtime))
+            if entry is None:
+                return None
+            self._images.move_to_end((image_path, mtime))
+            return entry[0], entry[1]
+
+    def put(self, image_path, mtime, img, digest=None):
+        """Add an image to the cache, evicting least recently used images if the memory budget is exceeded
+
+        :param image_path: image file path
+        :param mtime: image file modification time or any other version identifier
+        :param img: decoded image object
+        :param digest: image pixels digest
+        """
+        image_size = img.width * img.height * len(img.getbands())
+        if image_size > self.max_size:
+            return
+        with self._lock:
+            self._remove(lambda key: key[0] == image_path)
+            self._images[(image_path, mtime)] = (img, digest, image_size)
+            self.size += image_size
+            while self.size > self.max_size:
+                self.size -= self._images.popitem(last=False)[1][2]
+
+    def invalidate(self, image_path):
+        """Remove all cached versions of an image
+
+        :param image_path: image file path
+        """
+        with self._lock:
+            self._remove(lambda key: key[0] == image_path)
+
+    def clear(self):
+        """Remove all cached images"""
+        with self._lock:
+            self._images.clear()
+            self.size = 0
+
+    def _remove(self, condition):
+        """Remove cached images whose key matches a condition, lock must be acquired before
+
+        :param condition: function that receives a key and returns True if the image must be removed
+        """
+        for key in [key for key in self._images if condition(key)]:
+            self.size -= self._images.pop(key)[2]
@@ -18,7 +18,15 @@ limitations under the License.
 
 from os import makedirs
 import errno
+import os
 import re
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
 
 FILENAME_MAX_LENGTH = 100
 
@@ -47,3 +55,122 @@ def makedirs_safe(folder):
     except OSError as e:
         if e.errno != errno.EEXIST:
             raise
+
+
+def link_directory(folder, link_path):
+    """
+    Point a symbolic link to a folder, replacing atomically the previous link. If there is a folder instead of a link
+    in the link path, it is removed.
+    :param folder: folder path
+    :param link_path: symbolic link path, in the same parent folder as the folder
+    :raises OSError: if symbolic links are not supported
+    """
+    temp_link_path = f'{link_path}.{os.getpid()}.tmp'
+    if os.path.lexists(temp_link_path):
+        os.remove(temp_link_path)
+    os.symlink(os.path.relpath(folder, os.path.dirname(link_path)), temp_link_path, target_is_directory=True)
+    try:
+        if os.path.isdir(link_path) and not os.path.islink(link_path):
+            shutil.rmtree(link_path)
+        os.replace(temp_link_path, link_path)
+    except OSError:
+        os.remove(temp_link_path)
+        raise
+
+
+def sync_directory(source, destination):
+    """
+    Update a folder to contain the same files as the source folder, creating hard links to new or modified files and
+    removing files that are not in the source folder. Unchanged files are not copied again and files are only copied
+    if hard links are not supported.
+    :param source: source folder path
+    :param destination: destination folder path
+    """
+    if os.path.islink(destination):
+        os.remove(destination)
+    for source_root, _, filenames in os.walk(source):
+        destination_root = os.path.join(destination, os.path.relpath(source_root, source))
+        makedirs_safe(destination_root)
+        for filename in filenames:
+            _link_file(os.path.join(source_root, filename), os.path.join(destination_root, filename))
+    _remove_missing_files(source, destination)
+
+
+def _link_file(source_file, destination_file):
+    """
+    Create a hard link to a file, or copy it if hard links are not supported, unless the destination file is the same
+    :param source_file: source file path
+    :param destination_file: destination file path
+    """
+    if os.path.exists(destination_file):
+        source_stat, destination_stat = os.stat(source_file), os.stat(destination_file)
+        if os.path.samestat(source_stat, destination_stat) or (
+                source_stat.st_size == destination_stat.st_size and
+                source_stat.st_mtime_ns == destination_stat.st_mtime_ns):
+            return
+        os.remove(destination_file)
+    try:
+        os.link(source_file, destination_file)
+    except OSError:
+        shutil.copy2(source_file, destination_file)
+
+
+def _remove_missing_files(source, destination):
+    """
+    Remove files and folders of the destination folder that do not exist in the source folder
+    :param source: source folder path
+    :param destination: destination folder path
+    """
+    for destination_root, dirnames, filenames in os.walk(destination, topdown=False):
+        source_root = os.path.join(source, os.path.relpath(destination_root, destination))
+        for filename in filenames:
+            if not os.path.isfile(os.path.join(source_root, filename)):
+                os.remove(os.path.join(destination_root, filename))
+        for dirname in dirnames:
+            if not os.path.isdir(os.path.join(source_root, dirname)):
+                os.rmdir(os.path.join(destination_root, dirname))
+
+
+def increment_counter_file(counter_path, initial_value=1):
+    """
+    Increment atomically a number saved in a file, that can be shared by several threads and processes
+    :param counter_path: counter file path
+    :param initial_value: number returned if the counter file does not exist yet
+    :returns: counter number before incrementing it
+    """
+    with os.fdopen(os.open(counter_path, os.O_RDWR | os.O_CREAT), 'r+') as f:
+        _lock_file(f)
+        try:
+            content = f.read().strip()
+            number = int(content) if content else initial_value
+            f.seek(0)
+            f.truncate()
+            f.write(str(number + 1))
+            f.flush()
+        finally:
+            _unlock_file(f)
+    return number
+
+
+def _lock_file(f):
+    """
+    Wait until an exclusive lock of a file is acquired
+    :param f: file object
+    """
+    f.seek(0)
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock_file(f):
+    """
+    Release the exclusive lock of a file
+    :param f: file object
+    """
+    f.seek(0)
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
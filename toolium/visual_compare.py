@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2023 Telefónica Investigación y Desarrollo, S.A.U.
+This file is part of Toolium.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Compare again the screenshots of a visual testing execution with a baseline folder, without executing the tests.
+
+Usage: python -m toolium.visual_compare OUTPUT_DIRECTORY BASELINE_DIRECTORY [options]
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from toolium.config_parser import ExtendedConfigParser
+from toolium.driver_wrapper import DriverWrapper
+from toolium.driver_wrappers_pool import DriverWrappersPool
+from toolium.utils.baseline_store import baseline_stores
+from toolium.utils.path_utils import makedirs_safe
+from toolium.visual_test import VisualTest
+
+# Screenshots filenames generated by VisualTest: {number}_{filename}__{file_suffix}.png
+SCREENSHOT_PATTERN = re.compile(r'^(?P<number>[0-9]+)_(?P<filename>.+?)(__(?P<suffix>.+))?\.png$')
+
+
+class OfflineVisualTest(VisualTest):
+    """Visual testing class that compares files without a driver
+
+    :type records: list of dict
+    """
+    records = None  #: report records kept in memory, or None to append them to the records file
+
+    def _add_record_to_report(self, record):
+        """Keep the record in memory if records list is initialized, in order to be saved by the main process
+
+        :param record: dict with the record data
+        """
+        if self.records is None:
+            super(OfflineVisualTest, self)._add_record_to_report(record)
+        else:
+            self.records.append(record)
+
+
+_visual_test = None
+
+
+def get_visual_test(report_directory, baseline_directory, complete_report=True, diff_engine='numpy',
+                    baseline_store='directory', comparison_mode='pixel', comparison_tolerance=None):
+    """Create a visual testing object configured to compare files offline
+
+    :param report_directory: folder where the new report will be generated
+    :param baseline_directory: folder with the baseline images
+    :param complete_report: True if equal images must be added to the report
+    :param diff_engine: engine used to calculate differences (numpy or pil)
+    :param baseline_store: store used to read baseline images (directory, content or pack)
+    :param comparison_mode: comparison mode (pixel, tolerance, isolated or ssim)
+    :param comparison_tolerance: tolerance of the comparison mode or None to use its default tolerance
+    :returns: offline visual testing object
+    """
+    DriverWrappersPool._empty_pool()
+    DriverWrappersPool.visual_output_directory = report_directory
+    driver_wrapper = DriverWrapper()
+    driver_wrapper.config = ExtendedConfigParser()
+    driver_wrapper.config.add_section('VisualTests')
+    driver_wrapper.config.set('VisualTests', 'enabled', 'true')
+    driver_wrapper.config.set('VisualTests', 'complete_report', str(complete_report).lower())
+    driver_wrapper.config.set('VisualTests', 'diff_engine', diff_engine)
+    driver_wrapper.config.set('VisualTests', 'baseline_store', baseline_store)
+    driver_wrapper.config.set('VisualTests', 'comparison_mode', comparison_mode)
+    if comparison_tolerance is not None:
+        if comparison_mode not in VisualTest.comparison_tolerance_options:
+            raise ValueError(f"Visual comparison mode '{comparison_mode}' has no tolerance")
+        driver_wrapper.config.set('VisualTests', VisualTest.comparison_tolerance_options[comparison_mode],
+                                  str(comparison_tolerance))
+    driver_wrapper.baseline_name = os.path.basename(os.path.normpath(baseline_directory))
+    driver_wrapper.visual_baseline_directory = baseline_directory
+    return OfflineVisualTest(driver_wrapper)
+
+
+def _initialize_worker(*args):
+    """Create the visual testing object used by a worker process
+
+    :param args: arguments of get_visual_test function
+    """
+    global _visual_test
+    _visual_test = get_visual_test(*args)
+
+
+def _compare_screenshot(screenshot):
+    """Compare a screenshot with its baseline in a worker process
+
+    :param screenshot: tuple with report name, image path, baseline path and threshold
+    :returns: tuple with comparison result and report records
+    """
+    report_name, image_path, baseline_path, threshold = screenshot
+    _visual_test.records = []
+    if _visual_test.baseline_store.exists(baseline_path):
+        result = _visual_test.compare_files(report_name, image_path, baseline_path, threshold)
+    else:
+        result = 'diff-Baseline file not found'
+        _visual_test._add_result_to_report('diff', report_name, image_path, None, None, 'Baseline file not found')
+    return result, _visual_test.records
+
+
+def get_screenshots_records(output_directory):
+    """Read the report records of a visual output folder, to get the original names of its screenshots
+
+    :param output_directory: visual output folder of a previous execution
+    :returns: dict with the result record of each screenshot filename
+    """
+    records_base, records_extension = os.path.splitext(VisualTest.records_name)
+    records = {}
+    for records_path in glob.glob(os.path.join(glob.escape(output_directory), records_base + '*' + records_extension)):
+        with open(records_path, encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get('type') == 'result' and 'image' in record:
+                    records[record['image']] = record
+    return records
+
+
+def get_screenshots(output_directory, report_directory, baseline_directory, threshold):
+    """Find screenshots in a visual output folder and copy them to the new report folder
+    Screenshots and baseline filenames are read from the report records of the output folder, because characters that
+    are not valid in filenames are replaced in screenshot filenames and baseline copies of the report could be taken as
+    screenshots. Screenshots of old reports without records are found and parsed by their filenames
+
+    :param output_directory: visual output folder of a previous execution
+    :param report_directory: folder where the new report will be generated
+    :param baseline_directory: folder with the baseline images
+    :param threshold: percentage threshold
+    :returns: list of tuples with report name, image path, baseline path and threshold
+    """
+    records = get_screenshots_records(output_directory)
+    if records:
+        screenshots_names = [(image_name, record['name'], record['baseline'])
+                             for image_name, record in sorted(records.items()) if 'baseline' in record]
+    else:
+        screenshots_names = []
+        for image_name in sorted(os.listdir(output_directory)):
+            match = SCREENSHOT_PATTERN.match(image_name)
+            if not match or image_name.endswith('.diff.png'):
+                continue
+            filename, file_suffix = match.group('filename'), match.group('suffix')
+            report_name = '{}<br>({})'.format(file_suffix, filename) if file_suffix else '-<br>({})'.format(filename)
+            screenshots_names.append((image_name, report_name, '{}.png'.format(filename)))
+
+    screenshots = []
+    for image_name, report_name, baseline_name in screenshots_names:
+        image_path = os.path.join(report_directory, image_name)
+        shutil.copyfile(os.path.join(output_directory, image_name), image_path)
+        baseline_path = os.path.join(baseline_directory, baseline_name)
+        screenshots.append((report_name, image_path, baseline_path, threshold))
+    return screenshots
+
+
+def compare_directories(output_directory, baseline_directory, report_directory, threshold=0, workers=None,
+                        complete_report=True, diff_engine='numpy', baseline_store='directory', comparison_mode='pixel',
+                        comparison_tolerance=None):
+    """Compare all screenshots of a visual output folder with a baseline folder using a process pool,
+    generating a new visual report
+
+    :param output_directory: visual output folder of a previous execution
+    :param baseline_directory: folder with the baseline images
+    :param report_directory: folder where the new report will be generated
+    :param threshold: percentage threshold
+    :param workers: number of worker processes, by default the number of CPUs
+    :param complete_report: True if equal images must be added to the report
+    :param diff_engine: engine used to calculate differences (numpy or pil)
+    :param baseline_store: store used to read baseline images (directory, content or pack)
+    :param comparison_mode: comparison mode (pixel, tolerance, isolated or ssim)
+    :param comparison_tolerance: tolerance of the comparison mode or None to use its default tolerance
+    :returns: dict with the number of equal and different screenshots
+    """
+    # Remove previous report to start a new one
+    makedirs_safe(report_directory)
+    for report_file in (VisualTest.report_name, VisualTest.records_name):
+        if os.path.exists(os.path.join(report_directory, report_file)):
+            os.remove(os.path.join(report_directory, report_file))
+    initargs = (report_directory, baseline_directory, complete_report, diff_engine, baseline_store, comparison_mode,
+                comparison_tolerance)
+    visual_test = get_visual_test(*initargs)
+    # Check comparison mode and tolerance before starting worker processes
+    visual_test.get_comparison_mode()
+    screenshots = get_screenshots(output_directory, report_directory, baseline_directory, threshold)
+
+    results = {'equal': 0, 'diff': 0}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_initialize_worker, initargs=initargs) as executor:
+        # Records are saved in the main process to keep screenshots order in the report
+        for result, records in executor.map(_compare_screenshot, screenshots):
+            results['diff' if result.startswith('diff') else 'equal'] += 1
+            for record in records:
+                visual_test._add_record_to_report(record)
+    VisualTest.render_report(report_directory)
+    return results
+
+
+def main(args=None):
+    """Compare again a visual testing execution from command line
+
+    :param args: command line arguments, by default sys.argv
+    :returns: exit code, 1 if any screenshot is different from its baseline
+    """
+    parser = argparse.ArgumentParser(prog='python -m toolium.visual_compare',
+                                     description='Compare screenshots of a visual testing execution with a baseline'
+                                                 ' folder using all CPU cores, without executing tests again')
+    parser.add_argument('output_directory', help='visual output folder of a previous execution')
+    parser.add_argument('baseline_directory', help='folder with the baseline images')
+    parser.add_argument('-r', '--report-directory',
+                        help='folder where the new report will be generated (default: OUTPUT_DIRECTORY/recompare)')
+    parser.add_argument('-t', '--threshold', type=float, default=0,
+                        help='percentage threshold, a number between 0 and 1 (default: 0)')
+    parser.add_argument('-w', '--workers', type=int, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('-e', '--diff-engine', choices=['numpy', 'pil'], default='numpy',
+                        help='engine used to calculate differences (default: numpy)')
+    parser.add_argument('-s', '--baseline-store', choices=list(baseline_stores), default='directory',
+                        help='store used to read baseline images (default: directory)')
+    parser.add_argument('-m', '--comparison-mode', choices=VisualTest.comparison_modes, default='pixel',
+                        help='comparison mode (default: pixel)')
+    parser.add_argument('--comparison-tolerance', type=float,
+                        help='tolerance of the comparison mode, from 0 to 255 in tolerance mode (default: 16)'
+                             ' and from 0 to 1 in ssim mode (default: 0.95)')
+    parser.add_argument('--failed-only', action='store_true', help='add only failed comparisons to the report')
+    parsed_args = parser.parse_args(args)
+
+    report_directory = parsed_args.report_directory or os.path.join(parsed_args.output_directory, 'recompare')
+    results = compare_directories(parsed_args.output_directory, parsed_args.baseline_directory, report_directory,
+                                  parsed_args.threshold, parsed_args.workers, not parsed_args.failed_only,
+                                  parsed_args.diff_engine, parsed_args.baseline_store, parsed_args.comparison_mode,
+                                  parsed_args.comparison_tolerance)
+    print('Visual asserts: {} ({} failed), report: {}'.format(sum(results.values()), results['diff'],
+                                                              os.path.join(report_directory, VisualTest.report_name)))
+    return 1 if results['diff'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
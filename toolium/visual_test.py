@@ -17,19 +17,30 @@ limitations under the License.
 """
 
 import datetime
-import itertools
+import glob
+import heapq
+import json
 import logging
 import os
-import re
 import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from os import path
-from selenium.common.exceptions import NoSuchElementException
+from selenium.common.exceptions import NoSuchElementException, WebDriverException
 
 from toolium.driver_wrappers_pool import DriverWrappersPool
-from toolium.utils.path_utils import get_valid_filename, makedirs_safe
+from toolium.utils.baseline_store import get_baseline_store, get_image_digest
+from toolium.utils.image_cache import ImageCache
+from toolium.utils.path_utils import get_valid_filename, link_directory, makedirs_safe, sync_directory
 
-from PIL import Image, ImageChops
+from PIL import Image, ImageChops, ImageDraw
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class VisualTest(object):
@@ -41,9 +52,38 @@ class VisualTest(object):
     javascript_name = 'VisualTests.js'  #: name of the javascript file
     css_name = 'VisualTests.css'  #: name of the css file
     report_name = 'VisualTests.html'  #: final visual report name
+    records_name = 'VisualTests.jsonl'  #: visual results records file name, used to render the html report
     driver_wrapper = None  #: driver wrapper instance
     results = {'equal': 0, 'diff': 0, 'baseline': 0}  #: dict to save visual assert results
     force = False  #: if True, screenshot is compared even if visual testing is disabled by configuration
+    executor = None  #: thread pool to compare screenshots in background
+    sync_point = None  #: when background comparisons must be waited (assert, test or session)
+    pending_comparisons = []  #: list of background comparisons futures
+    report_lock = threading.Lock()  #: lock to update visual results and html report from several threads
+    last_render_time = 0  #: time when the html report was rendered for the last time
+    baseline_cache = ImageCache()  #: cache of decoded baseline images
+    geometry = None  #: page geometry of the current visual assert, to avoid a javascript call per element
+    comparison_modes = ('pixel', 'tolerance', 'isolated', 'ssim')  #: valid comparison modes
+    default_comparison_tolerances = {'tolerance': 16, 'ssim': 0.95}  #: default tolerance of each comparison mode
+    comparison_tolerance_options = {'tolerance': 'channel_tolerance',
+                                    'ssim': 'ssim_tolerance'}  #: config property of each comparison mode tolerance
+    comparison_tolerance_ranges = {'tolerance': (0, 255), 'ssim': (0, 1)}  #: valid tolerances of each comparison mode
+    regions_block_size = 16  #: size in pixels of the blocks used to cluster different pixels in regions
+    max_diff_regions = 5  #: maximum number of differences regions shown in the html report and error messages
+    strip_height = 1024  #: height in pixels of the horizontal strips used to calculate differences of tall images
+    thumbnails_executor = None  #: thread to generate html report thumbnails in background
+    pending_thumbnails = []  #: list of background thumbnails futures
+    scroll_script = ('var scrollX = window.pageXOffset, scrollY = window.pageYOffset;'
+                     'window.scrollTo(0, arguments[0]);'
+                     'return {scrollX: scrollX, scrollY: scrollY, newScrollY: window.pageYOffset,'
+                     '        pageHeight: Math.max(document.body.scrollHeight, document.documentElement.scrollHeight)};')
+    geometry_script = ('var rects = [];'
+                       'for (var i = 0; i < arguments.length; i++) {'
+                       '  var rect = arguments[i].getBoundingClientRect();'
+                       '  rects.push([rect.left, rect.top, rect.right, rect.bottom]);'
+                       '}'
+                       'return {scrollHeight: document.body.scrollHeight, scrollWidth: document.body.scrollWidth,'
+                       '        innerHeight: window.innerHeight, innerWidth: window.innerWidth, rects: rects};')
 
     def __init__(self, driver_wrapper=None, force=False):
         self.driver_wrapper = driver_wrapper if driver_wrapper else DriverWrappersPool.get_default_wrapper()
@@ -65,26 +105,29 @@ class VisualTest(object):
 
         self.baseline_directory = self.driver_wrapper.visual_baseline_directory
         self.save_baseline = self.driver_wrapper.config.getboolean_optional('VisualTests', 'save')
+        baseline_store = self.driver_wrapper.config.get_optional('VisualTests', 'baseline_store', 'directory')
+        self.baseline_store = get_baseline_store(baseline_store)
+        self.thumbnail_width = int(self.driver_wrapper.config.get_optional('VisualTests', 'report_thumbnail_width')
+                                   or 0)
 
         # Create folders
         makedirs_safe(self.baseline_directory)
         makedirs_safe(self.output_directory)
 
-        # Copy js, css and html template to output directory
-        dst_template_path = os.path.join(self.output_directory, self.report_name)
-        if not os.path.exists(dst_template_path):
+        # Copy js and css to output directory and initialize the html report
+        dst_report_path = os.path.join(self.output_directory, self.report_name)
+        if not os.path.exists(dst_report_path):
             resources_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'resources')
-            orig_template_path = os.path.join(resources_path, self.template_name)
             orig_javascript_path = os.path.join(resources_path, self.javascript_name)
             dst_javascript_path = os.path.join(self.output_directory, self.javascript_name)
             orig_css_path = os.path.join(resources_path, self.css_name)
             dst_css_path = os.path.join(self.output_directory, self.css_name)
-            shutil.copyfile(orig_template_path, dst_template_path)
             shutil.copyfile(orig_javascript_path, dst_javascript_path)
             shutil.copyfile(orig_css_path, dst_css_path)
             self._add_summary_to_report()
 
-    def assert_screenshot(self, element, filename, file_suffix=None, threshold=0, exclude_elements=[]):
+    def assert_screenshot(self, element, filename, file_suffix=None, threshold=0, exclude_elements=[],
+                          comparison_mode=None, full_page=False):
         """Assert that a screenshot of an element is the same as a screenshot on disk, within a given threshold
 
         :param element: either a WebElement, PageElement or element locator as a tuple (locator_type, locator_value).
@@ -94,11 +137,20 @@ class VisualTest(object):
         :param threshold: percentage threshold for triggering a test failure (value between 0 and 1)
         :param exclude_elements: list of WebElements, PageElements or element locators as a tuple (locator_type,
                                  locator_value) that must be excluded from the assertion
+        :param comparison_mode: comparison mode (pixel, tolerance, isolated or ssim), by default the configured mode
+        :param full_page: if True, the whole page is captured scrolling the browser window, instead of the visible part
         """
         if not self.driver_wrapper.config.getboolean_optional('VisualTests', 'enabled') and not self.force:
             return
         if not (isinstance(threshold, int) or isinstance(threshold, float)) or threshold < 0 or threshold > 1:
             raise TypeError('Threshold must be a number between 0 and 1: {}'.format(threshold))
+        comparison_mode = self.get_comparison_mode(comparison_mode)[0]
+
+        # Raise errors of previous background comparisons
+        if self.sync_point == 'assert':
+            error = self.wait_pending_comparisons()
+            if error:
+                raise error
 
         # Search elements
         web_element = self.utils.get_web_element(element)
@@ -111,41 +163,248 @@ class VisualTest(object):
 
         baseline_path = os.path.join(self.baseline_directory, '{}.png'.format(filename))
         filename_with_suffix = '{0}__{1}'.format(filename, file_suffix) if file_suffix else filename
-        unique_name = '{0:0=2d}_{1}'.format(DriverWrappersPool.visual_number, filename_with_suffix)
+        unique_name = '{0:0=2d}_{1}'.format(DriverWrappersPool.get_visual_number(), filename_with_suffix)
         unique_name = '{}.png'.format(get_valid_filename(unique_name))
         output_path = os.path.join(self.output_directory, unique_name)
         report_name = '{}<br>({})'.format(file_suffix, filename) if file_suffix else '-<br>({})'.format(filename)
 
         # Get screenshot and modify it
-        img = Image.open(BytesIO(self.driver_wrapper.driver.get_screenshot_as_png()))
-        img = self.remove_scrolls(img)
-        img = self.mobile_resize(img)
-        img = self.desktop_resize(img)
-        img = self.exclude_elements(img, exclude_web_elements)
-        img = self.crop_element(img, web_element)
-        img.save(output_path)
-        DriverWrappersPool.visual_number += 1
+        img = self.get_screenshot(web_element, exclude_web_elements, full_page)
+
+        # Save and compare the screenshot, in background if async workers are configured
+        executor = self.get_executor()
+        if executor:
+            future = executor.submit(self.save_and_compare, img, filename, report_name, output_path, baseline_path,
+                                     threshold, comparison_mode)
+            self.pending_comparisons.append(future)
+        else:
+            self.save_and_compare(img, filename, report_name, output_path, baseline_path, threshold, comparison_mode)
+
+    def get_screenshot(self, web_element, exclude_web_elements, full_page=False):
+        """Capture a screenshot, remove scrolls, resize it, exclude elements and crop it to fit the element
+
+        :param web_element: WebElement object or None to get the full screenshot
+        :param exclude_web_elements: WebElement objects to be excluded
+        :param full_page: if True, the whole page is captured scrolling the browser window
+        :returns: modified image object
+        """
+        if full_page:
+            return self.get_full_page_screenshot(web_element, exclude_web_elements)
+        img = self.get_native_element_screenshot(web_element, exclude_web_elements)
+        if img:
+            return img
+
+        self.geometry = self.get_geometry([web_element] + exclude_web_elements if web_element else exclude_web_elements)
+        try:
+            img = Image.open(BytesIO(self.driver_wrapper.driver.get_screenshot_as_png()))
+            img = self.remove_scrolls(img)
+            img = self.mobile_resize(img)
+            img = self.desktop_resize(img)
+            img = self.exclude_elements(img, exclude_web_elements)
+            img = self.crop_element(img, web_element)
+        finally:
+            self.geometry = None
+        return img
+
+    def get_full_page_screenshot(self, web_element, exclude_web_elements):
+        """Capture a screenshot of the whole page scrolling the browser window. Each viewport screenshot is stitched in
+        the page image as soon as it is captured, so only one viewport screenshot is decoded at a time.
+        It is only available in desktop browsers.
+
+        :param web_element: WebElement object or None to get the whole page
+        :param exclude_web_elements: WebElement objects to be excluded
+        :returns: modified image object
+        """
+        if self.driver_wrapper.is_mobile_test():
+            raise ValueError('Full page screenshots are only available in desktop browsers')
+        driver = self.driver_wrapper.driver
+        page = driver.execute_script(self.scroll_script, 0)
+        try:
+            # Elements boxes are calculated with the page scrolled to the top, so they are page coordinates
+            self.geometry = self.get_geometry([web_element] + exclude_web_elements if web_element
+                                              else exclude_web_elements)
+            img = self._stitch_page_strips(max(int(page['pageHeight']), 1))
+            driver.execute_script(self.scroll_script, 0)
+            img = self.exclude_elements(img, exclude_web_elements)
+            img = self.crop_element(img, web_element)
+        finally:
+            self.geometry = None
+            driver.execute_script('window.scrollTo(arguments[0], arguments[1]);', page['scrollX'], page['scrollY'])
+        return img
+
+    def _stitch_page_strips(self, page_height):
+        """Scroll the browser window from the top to the bottom of the page, pasting in the page image only the rows of
+        each viewport screenshot that have not been captured yet. The page image is allocated with the whole page size
+
+        :param page_height: page height in pixels
+        :returns: page image object
+        """
+        driver = self.driver_wrapper.driver
+        img = None
+        top = 0
+        while top < page_height:
+            scroll_y = int(driver.execute_script(self.scroll_script, top)['newScrollY'])
+            strip = Image.open(BytesIO(driver.get_screenshot_as_png()))
+            strip = self.desktop_resize(self.remove_scrolls(strip))
+            if img is None:
+                img = Image.new('RGB', (strip.width, page_height))
+            # Last scroll could be stopped before the requested position, at the bottom of the page
+            strip_bottom = min(strip.height, page_height - scroll_y)
+            if strip_bottom <= top - scroll_y:
+                # Page can not be scrolled, it is shorter than expected
+                return img.crop((0, 0, img.width, top))
+            img.paste(strip.crop((0, top - scroll_y, strip.width, strip_bottom)), (0, top))
+            top = scroll_y + strip_bottom
+        return img
+
+    def get_native_element_screenshot(self, web_element, exclude_web_elements):
+        """Capture an element screenshot with the webdriver element screenshot endpoint, if element_screenshot property
+        is enabled. It is only available in desktop browsers without Retina display and without excluded elements.
+
+        :param web_element: WebElement object or None to get the full screenshot
+        :param exclude_web_elements: WebElement objects to be excluded
+        :returns: image object or None if the element screenshot must be cropped from the full screenshot
+        """
+        if (not web_element or exclude_web_elements
+                or not self.driver_wrapper.config.getboolean_optional('VisualTests', 'element_screenshot')
+                or self.driver_wrapper.is_mobile_test() or self.driver_wrapper.is_mac_test()):
+            return None
+        try:
+            return Image.open(BytesIO(web_element.screenshot_as_png))
+        except WebDriverException as exc:
+            self.logger.debug('Element screenshot is not supported, capturing full screenshot: %s', exc)
+            return None
+
+    def get_geometry(self, web_elements):
+        """Get scrolls sizes and elements boxes in a single javascript call, only in desktop browsers
+
+        :param web_elements: WebElement objects whose boxes must be calculated
+        :returns: dict with scrolls sizes and element boxes, or None if geometry can not be calculated with javascript
+        """
+        if self.driver_wrapper.is_mobile_test():
+            return None
+        try:
+            geometry = self.driver_wrapper.driver.execute_script(self.geometry_script, *web_elements)
+        except WebDriverException as exc:
+            self.logger.debug('Page geometry could not be calculated with javascript: %s', exc)
+            return None
+        if not isinstance(geometry, dict) or len(geometry.get('rects', [])) != len(web_elements):
+            return None
+        geometry['boxes'] = {web_element: self._get_rect_box(rect)
+                             for web_element, rect in zip(web_elements, geometry['rects'])}
+        return geometry
 
+    @staticmethod
+    def _get_rect_box(rect):
+        """Get element coordinates from its bounding client rect, rounded like the element location and size returned
+        by webdriver in get_element_box method
+
+        :param rect: list with left, top, right and bottom coordinates of the element
+        :returns: tuple with element coordinates
+        """
+        left, top, right, bottom = rect
+        width, height = right - left, bottom - top
+        left, top = round(left), round(top)
+        return left, top, int(left + width), int(top + height)
+
+    def save_and_compare(self, img, filename, report_name, output_path, baseline_path, threshold, comparison_mode=None):
+        """Save the screenshot and compare it with the baseline, or save it as baseline if save mode is enabled
+
+        :param img: screenshot image object
+        :param filename: the screenshot filename without extension
+        :param report_name: name to show in html report
+        :param output_path: output screenshot file path
+        :param baseline_path: baseline image file path
+        :param threshold: percentage threshold for triggering a test failure
+        :param comparison_mode: comparison mode, by default the configured mode
+        """
         # Determine whether we should save the baseline image
         if self.save_baseline:
-            # Copy screenshot to baseline
-            shutil.copyfile(output_path, baseline_path)
+            # Save screenshot as baseline
+            self.baseline_store.save(img, baseline_path, self.get_image_digest(img), self.save_image)
+            self.baseline_cache.invalidate(baseline_path)
 
             if self.driver_wrapper.config.getboolean_optional('VisualTests', 'complete_report'):
+                self.baseline_store.copy(baseline_path, output_path)
                 self._add_result_to_report('baseline', report_name, output_path, None, None,
                                            'Screenshot added to baseline')
 
             self.logger.debug("Visual screenshot '%s' saved in visualtests/baseline folder", filename)
-        elif not os.path.exists(baseline_path):
+        elif not self.baseline_store.exists(baseline_path):
             # Baseline should exist if save mode is not enabled
             error_message = f'Baseline file not found: {baseline_path}'
             self.logger.warning(error_message)
+            self.save_image(img, output_path)
             self._add_result_to_report('diff', report_name, output_path, None, None, 'Baseline file not found')
             if self.driver_wrapper.config.getboolean_optional('VisualTests', 'fail') or self.force:
                 raise AssertionError(error_message)
         else:
-            # Compare the screenshots
-            self.compare_files(report_name, output_path, baseline_path, threshold)
+            # Compare the screenshots, output screenshot is only saved if it is added to the report
+            self.compare_files(report_name, output_path, baseline_path, threshold, img, comparison_mode)
+
+    def save_image(self, img, image_path):
+        """Save an image in PNG format with the configured compression level
+
+        :param img: image object
+        :param image_path: image file path
+        """
+        compress_level = int(self.driver_wrapper.config.get_optional('VisualTests', 'png_compress_level') or 6)
+        img.save(image_path, 'PNG', compress_level=compress_level)
+
+    def get_executor(self):
+        """Get the thread pool to compare screenshots in background, if async_workers property is configured
+
+        :returns: thread pool executor or None if screenshots must be compared synchronously
+        """
+        async_workers = int(self.driver_wrapper.config.get_optional('VisualTests', 'async_workers') or 0)
+        if async_workers <= 0:
+            return None
+        sync_point = self.driver_wrapper.config.get_optional('VisualTests', 'async_sync_point', 'test')
+        if sync_point not in ('assert', 'test', 'session'):
+            raise ValueError(f"Unknown visual async sync point '{sync_point}', valid values are: assert, test, "
+                             f"session")
+        VisualTest.sync_point = sync_point
+        if VisualTest.executor is None:
+            VisualTest.executor = ThreadPoolExecutor(max_workers=async_workers, thread_name_prefix='visual_test')
+        return VisualTest.executor
+
+    @classmethod
+    def wait_pending_comparisons(cls, scope=None):
+        """Wait until background comparisons have finished and collect their errors
+        With session sync point, they are also waited in class scope, that is the last one in unittest test cases
+
+        :param scope: execution scope (function, module, class or session) or None to wait in any case
+        :returns: exception raised in background comparisons or None if all of them have passed
+        """
+        if scope not in (None, 'class', 'session') and cls.sync_point == 'session':
+            return None
+
+        # Wait for comparisons submitted until now
+        pending_comparisons = cls.pending_comparisons[:]
+        del cls.pending_comparisons[:len(pending_comparisons)]
+        errors = [future.exception() for future in pending_comparisons]
+        errors = [error for error in errors if error is not None]
+
+        if scope == 'session' and cls.executor:
+            cls.executor.shutdown()
+            cls.executor = None
+        if scope == 'session':
+            cls.wait_pending_thumbnails()
+
+        if len(errors) > 1:
+            return AssertionError('\n'.join(str(error) for error in errors))
+        return errors[0] if errors else None
+
+    @classmethod
+    def wait_pending_thumbnails(cls):
+        """Wait until background thumbnails have been generated, so that the html report can be copied"""
+        pending_thumbnails = cls.pending_thumbnails[:]
+        del cls.pending_thumbnails[:len(pending_thumbnails)]
+        for future in pending_thumbnails:
+            future.result()
+        if cls.thumbnails_executor:
+            cls.thumbnails_executor.shutdown()
+            cls.thumbnails_executor = None
 
     def get_scrolls_size(self):
         """Return Chrome and Explorer scrolls sizes if they are visible
@@ -156,10 +415,16 @@ class VisualTest(object):
         scroll_x = 0
         scroll_y = 0
         if self.utils.get_driver_name() in ['chrome', 'iexplore'] and not self.driver_wrapper.is_mobile_test():
-            scroll_height = self.driver_wrapper.driver.execute_script("return document.body.scrollHeight")
-            scroll_width = self.driver_wrapper.driver.execute_script("return document.body.scrollWidth")
-            window_height = self.driver_wrapper.driver.execute_script("return window.innerHeight")
-            window_width = self.driver_wrapper.driver.execute_script("return window.innerWidth")
+            if self.geometry:
+                scroll_height = self.geometry['scrollHeight']
+                scroll_width = self.geometry['scrollWidth']
+                window_height = self.geometry['innerHeight']
+                window_width = self.geometry['innerWidth']
+            else:
+                scroll_height = self.driver_wrapper.driver.execute_script("return document.body.scrollHeight")
+                scroll_width = self.driver_wrapper.driver.execute_script("return document.body.scrollWidth")
+                window_height = self.driver_wrapper.driver.execute_script("return window.innerHeight")
+                window_width = self.driver_wrapper.driver.execute_script("return window.innerWidth")
             scroll_size = 21 if self.utils.get_driver_name() == 'iexplore' else 17
             scroll_x = scroll_size if scroll_width > window_width else 0
             scroll_y = scroll_size if scroll_height > window_height else 0
@@ -216,6 +481,8 @@ class VisualTest(object):
         :param web_element: WebElement object
         :returns: tuple with element coordinates
         """
+        if self.geometry and web_element in self.geometry['boxes']:
+            return self.geometry['boxes'][web_element]
         if not self.driver_wrapper.is_mobile_test():
             scroll_x = self.driver_wrapper.driver.execute_script("return window.pageXOffset")
             scroll_x = scroll_x if scroll_x else 0
@@ -256,20 +523,20 @@ class VisualTest(object):
         """
         if web_elements and len(web_elements) > 0:
             img = img.convert("RGBA")
-            pixel_data = img.load()
+            draw = ImageDraw.Draw(img)
 
             for web_element in web_elements:
                 element_box = self.get_element_box(web_element)
-                for x, y in itertools.product(range(element_box[0], element_box[2]),
-                                              range(element_box[1], element_box[3])):
-                    try:
-                        pixel_data[x, y] = (0, 0, 0, 255)
-                    except IndexError:
-                        pass
+                # Reduce element box to the image size
+                x0, y0 = max(element_box[0], 0), max(element_box[1], 0)
+                x1, y1 = min(element_box[2], img.size[0]), min(element_box[3], img.size[1])
+                if x0 < x1 and y0 < y1:
+                    # Rectangle end coordinates are inclusive
+                    draw.rectangle((x0, y0, x1 - 1, y1 - 1), fill=(0, 0, 0, 255))
 
         return img
 
-    def compare_files(self, report_name, image_path, baseline_path, threshold):
+    def compare_files(self, report_name, image_path, baseline_path, threshold, image=None, comparison_mode=None):
         """Compare two image files, generate a new image file with highlighted differences,
            calculate the percentage of pixels that are different between both images and add result to the html report
 
@@ -277,22 +544,14 @@ class VisualTest(object):
         :param image_path: image file path
         :param baseline_path: baseline image file path
         :param threshold: percentage threshold
+        :param image: image object not saved yet, it is only saved in image_path if it is added to the html report
+        :param comparison_mode: comparison mode (pixel, tolerance, isolated or ssim), by default the configured mode
         :returns: result message
         """
-        # Make two new images with same size
-        with Image.open(image_path) as image:
-            image_size = image.size
-            with Image.open(baseline_path) as baseline:
-                baseline_size = baseline.size
-                max_size = (max(image.width, baseline.width), max(image.height, baseline.height))
-                image_max = Image.new('RGB', max_size)
-                image_max.paste(image.convert('RGB'))
-                baseline_max = Image.new('RGB', max_size)
-                baseline_max.paste(baseline.convert('RGB'))
-
-        # Generate and save diff image
-        diff_path = image_path.replace('.png', '.diff.png')
-        diff_pixels_percentage = self.save_differences_image(image_max, baseline_max, diff_path)
+        image_size, baseline_size, diff_pixels_percentage, diff_image = self._get_images_differences(image_path,
+                                                                                                     baseline_path,
+                                                                                                     image, threshold,
+                                                                                                     comparison_mode)
 
         # Check differences and add to report
         if image_size != baseline_size:
@@ -303,7 +562,7 @@ class VisualTest(object):
             result = 'diff'
         elif diff_pixels_percentage == 0:
             # Equal images
-            diff_path = diff_message = None
+            diff_image = diff_message = None
             result = 'equal'
         elif 0 < diff_pixels_percentage <= threshold:
             # Similar images
@@ -316,9 +575,13 @@ class VisualTest(object):
                                 f" (by a distance of {diff_pixels_percentage:.8f}, more than {threshold} threshold)"
             result = 'diff'
 
+        regions = []
         if (result == 'equal' and self.driver_wrapper.config.getboolean_optional('VisualTests', 'complete_report')
                 or result == 'diff'):
-            self._add_result_to_report(result, report_name, image_path, baseline_path, diff_path, diff_message)
+            regions = self._get_report_regions(diff_image, image_size, baseline_size)
+            diff_path = self._save_report_images(image_path, image, diff_image, regions)
+            self._add_result_to_report(result, report_name, image_path, baseline_path, diff_path, diff_message,
+                                       regions)
             # Add message to result to be used in unittests
             result = f'{result}-{diff_message}' if diff_message is not None else result
 
@@ -326,21 +589,301 @@ class VisualTest(object):
             self.logger.warning(f"Visual error in '{os.path.splitext(os.path.basename(baseline_path))[0]}':"
                                 f" {diff_message}")
             if self.driver_wrapper.config.getboolean_optional('VisualTests', 'fail') or self.force:
-                raise AssertionError(exception_message)
+                raise AssertionError(exception_message + self._get_regions_message(regions))
 
         return result
 
+    def _get_report_regions(self, diff_image, image_size, baseline_size):
+        """Get differences regions to be shown in the html report, only if both images have the same size
+
+        :param diff_image: image object with highlighted differences or None if images are equal
+        :param image_size: image size
+        :param baseline_size: baseline image size
+        :returns: list of differences regions, empty if they can not be calculated
+        """
+        if diff_image is None or image_size != baseline_size or numpy is None:
+            return []
+        return self.get_differences_regions(diff_image, self.regions_block_size)
+
+    def _save_report_images(self, image_path, image, diff_image, regions=None):
+        """Save images that have not been saved yet and will be shown in the html report, including thumbnails of the
+        differences regions, whose paths are added to each region dict
+
+        :param image_path: image file path
+        :param image: image object not saved yet or None if it is already saved
+        :param diff_image: image object with highlighted differences or None if images are equal
+        :param regions: list of differences regions
+        :returns: differences image file path or None if images are equal
+        """
+        if image is not None:
+            self.save_image(image, image_path)
+        if diff_image is None:
+            return None
+        diff_path = image_path.replace('.png', '.diff.png')
+        self.save_image(diff_image, diff_path)
+
+        # Thumbnails are saved in a subfolder of the report to avoid mixing them with screenshots
+        regions_directory = os.path.join(self.output_directory, 'regions')
+        for index, region in enumerate((regions or [])[:self.max_diff_regions], start=1):
+            makedirs_safe(regions_directory)
+            x0, y0, x1, y1 = region['box']
+            padding = self.regions_block_size
+            thumbnail_box = (max(x0 - padding, 0), max(y0 - padding, 0), min(x1 + padding, diff_image.width),
+                             min(y1 + padding, diff_image.height))
+            region['thumbnail'] = os.path.join(regions_directory,
+                                               os.path.basename(image_path).replace('.png', f'.{index}.png'))
+            self.save_image(diff_image.crop(thumbnail_box), region['thumbnail'])
+        return diff_path
+
+    def _get_regions_message(self, regions):
+        """Create a message describing the differences regions
+
+        :param regions: list of differences regions
+        :returns: str with the regions message or an empty string if there are not regions
+        """
+        if not regions:
+            return ''
+        regions_messages = [f"({', '.join(str(coordinate) for coordinate in region['box'])}): {region['pixels']} pixels"
+                            for region in regions[:self.max_diff_regions]]
+        if len(regions) > self.max_diff_regions:
+            regions_messages.append(f'and {len(regions) - self.max_diff_regions} more')
+        return f". Different regions: {', '.join(regions_messages)}"
+
+    def _get_images_differences(self, image_path, baseline_path, image=None, threshold=None, comparison_mode=None):
+        """Calculate differences between an image and its baseline and generate an image with highlighted differences
+        If the image pixels digest is equal to the baseline pixels digest, the differences image is not generated
+        If early exit is enabled and the comparison passes without being added to the report, neither it is generated
+
+        :param image_path: image file path
+        :param baseline_path: baseline image file path
+        :param image: image object or None to read it from image_path
+        :param threshold: percentage threshold or None to calculate always the exact differences
+        :param comparison_mode: comparison mode, by default the configured mode
+        :returns: tuple with image size, baseline size, percentage of pixels that are different (or the threshold if
+                  the comparison has been stopped early) and differences image
+        """
+        if image is None:
+            with Image.open(image_path) as image:
+                image = image.convert('RGB')
+        else:
+            image = image.convert('RGB')
+        image_digest = self.get_image_digest(image)
+        if image_digest == self._get_cached_baseline_digest(baseline_path):
+            return image.size, image.size, 0, None
+
+        baseline, baseline_digest = self._open_baseline(baseline_path)
+        if image_digest == baseline_digest:
+            return image.size, baseline.size, 0, None
+        comparison_mode, tolerance = self.get_comparison_mode(comparison_mode)
+        if self._is_early_exit_passed(image, baseline, threshold, comparison_mode, tolerance):
+            return image.size, baseline.size, threshold, None
+
+        # Make two new images with same size
+        image_max, baseline_max = image, baseline
+        if image.size != baseline.size:
+            max_size = (max(image.width, baseline.width), max(image.height, baseline.height))
+            image_max = Image.new('RGB', max_size)
+            image_max.paste(image)
+            baseline_max = Image.new('RGB', max_size)
+            baseline_max.paste(baseline)
+
+        # Generate diff image
+        diff_image, diff_pixels_percentage = self.get_differences_image(image_max, baseline_max, self.get_diff_engine(),
+                                                                        comparison_mode, tolerance, self.strip_height)
+        return image.size, baseline.size, diff_pixels_percentage, diff_image
+
+    def _is_early_exit_passed(self, image, baseline, threshold, comparison_mode='pixel', tolerance=None):
+        """Check if the comparison passes using the early exit tiled comparison, only when it is enabled and the
+        result is not added to the report, because the report needs the differences image and the exact distance
+
+        :param image: RGB image object
+        :param baseline: reference RGB baseline image object
+        :param threshold: percentage threshold or None if early exit is not allowed
+        :param comparison_mode: comparison mode (pixel, tolerance, isolated or ssim)
+        :param tolerance: tolerance of the comparison mode
+        :returns: True if the comparison is certain to pass
+        """
+        config = self.driver_wrapper.config
+        if (threshold is None or image.size != baseline.size
+                or not config.getboolean_optional('VisualTests', 'early_exit')
+                or config.getboolean_optional('VisualTests', 'complete_report')):
+            return False
+        return self.is_under_threshold(image, baseline, threshold, self.get_diff_engine(),
+                                       comparison_mode=comparison_mode, tolerance=tolerance)
+
+    def _open_baseline(self, baseline_path):
+        """Open a baseline image converted to RGB and calculate its digest, using the baseline images cache
+
+        :param baseline_path: baseline image file path
+        :returns: tuple with the RGB baseline image object and its pixels digest
+        """
+        cache_size = float(self.driver_wrapper.config.get_optional('VisualTests', 'baseline_cache_size') or 0)
+        self.baseline_cache.max_size = int(cache_size * 1024 * 1024)
+        baseline_version = self.baseline_store.get_version(baseline_path)
+        cached_baseline = self.baseline_cache.get(baseline_path, baseline_version)
+        if cached_baseline:
+            return cached_baseline
+
+        with self.baseline_store.open(baseline_path) as baseline_file, Image.open(baseline_file) as baseline:
+            baseline = baseline.convert('RGB')
+        baseline_digest = self.get_image_digest(baseline)
+        self._save_baseline_digest(baseline_path, baseline_digest)
+        self.baseline_cache.put(baseline_path, baseline_version, baseline, baseline_digest)
+        return baseline, baseline_digest
+
+    @staticmethod
+    def get_image_digest(img):
+        """Calculate a digest of the image size and its decoded RGB pixels
+
+        :param img: image object
+        :returns: str with the hexadecimal digest
+        """
+        return get_image_digest(img)
+
+    def _get_cached_baseline_digest(self, baseline_path):
+        """Get baseline pixels digest saved by the baseline store, if baseline has not changed
+
+        :param baseline_path: baseline image file path
+        :returns: str with the hexadecimal digest or None if there is no valid cached digest
+        """
+        return self.baseline_store.get_digest(baseline_path)
+
+    def _save_baseline_digest(self, baseline_path, digest):
+        """Save baseline pixels digest in the baseline store
+
+        :param baseline_path: baseline image file path
+        :param digest: str with the hexadecimal digest
+        """
+        self.baseline_store.save_digest(baseline_path, digest)
+
+    def get_diff_engine(self):
+        """Get configured engine to calculate images differences, falling back to pil if numpy is not installed
+
+        :returns: diff engine name (numpy or pil)
+        """
+        diff_engine = self.driver_wrapper.config.get_optional('VisualTests', 'diff_engine', 'numpy')
+        if diff_engine not in ('numpy', 'pil'):
+            raise ValueError(f"Unknown visual diff engine '{diff_engine}', valid values are: numpy, pil")
+        if diff_engine == 'numpy' and numpy is None:
+            self.logger.debug('numpy is not installed, visual differences will be calculated with pil engine')
+            diff_engine = 'pil'
+        return diff_engine
+
+    def get_comparison_mode(self, comparison_mode=None):
+        """Get comparison mode and its configured tolerance, read from the tolerance config property of the mode
+
+        :param comparison_mode: comparison mode of the assert or None to use the configured comparison mode
+        :returns: tuple with comparison mode name (pixel, tolerance, isolated or ssim) and its tolerance
+        """
+        if not comparison_mode:
+            comparison_mode = self.driver_wrapper.config.get_optional('VisualTests', 'comparison_mode', 'pixel')
+        if comparison_mode not in self.comparison_modes:
+            raise ValueError(f"Unknown visual comparison mode '{comparison_mode}', valid values are:"
+                             f" {', '.join(self.comparison_modes)}")
+        if comparison_mode != 'pixel' and numpy is None:
+            raise ImportError(f"numpy must be installed to use '{comparison_mode}' visual comparison mode")
+        if comparison_mode not in self.comparison_tolerance_options:
+            return comparison_mode, None
+        option = self.comparison_tolerance_options[comparison_mode]
+        tolerance = self.driver_wrapper.config.get_optional('VisualTests', option)
+        if not tolerance:
+            return comparison_mode, self.default_comparison_tolerances[comparison_mode]
+        minimum, maximum = self.comparison_tolerance_ranges[comparison_mode]
+        try:
+            tolerance = float(tolerance)
+        except ValueError:
+            tolerance = None
+        if tolerance is None or not minimum <= tolerance <= maximum:
+            raise ValueError(f"Invalid visual {option} '{self.driver_wrapper.config.get('VisualTests', option)}',"
+                             f" valid values are numbers from {minimum} to {maximum}")
+        return comparison_mode, tolerance
+
     @staticmethod
-    def save_differences_image(image, baseline, diff_path):
+    def save_differences_image(image, baseline, diff_path, engine='pil', comparison_mode='pixel', tolerance=None):
         """Create and save an image showing differences between both images
 
         :param image: image object
         :param baseline: reference baseline image object
         :param diff_path: file path where difference image will be saved
+        :param engine: engine used to calculate differences (numpy or pil)
+        :param comparison_mode: comparison mode (pixel, tolerance, isolated or ssim)
+        :param tolerance: tolerance of the comparison mode
         :returns: percentage of pixels that are different between both images
         """
-        # Create a mask with differences
-        mask = ImageChops.difference(image, baseline).convert('L').point(lambda x: 255 if x else 0)
+        diff_image, diff_pixels_percentage = VisualTest.get_differences_image(image, baseline, engine, comparison_mode,
+                                                                              tolerance)
+        diff_image.save(diff_path)
+        return diff_pixels_percentage
+
+    @staticmethod
+    def get_differences_image(image, baseline, engine='pil', comparison_mode='pixel', tolerance=None,
+                              strip_height=None):
+        """Create an image showing differences between both images
+
+        :param image: image object
+        :param baseline: reference baseline image object with the same size
+        :param engine: engine used to calculate differences (numpy or pil), comparison modes other than pixel are
+                       always calculated with numpy
+        :param comparison_mode: comparison mode (pixel, tolerance, isolated or ssim)
+        :param tolerance: tolerance of the comparison mode
+        :param strip_height: height in pixels of the horizontal strips in which images are compared, to avoid
+                             intermediate arrays of the whole image size, or None to compare them at once. The
+                             differences image has always the whole image size
+        :returns: tuple with the differences image and the percentage of pixels that are different
+        """
+        width, height = baseline.size
+        strip_height = min(strip_height or height, height)
+        if strip_height == height:
+            diff_image, diff_pixels = VisualTest._get_strip_differences(image, baseline, engine, comparison_mode,
+                                                                        tolerance, 0, height)
+        else:
+            diff_image = Image.new('RGB', baseline.size)
+            diff_pixels = 0
+            for top in range(0, height, strip_height):
+                bottom = min(top + strip_height, height)
+                strip_diff_image, strip_diff_pixels = VisualTest._get_strip_differences(image, baseline, engine,
+                                                                                        comparison_mode, tolerance,
+                                                                                        top, bottom)
+                diff_image.paste(strip_diff_image, (0, top))
+                diff_pixels += strip_diff_pixels
+        return diff_image, diff_pixels / (width * height)
+
+    @staticmethod
+    def _get_strip_differences(image, baseline, engine, comparison_mode, tolerance, top, bottom):
+        """Calculate differences between a horizontal strip of both images
+
+        :param image: RGB image object
+        :param baseline: reference RGB baseline image object with the same size
+        :param engine: engine used to calculate differences (numpy or pil)
+        :param comparison_mode: comparison mode (pixel, tolerance, isolated or ssim)
+        :param tolerance: tolerance of the comparison mode
+        :param top: top row of the strip
+        :param bottom: bottom row of the strip, not included
+        :returns: tuple with the image showing differences in the strip and its number of different pixels
+        """
+        if numpy is None or (engine != 'numpy' and comparison_mode == 'pixel'):
+            # Baseline is copied, because pil engine modifies it
+            box = (0, top, baseline.width, bottom)
+            return VisualTest._get_differences_pil(image.crop(box), baseline.crop(box))
+
+        # Rows around the strip needed to calculate its mask as in the full image
+        margin = {'isolated': 1, 'ssim': 3}.get(comparison_mode, 0)
+        start, end = max(top - margin, 0), min(bottom + margin, baseline.height)
+        if (start, end) != (0, baseline.height):
+            box = (0, start, baseline.width, end)
+            image, baseline = image.crop(box), baseline.crop(box)
+        return VisualTest._get_differences_numpy(image, baseline, comparison_mode, tolerance,
+                                                 (top - start, bottom - start))
+
+    @staticmethod
+    def _get_differences_pil(image, baseline):
+        """Calculate differences between both images using pil operations
+
+        :param image: RGB image object
+        :param baseline: reference RGB baseline image object
+        :returns: tuple with the image showing differences and the number of different pixels
+        """
+        mask = VisualTest._get_differences_mask_pil(image, baseline)
         # Create a White base
         white_image = Image.new('RGB', baseline.size, (255, 255, 255))
         # Add baseline with 50% opacity
@@ -349,16 +892,262 @@ class VisualTest(object):
         # Add red points in different pixels
         red_image = Image.new('RGB', baseline.size, (255, 0, 0))
         white_image.paste(red_image, (0, 0), mask)
-        # Save file
-        white_image.save(diff_path)
 
-        # Count different pixels (black pixels in mask image are equal pixels)
-        equal_pixels = sum([1 for pixel in mask.getdata() if pixel == 0])
-        diff_pixels_percentage = 1 - equal_pixels / (baseline.width * baseline.height)
-        return diff_pixels_percentage
+        # Count different pixels (white pixels in mask image are different pixels)
+        diff_pixels = mask.histogram()[255]
+        return white_image, diff_pixels
+
+    @staticmethod
+    def _get_differences_numpy(image, baseline, comparison_mode='pixel', tolerance=None, rows=None):
+        """Calculate differences between both images using numpy array operations, getting the same result as pil
+        in pixel comparison mode
+
+        :param image: RGB image object
+        :param baseline: reference RGB baseline image object
+        :param comparison_mode: comparison mode (pixel, tolerance, isolated or ssim)
+        :param tolerance: tolerance of the comparison mode
+        :param rows: tuple with the first and the last (not included) rows of the differences image, or None to get
+                     all rows. Other rows are only used to calculate the comparison mode mask.
+        :returns: tuple with the image showing differences and the number of different pixels
+        """
+        image_array = numpy.asarray(image)
+        baseline_array = numpy.asarray(baseline)
+
+        mask = VisualTest._get_differences_mask_numpy(image_array, baseline_array, comparison_mode, tolerance)
+        if rows:
+            mask, baseline_array = mask[rows[0]:rows[1]], baseline_array[rows[0]:rows[1]]
+
+        # Add baseline with 50% opacity over a white base, rounding as pil alpha composition
+        blended = VisualTest._get_blend_table()[baseline_array]
+        # Add red points in different pixels
+        blended[mask] = (255, 0, 0)
+
+        diff_pixels = int(numpy.count_nonzero(mask))
+        return Image.fromarray(blended, 'RGB'), diff_pixels
+
+    @staticmethod
+    def _get_differences_mask_pil(image, baseline):
+        """Create a mask with differences between both images using pil operations
+
+        :param image: RGB image object
+        :param baseline: reference RGB baseline image object
+        :returns: L image object, with white pixels where images are different
+        """
+        return ImageChops.difference(image, baseline).convert('L').point(lambda x: 255 if x else 0)
+
+    @staticmethod
+    def _get_differences_mask_numpy(image_array, baseline_array, comparison_mode='pixel', tolerance=None):
+        """Create a mask with differences between both images using numpy array operations
+
+        - pixel: pixels whose difference is not zero, converted to luminance with the same ITU-R 601-2 formula used
+          by pil
+        - tolerance: pixels whose difference in any channel is greater than the tolerance (from 0 to 255)
+        - isolated: pixels that are different in pixel mode, ignoring pixels without any different neighbour
+        - ssim: pixels that are different in pixel mode and whose local structural similarity with the baseline is
+          less than the tolerance (from 0 to 1)
+
+        :param image_array: numpy array of a RGB image
+        :param baseline_array: numpy array of the reference RGB baseline image
+        :param comparison_mode: comparison mode (pixel, tolerance, isolated or ssim)
+        :param tolerance: tolerance of the comparison mode
+        :returns: boolean numpy array, True where images are different
+        """
+        difference = numpy.maximum(image_array, baseline_array)
+        difference -= numpy.minimum(image_array, baseline_array)
+        if comparison_mode == 'tolerance':
+            return difference.max(axis=2) > tolerance
+        luminance = (difference[..., 0] * numpy.uint32(19595) + difference[..., 1] * numpy.uint32(38470)
+                     + difference[..., 2] * numpy.uint32(7471))
+        mask = luminance >= 0x8000
+        if comparison_mode == 'isolated':
+            return mask & VisualTest._get_neighbours_mask(mask)
+        if comparison_mode == 'ssim':
+            return mask & (VisualTest._get_ssim_map(image_array, baseline_array) < tolerance)
+        return mask
+
+    @staticmethod
+    def _get_neighbours_mask(mask):
+        """Get pixels that have any of their eight neighbours enabled in a mask
+
+        :param mask: boolean numpy array
+        :returns: boolean numpy array, True where any neighbour is True in the mask
+        """
+        height, width = mask.shape
+        padded = numpy.pad(mask, 1)
+        neighbours = numpy.zeros_like(mask)
+        for y in range(3):
+            for x in range(3):
+                if (y, x) != (1, 1):
+                    neighbours |= padded[y:y + height, x:x + width]
+        return neighbours
+
+    @staticmethod
+    def _get_ssim_map(image_array, baseline_array, window_size=7):
+        """Calculate the local structural similarity (SSIM) of each pixel, comparing luminance of both images in a
+        square window around it
+
+        :param image_array: numpy array of a RGB image
+        :param baseline_array: numpy array of the reference RGB baseline image
+        :param window_size: odd size in pixels of the window
+        :returns: float numpy array, with values from -1 to 1, where 1 means equal windows
+        """
+        weights = numpy.array([0.299, 0.587, 0.114])
+        image_luminance = image_array @ weights
+        baseline_luminance = baseline_array @ weights
+        image_mean = VisualTest._box_filter(image_luminance, window_size)
+        baseline_mean = VisualTest._box_filter(baseline_luminance, window_size)
+        image_variance = VisualTest._box_filter(image_luminance * image_luminance, window_size) - image_mean ** 2
+        baseline_variance = (VisualTest._box_filter(baseline_luminance * baseline_luminance, window_size)
+                             - baseline_mean ** 2)
+        covariance = (VisualTest._box_filter(image_luminance * baseline_luminance, window_size)
+                      - image_mean * baseline_mean)
+        c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+        return (((2 * image_mean * baseline_mean + c1) * (2 * covariance + c2))
+                / ((image_mean ** 2 + baseline_mean ** 2 + c1) * (image_variance + baseline_variance + c2)))
+
+    @staticmethod
+    def _box_filter(array, window_size):
+        """Calculate the mean of a square window around each value using a summed-area table
+
+        :param array: 2D float numpy array
+        :param window_size: odd size of the window
+        :returns: 2D float numpy array with the same shape
+        """
+        padded = numpy.pad(array, window_size // 2, mode='edge')
+        summed_area = numpy.pad(padded.cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+        window_sum = (summed_area[window_size:, window_size:] - summed_area[:-window_size, window_size:]
+                      - summed_area[window_size:, :-window_size] + summed_area[:-window_size, :-window_size])
+        return window_sum / (window_size * window_size)
+
+    @staticmethod
+    def is_under_threshold(image, baseline, threshold, engine='pil', tile_height=256, comparison_mode='pixel',
+                           tolerance=None):
+        """Check if the percentage of different pixels is less than or equal to the threshold, comparing both images
+        in horizontal tiles and stopping as soon as the result is known, without creating the differences image
+
+        :param image: RGB image object
+        :param baseline: reference RGB baseline image object with the same size
+        :param threshold: percentage threshold
+        :param engine: engine used to calculate differences (numpy or pil)
+        :param tile_height: height in pixels of each tile
+        :param comparison_mode: comparison mode (pixel, tolerance, isolated or ssim)
+        :param tolerance: tolerance of the comparison mode
+        :returns: True if the percentage of different pixels is not greater than the threshold
+        """
+        width, height = baseline.size
+        total_pixels = width * height
+        count_differences = VisualTest._get_tile_differences_counter(image, baseline, engine, comparison_mode,
+                                                                     tolerance)
+        diff_pixels = 0
+        for top in range(0, height, tile_height):
+            bottom = min(top + tile_height, height)
+            diff_pixels += count_differences(top, bottom)
+            if diff_pixels / total_pixels > threshold:
+                # Certain to fail, although remaining tiles were equal
+                return False
+            if (diff_pixels + (height - bottom) * width) / total_pixels <= threshold:
+                # Certain to pass, although remaining tiles were different
+                return True
+        return True
+
+    @staticmethod
+    def _get_tile_differences_counter(image, baseline, engine='pil', comparison_mode='pixel', tolerance=None):
+        """Get a function that counts different pixels in a horizontal tile of both images
+
+        :param image: RGB image object
+        :param baseline: reference RGB baseline image object with the same size
+        :param engine: engine used to calculate differences (numpy or pil)
+        :param comparison_mode: comparison mode (pixel, tolerance, isolated or ssim)
+        :param tolerance: tolerance of the comparison mode
+        :returns: function that receives top and bottom rows of the tile and returns its number of different pixels
+        """
+        if numpy is None or (engine != 'numpy' and comparison_mode == 'pixel'):
+            def count_differences_pil(top, bottom):
+                box = (0, top, baseline.width, bottom)
+                return VisualTest._get_differences_mask_pil(image.crop(box), baseline.crop(box)).histogram()[255]
+            return count_differences_pil
+
+        image_array = numpy.asarray(image)
+        baseline_array = numpy.asarray(baseline)
+        # Rows around the tile needed to calculate its mask as in the full image
+        margin = {'isolated': 1, 'ssim': 3}.get(comparison_mode, 0)
+
+        def count_differences_numpy(top, bottom):
+            start = max(top - margin, 0)
+            mask = VisualTest._get_differences_mask_numpy(image_array[start:bottom + margin],
+                                                          baseline_array[start:bottom + margin], comparison_mode,
+                                                          tolerance)
+            return int(numpy.count_nonzero(mask[top - start:bottom - start]))
+        return count_differences_numpy
+
+    @staticmethod
+    def _get_blend_table():
+        """Get lookup table to blend a 50% opacity pixel value over a white base
 
-    def _add_result_to_report(self, result, report_name, image_path, baseline_path, diff_path, message):
-        """Add the result of a visual test to the html report
+        :returns: numpy array with the blended value of each channel value
+        """
+        blended = numpy.arange(256, dtype=numpy.uint32) * 127 + 255 * 128 + 128
+        return (((blended >> 8) + blended) >> 8).astype(numpy.uint8)
+
+    @staticmethod
+    def get_differences_regions(diff_image, block_size=16):
+        """Cluster different pixels, highlighted in red in a differences image, in connected regions
+
+        Pixels are grouped in square blocks and adjacent blocks with different pixels, including diagonals, are labeled
+        as the same region. Labels are propagated with array operations over the blocks grid.
+
+        :param diff_image: image object with highlighted differences
+        :param block_size: size in pixels of the blocks
+        :returns: list of dicts with the bounding box (x0, y0, x1, y1), with exclusive end coordinates, and the number
+                  of different pixels of each region, sorted by number of pixels in descending order
+        """
+        mask = numpy.all(numpy.asarray(diff_image.convert('RGB')) == (255, 0, 0), axis=2)
+        height, width = mask.shape
+        grid_height, grid_width = -(-height // block_size), -(-width // block_size)
+        padded_mask = numpy.zeros((grid_height * block_size, grid_width * block_size), dtype=bool)
+        padded_mask[:height, :width] = mask
+        blocks = padded_mask.reshape(grid_height, block_size, grid_width, block_size)
+        block_pixels = blocks.sum(axis=(1, 3))
+        active = block_pixels > 0
+        if not active.any():
+            return []
+
+        # Label adjacent blocks, propagating the maximum block label until labels do not change
+        labels = numpy.where(active, numpy.arange(1, active.size + 1).reshape(active.shape), 0)
+        while True:
+            padded_labels = numpy.pad(labels, 1)
+            neighbours = numpy.max([padded_labels[y:y + grid_height, x:x + grid_width]
+                                    for y in range(3) for x in range(3)], axis=0)
+            new_labels = numpy.where(active, neighbours, 0)
+            if numpy.array_equal(new_labels, labels):
+                break
+            labels = new_labels
+
+        # Bounding box of different pixels in each block
+        rows = blocks.any(axis=3)
+        columns = blocks.any(axis=1)
+        grid_y, grid_x = numpy.nonzero(active)
+        top = grid_y * block_size + rows.argmax(axis=1)[grid_y, grid_x]
+        bottom = (grid_y + 1) * block_size - rows[:, ::-1, :].argmax(axis=1)[grid_y, grid_x]
+        left = grid_x * block_size + columns.argmax(axis=2)[grid_y, grid_x]
+        right = (grid_x + 1) * block_size - columns[:, :, ::-1].argmax(axis=2)[grid_y, grid_x]
+
+        # Join blocks of each region
+        region_labels, region_index = numpy.unique(labels[grid_y, grid_x], return_inverse=True)
+        region_count = len(region_labels)
+        pixels = numpy.bincount(region_index, weights=block_pixels[grid_y, grid_x], minlength=region_count)
+        boxes = numpy.array([[width, height, 0, 0]] * region_count)
+        numpy.minimum.at(boxes[:, 0], region_index, left)
+        numpy.minimum.at(boxes[:, 1], region_index, top)
+        numpy.maximum.at(boxes[:, 2], region_index, right)
+        numpy.maximum.at(boxes[:, 3], region_index, bottom)
+        regions = [{'box': [int(coordinate) for coordinate in box], 'pixels': int(region_pixels)}
+                   for box, region_pixels in zip(boxes, pixels)]
+        return sorted(regions, key=lambda region: (-region['pixels'], region['box'][1], region['box'][0]))
+
+    def _add_result_to_report(self, result, report_name, image_path, baseline_path, diff_path, message,
+                              regions=None):
+        """Add the result of a visual test to the visual results records, that will be rendered in the html report
 
         :param result: comparation result (equal, diff, baseline)
         :param report_name: name to show in html report
@@ -366,47 +1155,157 @@ class VisualTest(object):
         :param baseline_path: baseline image file path
         :param diff_path: differences image file path
         :param message: error message
+        :param regions: list of differences regions
         """
-        self.results[result] += 1
         output_baseline_path = None
         if baseline_path is not None:
             output_baseline_path = os.path.join(self.output_directory, os.path.basename(baseline_path))
-            shutil.copyfile(baseline_path, output_baseline_path)
-        row = self._get_html_row(result, report_name, image_path, output_baseline_path, diff_path, message)
-        self._add_data_to_report_before_tag(row, '</tbody>')
-        self._update_report_summary()
+            self.baseline_store.copy(baseline_path, output_baseline_path)
+        row = self._get_html_row(result, report_name, image_path, output_baseline_path, diff_path, message, regions)
+        if self.thumbnail_width > 0:
+            thumbnails = [region['thumbnail'] for region in regions or [] if 'thumbnail' in region]
+            self._submit_thumbnails([output_baseline_path, image_path] + ([] if thumbnails else [diff_path]))
+        record = {'type': 'result', 'result': result, 'row': row, 'time': time.time(), 'name': report_name,
+                  'image': os.path.basename(image_path)}
+        if baseline_path is not None:
+            # Original baseline filename, that can not be recovered from the image filename
+            record['baseline'] = os.path.basename(baseline_path)
+        if regions:
+            record['regions'] = [{'box': region['box'], 'pixels': region['pixels']} for region in regions]
+        with self.report_lock:
+            self.results[result] += 1
+            self._add_record_to_report(record)
+            render_interval = float(self.driver_wrapper.config.get_optional('VisualTests', 'report_render_interval')
+                                    or 0)
+            if 0 < render_interval <= time.time() - VisualTest.last_render_time:
+                self.render_report(self.output_directory)
+
+    def _submit_thumbnails(self, image_paths):
+        """Generate in a background thread the thumbnails of the images shown in the html report
+
+        :param image_paths: list of image file paths, None values are ignored
+        """
+        if VisualTest.thumbnails_executor is None:
+            VisualTest.thumbnails_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='visual_thumbnails')
+        for image_path in image_paths:
+            if image_path:
+                future = VisualTest.thumbnails_executor.submit(self.save_thumbnail, image_path,
+                                                               self._get_thumbnail_path(image_path))
+                VisualTest.pending_thumbnails.append(future)
 
-    def _add_data_to_report_before_tag(self, data, tag):
-        """Add data to visual report before tag
+    def save_thumbnail(self, image_path, thumbnail_path):
+        """Save a thumbnail of an image, reduced to the configured thumbnail width and keeping its aspect ratio
 
-        :param data: data to be added
-        :param tag: data will be added before this tag
+        :param image_path: image file path
+        :param thumbnail_path: thumbnail file path
         """
-        with open(os.path.join(self.output_directory, self.report_name), "r+") as f:
-            report = f.read()
-            index = report.find(tag)
-            report = report[:index] + data + report[index:]
-            f.seek(0)
-            f.write(report)
+        try:
+            with Image.open(image_path) as img:
+                img.thumbnail((self.thumbnail_width, img.height))
+                makedirs_safe(os.path.dirname(thumbnail_path))
+                # Replace the thumbnail atomically, so it is never read half written
+                temp_thumbnail_path = f'{thumbnail_path}.{threading.get_ident()}.tmp'
+                img.save(temp_thumbnail_path, 'PNG', compress_level=1)
+                os.replace(temp_thumbnail_path, thumbnail_path)
+        except OSError as exc:
+            self.logger.warning("Thumbnail of visual image '%s' could not be generated: %s", image_path, exc)
+
+    def _get_thumbnail_path(self, image_path):
+        """Get the path of the thumbnail of an image shown in the html report
+
+        :param image_path: image file path
+        :returns: thumbnail file path
+        """
+        return os.path.join(self.output_directory, 'thumbnails', os.path.basename(image_path))
+
+    def _add_record_to_report(self, record):
+        """Append a record to the visual results records file of the current process
+
+        :param record: dict with the record data
+        """
+        with open(os.path.join(self.output_directory, self.get_records_name()), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+
+    @classmethod
+    def get_records_name(cls):
+        """Get the name of the records file of the current process. Each pytest-xdist worker saves its records in its
+        own shard file, to avoid mixing lines written by several processes, and all shards are merged when the html
+        report is rendered
+
+        :returns: records file name
+        """
+        worker = os.environ.get('PYTEST_XDIST_WORKER')
+        if not worker:
+            return cls.records_name
+        records_base, records_extension = os.path.splitext(cls.records_name)
+        return f'{records_base}.{get_valid_filename(worker)}{records_extension}'
+
+    def _add_summary_to_report(self):
+        """Add visual data summary to the visual results records and render the empty html report"""
+        self._add_record_to_report({'type': 'summary',
+                                    'execution_date': datetime.datetime.now().strftime('%d/%m/%Y %H:%M:%S'),
+                                    'baseline_name': path.basename(self.baseline_directory)})
+        self.render_report(self.output_directory)
 
-    def _update_report_summary(self):
-        """Update asserts counter in report"""
-        new_results = 'Visual asserts</b>: {} ({} failed)'.format(sum(self.results.values()), self.results['diff'])
-        with open(os.path.join(self.output_directory, self.report_name), "r+") as f:
+    @classmethod
+    def render_report(cls, output_directory=None):
+        """Render the html report with all visual results records saved until now
+
+        :param output_directory: visual output directory, by default the current visual output directory
+        """
+        output_directory = output_directory if output_directory else DriverWrappersPool.visual_output_directory
+        records_base, records_extension = os.path.splitext(cls.records_name)
+        records_paths = sorted(glob.glob(os.path.join(glob.escape(output_directory), records_base + '*' +
+                                                      records_extension))) if output_directory else []
+        if not records_paths:
+            return
+
+        summary_record = {}
+        shards = []
+        for records_path in records_paths:
+            with open(records_path, encoding='utf-8') as f:
+                records = [json.loads(line) for line in f]
+            summary_record = summary_record or next((record for record in records if record['type'] == 'summary'), {})
+            shards.append([record for record in records if record['type'] == 'result'])
+
+        # Records of all shards are merged in the order they were saved
+        rows = []
+        results = {'equal': 0, 'diff': 0, 'baseline': 0}
+        for record in heapq.merge(*shards, key=lambda record: record.get('time', 0)):
+            results[record['result']] += 1
+            rows.append(record['row'])
+
+        summary = '<p><b>Execution date</b>: {}</p>'.format(summary_record.get('execution_date'))
+        summary += '<p><b>Baseline name</b>: {}</p>'.format(summary_record.get('baseline_name'))
+        summary += '<p><b>Visual asserts</b>: {} ({} failed)</p>'.format(sum(results.values()), results['diff'])
+
+        template_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'resources', cls.template_name)
+        with open(template_path, encoding='utf-8') as f:
             report = f.read()
-            report = re.sub(r'Visual asserts</b>: [0-9]* \([0-9]* failed\)', new_results, report)
-            f.seek(0)
+        report = cls._add_data_before_tag(report, summary, '</div>')
+        report = cls._add_data_before_tag(report, ''.join(rows), '</tbody>')
+
+        # Replace the report atomically, so it is never read half written
+        report_path = os.path.join(output_directory, cls.report_name)
+        temp_report_path = f'{report_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_report_path, 'w', encoding='utf-8') as f:
             f.write(report)
+        os.replace(temp_report_path, report_path)
+        VisualTest.last_render_time = time.time()
 
-    def _add_summary_to_report(self):
-        """Add visual data summary to the html report"""
-        summary = '<p><b>Execution date</b>: {}</p>'.format(datetime.datetime.now().strftime('%d/%m/%Y %H:%M:%S'))
-        summary += '<p><b>Baseline name</b>: {}</p>'.format(path.basename(self.baseline_directory))
-        summary += '<p><b>Visual asserts</b>: {} ({} failed)</p>'.format(sum(self.results.values()),
-                                                                         self.results['diff'])
-        self._add_data_to_report_before_tag(summary, '</div>')
-
-    def _get_html_row(self, result, report_name, image_path, baseline_path, diff_path, message):
+    @staticmethod
+    def _add_data_before_tag(report, data, tag):
+        """Add data to visual report before the first occurrence of a tag
+
+        :param report: report content
+        :param data: data to be added
+        :param tag: data will be added before this tag
+        :returns: report content with the new data
+        """
+        index = report.find(tag)
+        return report[:index] + data + report[index:]
+
+    def _get_html_row(self, result, report_name, image_path, baseline_path, diff_path, message, regions=None):
         """Create the html row with the result of a visual test
 
         :param result: comparation result (equal, diff, baseline)
@@ -415,6 +1314,7 @@ class VisualTest(object):
         :param baseline_path: baseline image file path
         :param diff_path: differences image file path
         :param message: error message
+        :param regions: list of differences regions, whose thumbnails are shown instead of the differences image
         :returns: str with the html row
         """
         row = '<tr class=' + result + '>'
@@ -430,32 +1330,52 @@ class VisualTest(object):
 
         # Create diff column
         message = '' if message is None else message
-        diff_col = self._get_img_element(diff_path, message) if diff_path and os.path.exists(diff_path) else message
+        if diff_path and os.path.exists(diff_path):
+            thumbnails = [region['thumbnail'] for region in regions or [] if 'thumbnail' in region]
+            diff_col = (''.join(self._get_img_element(thumbnail, message, diff_path) for thumbnail in thumbnails)
+                        or self._get_img_element(diff_path, message))
+        else:
+            diff_col = message
 
         row += '<td>' + diff_col + '</td>'
         row += '</tr>'
         return row
 
-    def _get_img_element(self, image_path, image_title):
+    def _get_img_element(self, image_path, image_title, full_image_path=None):
         """Create an img html element
 
         :param image_path: image file path
         :param image_title: image title
+        :param full_image_path: file path of the full image shown when a thumbnail is clicked, None if image is not a
+                                thumbnail
         :returns: str with the img element
         """
         img_element = ''
         if image_path:
+            image_class = ' class="thumbnail"' if full_image_path else ''
+            if not full_image_path and self.thumbnail_width > 0:
+                # Original image is only loaded when the thumbnail is clicked
+                image_path, full_image_path = self._get_thumbnail_path(image_path), image_path
             image_relative_path = path.relpath(image_path, self.output_directory).replace('\\', '/')
-            img_element = f'<img src="{image_relative_path}" title="{image_title}"/>'
+            img_element = f'<img{image_class} src="{image_relative_path}" title="{image_title}"'
+            if full_image_path:
+                full_image_relative_path = path.relpath(full_image_path, self.output_directory).replace('\\', '/')
+                img_element += f' data-full-src="{full_image_relative_path}"'
+            img_element += ' loading="lazy"/>'
         return img_element
 
     @staticmethod
-    def update_latest_report():
+    def update_latest_report(output_directory=None):
         """
-        Duplicate current visual testing report into latest folder
+        Point latest folder to current visual testing report with a symbolic link, or synchronize it with hard links
+        to current report files if symbolic links are not supported
+
+        :param output_directory: visual output directory, by default the current visual output directory
         """
-        if os.path.exists(DriverWrappersPool.visual_output_directory):
-            latest_directory = os.path.join(os.path.dirname(DriverWrappersPool.visual_output_directory), 'latest')
-            if os.path.exists(latest_directory):
-                shutil.rmtree(latest_directory)
-            shutil.copytree(DriverWrappersPool.visual_output_directory, latest_directory)
+        output_directory = output_directory if output_directory else DriverWrappersPool.visual_output_directory
+        if output_directory and os.path.exists(output_directory):
+            latest_directory = os.path.join(os.path.dirname(output_directory), 'latest')
+            try:
+                link_directory(output_directory, latest_directory)
+            except OSError:
+                sync_directory(output_directory, latest_directory)